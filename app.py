@@ -4,39 +4,48 @@ import json
 import time
 import datetime
 import random
-import requests
-from collections import defaultdict
+from collections import deque
 import logging
 import subprocess
 import hashlib
 import base64
 import threading
+import socket
+import queue
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
-from flask import Flask, render_template, redirect, url_for, session, request, jsonify, Response, make_response
-import google.oauth2.credentials
-import google_auth_oauthlib.flow
-import googleapiclient.discovery
-
-# Disable cache warning
-import googleapiclient.discovery_cache
-googleapiclient.discovery_cache.LOGGER.setLevel(logging.ERROR)
+from flask import Flask, render_template, redirect, url_for, session, request, jsonify, Response, make_response, send_file
+from werkzeug.serving import is_running_from_reloader
 
 # Disable werkzeug normal HTTP request logging
 werkzeug_logger = logging.getLogger('werkzeug')
 werkzeug_logger.setLevel(logging.WARNING)  # Show only WARNING and higher level messages
 
-# Configure media display logger
+from config import Config
+from media_log import MediaDisplayLog
+
+# Configure media display logger; records go through a queue and are written in batches
 media_logger = logging.getLogger('media_display')
 media_logger.setLevel(logging.INFO)
-
-# Create file handler for media display logger
-media_handler = logging.FileHandler('media_display.log')
-media_handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s', '%Y.%m.%d %H:%M:%S'))
-media_logger.addHandler(media_handler)
-
-import broadlink
-from config import Config
+media_display_log = MediaDisplayLog(Config, 'media_display.log')
+media_display_log.attach(media_logger, logging.Formatter('%(asctime)s [%(levelname)s] %(message)s', '%Y.%m.%d %H:%M:%S'))
 from temp_monitor import TemperatureMonitor
+from media_index import MediaIndex, MEDIA_TYPE_SETTINGS, media_type_setting
+from play_history import PlayHistory
+from photo_prefetch import PhotoPrefetcher
+from media_cache import MediaCache
+from video_cache import VideoCache
+from media_sizing import photo_box, fit_size, parse_variant, size_variant, clamp_side, snap_side
+from google_services import ServiceRegistry
+from quota import QuotaGovernor, QuotaExceeded
+from credentials import CredentialManager
+from warm_start import WarmStart
+from calendar_sync import CalendarSync, GridVersions
+from weather import WeatherService
+from sensors import SensorPoller
+from discord_poller import DiscordPoller
+from event_bus import EventBus
+import metrics
 
 # Add zoneinfo (works from Python 3.9). If you don't have it, use pytz.
 from zoneinfo import ZoneInfo
@@ -46,6 +55,9 @@ os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 app = Flask(__name__, static_folder='static')
 app.secret_key = "something_secret"
 
+# Time every request and template render for /metrics
+metrics.instrument(app)
+
 # Disable werkzeug normal HTTP request logging
 werkzeug_logger = logging.getLogger('werkzeug')
 werkzeug_logger.setLevel(logging.WARNING)  # Show only WARNING and higher level messages
@@ -55,12 +67,54 @@ SCOPES = [
     'https://www.googleapis.com/auth/calendar.readonly'
 ]
 
+TOKEN_FILE = 'token.json'
 ALBUMS_CACHE_FILE = 'albums_cache.json'
+MEDIA_INDEX_FILE = 'media_index.db'
+PLAY_HISTORY_FILE = 'play_history.db'
+MEDIA_CACHE_DIR = 'media_cache'
+VIDEO_CACHE_DIR = 'video_cache'
+DISCOVERY_DIR = 'discovery'
+WEATHER_CACHE_FILE = 'weather_cache.json'
+WARM_START_FILE = 'warm_start.json'
 CACHE_EXPIRATION = 30 * 24 * 3600  # 30 days (was 7)
+PHOTOS_DISCOVERY_URL = 'https://photoslibrary.googleapis.com/$discovery/rest?version=v1'
+
+# Typed update events pushed to the front end over /stream
+event_bus = EventBus()
+
+# Initialize the warm start snapshot, served while live sources catch up after a restart
+warm_start = WarmStart(Config, WARM_START_FILE)
+
+# Initialize OAuth credentials shared by all routes and workers, refreshed ahead of expiry
+credential_manager = CredentialManager(Config, TOKEN_FILE)
+
+# Shared request budget for the Google Photos and Calendar APIs
+api_quota = QuotaGovernor(Config)
+
+# Google API clients shared by all requests and workers
+google_services = ServiceRegistry(Config, DISCOVERY_DIR, api_quota)
 
 # Initialize temperature monitoring
 temp_monitor = TemperatureMonitor(Config)
 
+# Initialize local media catalog
+media_index = MediaIndex(Config, MEDIA_INDEX_FILE)
+
+# Initialize play history, steering picks toward least recently shown albums
+play_history = PlayHistory(Config, PLAY_HISTORY_FILE)
+
+# Initialize weather refresh, falling back to the last snapshot on disk
+weather_service = WeatherService(Config, WEATHER_CACHE_FILE)
+
+# Initialize Broadlink sensor polling
+sensor_poller = SensorPoller(Config)
+
+# Initialize local image cache
+media_cache = MediaCache(Config, MEDIA_CACHE_DIR)
+
+# Initialize local video cache, transcoded ahead of display when ffmpeg is installed
+video_cache = VideoCache(Config, VIDEO_CACHE_DIR)
+
 def load_album_cache():
     try:
         with open(ALBUMS_CACHE_FILE, 'r') as f:
@@ -101,97 +155,219 @@ def get_all_albums(photos_service):
     save_album_cache(albums)
     return albums
 
-def get_all_media_items(photos_service, album_id):
-    items = []
-    next_page_token = None
-    while True:
-        resp = photos_service.mediaItems().search(
-            body={'albumId': album_id, 'pageSize': 100, 'pageToken': next_page_token}
-        ).execute()
-        found_items = resp.get('mediaItems', [])
-        items.extend(found_items)
-        next_page_token = resp.get('nextPageToken')
-        if not next_page_token:
-            break
-    return items
+def build_photos_service(creds):
+    return google_services.get('photoslibrary', 'v1', creds, discovery_url=PHOTOS_DISCOVERY_URL)
+
+def build_calendar_service(creds):
+    return google_services.get('calendar', 'v3', creds)
+
+def background_photos_service():
+    """Photos service for background workers, None until the app is authorized
+    or while the API budget is low"""
+    if api_quota.low('photoslibrary'):
+        return None
+    creds = load_stored_credentials()
+    if creds is None:
+        return None
+    return build_photos_service(creds)
+
+def resolve_media_base_url(item_id):
+    """Fetches a fresh baseUrl for a media item whose cached one expired"""
+    photos_service = background_photos_service()
+    if photos_service is None:
+        return None
+    resp = photos_service.mediaItems().batchGet(mediaItemIds=[item_id]).execute()
+    for result in resp.get('mediaItemResults', []):
+        media_item = result.get('mediaItem')
+        if media_item:
+            return media_item.get('baseUrl')
+    return None
+
+def fresh_media_base_url(item_id):
+    """Returns a baseUrl that has not expired, resolving a new one if needed"""
+    base_url = media_cache.base_url(item_id)
+    if not base_url:
+        base_url = resolve_media_base_url(item_id)
+        if base_url:
+            media_cache.remember(item_id, base_url)
+    return base_url
+
+# Last screen (width, height, devicePixelRatio) the front end reported
+last_screen = None
+
+def request_screen():
+    """Returns the screen the front end reported with ?sw=&sh=&dpr= or the kiosk_screen cookie"""
+    global last_screen
+    try:
+        if 'sw' in request.args:
+            screen = (int(request.args['sw']), int(request.args['sh']), float(request.args.get('dpr', 1)))
+        elif request.cookies.get('kiosk_screen'):
+            width, height, dpr = request.cookies['kiosk_screen'].split('x')
+            screen = (int(width), int(height), float(dpr))
+        else:
+            return last_screen
+    except (KeyError, ValueError):
+        return last_screen
+    if screen[0] > 0 and screen[1] > 0 and 0 < screen[2] <= 8:
+        last_screen = screen
+    return last_screen
+
+def current_photo_box(screen):
+    """Device pixel box of the photo area, scaled down while the kiosk runs hot"""
+    if screen:
+        box = photo_box(Config.PHOTO_CONTAINER, *screen, step=Config.MEDIA_SIZE_STEP)
+    else:
+        box = parse_variant(Config.MEDIA_CACHE_VARIANT)
+    scale = temp_monitor.thermal_level()['IMAGE_SCALE']
+    return clamp_side(box[0] * scale), clamp_side(box[1] * scale)
+
+def size_media_urls(batch, box):
+    """Points photos at /media, sized to fill the box in their own orientation,
+    and videos at /video"""
+    for item in batch:
+        if item.get('cached'):
+            # Only the size that is on disk can be served without the API
+            continue
+        if item.get('mediaType') == 'photo' and item.get('id'):
+            width, height = fit_size(item.get('width'), item.get('height'), *box, step=Config.MEDIA_SIZE_STEP)
+            item['url'] = f"/media/{item['id']}?w={width}&h={height}"
+        elif item.get('mediaType') == 'video' and item.get('id'):
+            item['url'] = f"/video/{item['id']}"
+    return batch
+
+def attach_media_urls(batch):
+    """Points media at the local routes, remembers their baseUrls and queues videos for transcoding"""
+    for item in batch:
+        media_cache.remember(item['id'], item['baseUrl'])
+        if item.get('mediaType') == 'video':
+            video_cache.enqueue(item['id'])
+    return size_media_urls(batch, current_photo_box(last_screen))
+
+def index_unindexed_album(photos_service):
+    """Indexes albums not yet in the catalog until one has matching media.
+
+    Used right after installation, before the background refresh has caught up.
+    """
+    albums = media_index.unindexed_albums()
+    random.shuffle(albums)
+    for album_attempt, album in enumerate(albums):
+        album_title = album.get('title', 'Unknown Album')
+        app.logger.info(f"Indexing album: {album_title} (attempt {album_attempt+1}/{len(albums)})")
+        if not media_index.refresh_album(photos_service, album):
+            continue
+        batch, album_title = media_index.pick_batch(
+            Config.MEDIA_TYPES, Config.PHOTO_BATCH_COUNT, album_id=album['id'],
+            start_picker=play_history.pick_start)
+        if batch:
+            return batch, album_title
+        app.logger.info(f"Album {album_title} has no matching items of type {Config.MEDIA_TYPES}, skipping")
+    return [], None
+
+def pick_fresh_batch():
+    """Picks a batch from an album weighted toward the least recently shown ones"""
+    # Eligible albums for every MEDIA_TYPES setting come from the album summaries,
+    # so a thermal switch to photos only picks from another pool
+    play_history.sync_albums(media_index.version, lambda: {
+        setting: media_index.album_ids(setting) for setting in MEDIA_TYPE_SETTINGS
+    })
+    return media_index.pick_batch(Config.MEDIA_TYPES, Config.PHOTO_BATCH_COUNT,
+                                  album_id=play_history.pick_album(media_type_setting(Config.MEDIA_TYPES)),
+                                  start_picker=play_history.pick_start)
+
+def record_batch_served(batch, album_title):
+    """Counts a batch handed to the front end as a show of its album
+    and keeps it for the warm start snapshot"""
+    if batch and 'error' not in batch[0] and batch[0].get('albumId'):
+        play_history.record([(None, batch[0]['albumId'], time.time())])
+        warm_start.update('batch', {'photos': batch, 'album_title': album_title})
+
+def point_to_cached(batch, cached):
+    """Points photos at the size they are cached at; items not cached are dropped"""
+    result = []
+    for item in batch:
+        if item.get('mediaType') == 'photo' and item.get('id') in cached:
+            width, height = parse_variant(cached[item['id']])
+            item['url'] = f"/media/{item['id']}?w={width}&h={height}"
+        elif item.get('mediaType') == 'video' and video_cache.lookup(item.get('id')):
+            item['url'] = f"/video/{item['id']}"
+        else:
+            continue
+        item['cached'] = True
+        result.append(item)
+    return result
+
+def cached_photo_batch():
+    """A batch of photos that are already in the local cache, made without API calls"""
+    cached = media_cache.cached_variants()
+    albums = media_index.items_by_album(cached)
+    if not albums:
+        return [], None
+    album_title, items = albums[random.choice(list(albums))]
+    start_index = random.randint(0, len(items) - 1)
+    batch = point_to_cached([items[(start_index + i) % len(items)]
+                             for i in range(min(Config.PHOTO_BATCH_COUNT, len(items)))], cached)
+    if not batch:
+        return [], None
+    play_history.reserve(batch[0]['albumId'])
+    return batch, album_title
+
+def restored_photo_batch():
+    """The batch on screen before the restart, if its files are still cached"""
+    saved = warm_start.take_batch()
+    if not saved:
+        return None
+    batch = point_to_cached(saved['photos'], media_cache.cached_variants())
+    if not batch:
+        return None
+    app.logger.info(f"Showing {len(batch)} items from the warm start snapshot")
+    return batch, saved['album_title']
+
+def quota_fallback_batch(message):
+    """Cached photos when the API budget is exhausted, an error batch if there are none"""
+    batch, album_title = cached_photo_batch()
+    if batch:
+        app.logger.info(f"{message}, showing cached photos from {album_title}")
+        return batch, album_title
+    return [{"error": message, "mediaType": "error"}], "API Limit Error"
 
 def get_random_photo_batch(photos_service):
+    import googleapiclient.errors
+    # Keep what is left of the budget for when the cache runs dry
+    if api_quota.low('photoslibrary'):
+        batch, album_title = cached_photo_batch()
+        if batch:
+            app.logger.info(f"Photos API budget low, showing cached photos from {album_title}")
+            return batch, album_title
+
     try:
         albums = get_all_albums(photos_service)
         if not albums:
             app.logger.warning("No albums found.")
             return [{"error": "No albums found"}], "Error"
-        
-        # Shuffle albums in random order
-        random.shuffle(albums)
-        
-        # Try all albums until we find a suitable one
-        for album_attempt in range(len(albums)):
-            album = albums[album_attempt]
-            album_title = album.get('title', 'Unknown Album')
-            app.logger.info(f"Trying album: {album_title} (attempt {album_attempt+1}/{len(albums)})")
-            
-            try:
-                items = get_all_media_items(photos_service, album['id'])
-                if not items:
-                    app.logger.info(f"Album {album_title} has no items, skipping")
-                    continue
-
-                # Filter only those that have creationTime
-                items = [i for i in items if i.get('mediaMetadata', {}).get('creationTime')]
-                if not items:
-                    app.logger.info(f"Album {album_title} has no items with creationTime, skipping")
-                    continue
-
-                # Identify media types and filter according to MEDIA_TYPES setting
-                processed_items = []
-                for item in items:
-                    meta = item.get('mediaMetadata', {})
-                    # Determine media type and add additional metadata
-                    media_type = "photo"
-                    video_metadata = {}
-                    
-                    if 'video' in meta:
-                        media_type = "video"
-                        video_metadata = meta.get('video', {})
-                    
-                    # Filter by configured media type
-                    if Config.MEDIA_TYPES.lower() == "all" or Config.MEDIA_TYPES.lower() == media_type:
-                        processed_items.append({
-                            'baseUrl': item.get('baseUrl', ''),
-                            'photo_time': meta.get('creationTime', ''),
-                            'filename': item.get('filename', 'Unknown'),
-                            'mediaType': media_type,
-                            'videoMetadata': video_metadata,
-                            'mimeType': item.get('mimeType', '')
-                        })
-                
-                # If this album has suitable media, use it
-                if processed_items:
-                    app.logger.info(f"Album {album_title} has {len(processed_items)} matching items of type {Config.MEDIA_TYPES}")
-                    
-                    # Sort by creationTime
-                    processed_items.sort(key=lambda x: x['photo_time'])
-                    total = len(processed_items)
-                    start_index = random.randint(0, total - 1)
-                    batch = []
-                    
-                    # Collect batch
-                    count = min(Config.PHOTO_BATCH_COUNT, total)
-                    for i in range(count):
-                        idx = (start_index + i) % total
-                        batch.append(processed_items[idx])
+        media_index.sync_albums(albums)
 
+        try:
+            batch, album_title = pick_fresh_batch()
+            if not batch:
+                batch, album_title = index_unindexed_album(photos_service)
+
+            if batch:
+                # Only the chosen items need fresh baseUrls
+                batch = attach_media_urls(media_index.resolve_base_urls(photos_service, batch))
+                if batch:
+                    play_history.reserve(batch[0]['albumId'])
+                    app.logger.info(f"Album {album_title}: batch of {len(batch)} items of type {Config.MEDIA_TYPES}")
                     return batch, album_title
-                else:
-                    app.logger.info(f"Album {album_title} has no matching items of type {Config.MEDIA_TYPES}, skipping")
-            except googleapiclient.errors.HttpError as error:
-                app.logger.error(f"Error processing album {album_title}: {error}")
-                if error.resp.status == 429:
-                    # Quota exceeded - stop and return error message
-                    app.logger.warning("Google Photos API quota exceeded")
-                    return [{"error": "Google Photos API quota exceeded", "mediaType": "error"}], "API Limit Error"
-
+        except googleapiclient.errors.HttpError as error:
+            app.logger.error(f"Error getting photo batch: {error}")
+            if error.resp.status == 429:
+                # Quota exceeded - stop and show what is cached
+                app.logger.warning("Google Photos API quota exceeded")
+                return quota_fallback_batch("Google Photos API quota exceeded")
+            raise
+
+    except QuotaExceeded as e:
+        return quota_fallback_batch(str(e))
     except Exception as e:
         app.logger.error(f"Unexpected error in get_random_photo_batch: {e}")
         return [{"error": str(e), "mediaType": "error"}], "Error"
@@ -199,78 +375,76 @@ def get_random_photo_batch(photos_service):
     # If nothing found
     return [{"error": "No suitable media found", "mediaType": "error"}], "No Media"
 
-def parse_meteo_lt_time(dt_str):
-    fmts = ["%Y-%m-%dT%H:%M:%SZ", "%Y-%m-%d %H:%M:%S"]
-    for fmt in fmts:
-        try:
-            return datetime.datetime.strptime(dt_str, fmt)
-        except:
-            pass
-    raise ValueError(f"Bad time format: {dt_str}")
+def background_calendar_service():
+    """Calendar service for background workers, None until the app is authorized
+    or while the API budget is low; the calendar is then served from the store"""
+    if api_quota.low('calendar'):
+        return None
+    creds = load_stored_credentials()
+    if creds is None:
+        return None
+    return build_calendar_service(creds)
 
-def get_weather():
-    url = f"{Config.METEO_API_BASE_URL}/places/{Config.WEATHER['LOCATION']}/forecasts/long-term"
-    r = requests.get(url)
-    if r.status_code != 200:
+# Initialize calendar sync shared by index(), /calendarevents and /todayevents
+calendar_sync = CalendarSync(Config, background_calendar_service)
+
+# Initialize per-cell versions of the rendered calendar grid
+calendar_grid = GridVersions()
+
+def prefetch_photo_batch():
+    """Batch factory for the prefetch worker"""
+    photos_service = background_photos_service()
+    if photos_service is None:
         return None
-    data = r.json()
-    forecasts = data.get("forecastTimestamps", [])
-    by_date = {}
-    for entry in forecasts:
-        dt_obj = parse_meteo_lt_time(entry["forecastTimeUtc"])
-        date_str = dt_obj.strftime("%Y-%m-%d")
-        by_date.setdefault(date_str, []).append(entry)
-    daily_list = []
-    for date_str in sorted(by_date.keys()):
-        daily_entries = by_date[date_str]
-        if not daily_entries:
-            continue
-        min_temp, max_temp = None, None
-        best_condition, best_dt_obj = None, None
-        best_diff = 24
-        for f in daily_entries:
-            t = f["airTemperature"]
-            if min_temp is None or t < min_temp:
-                min_temp = t
-            if max_temp is None or t > max_temp:
-                max_temp = t
-            dt_obj = parse_meteo_lt_time(f["forecastTimeUtc"])
-            midday = dt_obj.replace(hour=12, minute=0, second=0, microsecond=0)
-            diff = abs((dt_obj - midday).total_seconds()) / 3600.0
-            if diff < best_diff:
-                best_diff = diff
-                best_condition = f["conditionCode"]
-                best_dt_obj = dt_obj
-        if not best_dt_obj:
-            f0 = daily_entries[0]
-            best_dt_obj = parse_meteo_lt_time(f0["forecastTimeUtc"])
-            best_condition = f0["conditionCode"]
-        daily_list.append({
-            "dt": int(best_dt_obj.timestamp()),
-            "main": {"temp_min": min_temp, "temp_max": max_temp},
-            "weather": [{"description": best_condition}]
-        })
-    daily_list = daily_list[:7]
-    return {"daily": daily_list}
+    batch, album_title = get_random_photo_batch(photos_service)
+    # Download the photos now so showing them costs no network
+    if batch and 'error' not in batch[0]:
+        box = current_photo_box(last_screen)
+        media_cache.warm(batch, lambda item: size_variant(
+            *fit_size(item.get('width'), item.get('height'), *box, step=Config.MEDIA_SIZE_STEP)))
+    return batch, album_title
+
+# Initialize background batch prefetching; flush when the temperature monitor changes MEDIA_TYPES
+photo_prefetcher = PhotoPrefetcher(Config, prefetch_photo_batch)
+temp_monitor.add_listener(lambda media_types: photo_prefetcher.flush(f"(MEDIA_TYPES is now {media_types})"))
+
+def apply_thermal_level(level):
+    """Scales background work to the thermal governor's level"""
+    photo_prefetcher.depth_limit = level['PREFETCH_DEPTH']
+    photo_prefetcher.wakeup.set()
+    sensor_poller.interval_factor = level['POLL_FACTOR']
+    # No transcoding while videos are not shown
+    video_cache.paused = not level['VIDEO']
+    video_cache.wakeup.set()
+
+temp_monitor.add_level_listener(apply_thermal_level)
+
+def ready_photo_batch():
+    """Returns a prefetched batch, or right after a restart the last one, without waiting"""
+    prefetched = photo_prefetcher.pop()
+    if prefetched:
+        return prefetched
+    # Right after a restart the last batch paints without waiting for the API
+    return restored_photo_batch()
+
+def next_photo_batch(photos_service):
+    """Returns a prefetched batch if one is ready, otherwise searches synchronously"""
+    ready = ready_photo_batch()
+    if ready:
+        return ready
+    app.logger.info("No prefetched batch ready, searching synchronously")
+    return get_random_photo_batch(photos_service)
+
+def get_weather():
+    return weather_service.get()
 
 def get_sensor_data():
     try:
-        # Get sensor data
-        sensor_data = {}
-        devices = broadlink.discover(timeout=Config.BROADLINK["DISCOVER_TIMEOUT"])
-        for d in devices:
-            if d.type.startswith(Config.BROADLINK["TARGET_TYPE_PREFIX"]):
-                d.auth()
-                sensor_data = d.check_sensors()
-                break
-        
-        # If there is no sensor data or there is an error, create an empty object
-        if not sensor_data or "error" in sensor_data:
-            sensor_data = {}
+        # Latest reading from the background poller
+        sensor_data = sensor_poller.latest()
         
         # Add CPU temperature
         cpu_temp = temp_monitor.get_cpu_temperature()
-        temp_status = temp_monitor.get_status()
         
         # Combine data
         result = {
@@ -278,10 +452,6 @@ def get_sensor_data():
             "humidity": sensor_data.get("humidity"),
             "cpu_temp": cpu_temp
         }
-        
-        # If there is no sensor data but there is CPU temperature, do not show error
-        if cpu_temp > 0 and ("error" in sensor_data or not sensor_data):
-            result.pop("error", None)
             
         # If there is an error from the sensor, keep it
         if "error" in sensor_data:
@@ -301,6 +471,9 @@ def get_event_color(summary):
     prefix = summary[:2].upper()
     return Config.EVENT_COLORS.get(prefix, Config.DEFAULT_EVENT_COLOR)
 
+# Initialize Discord polling
+discord_poller = DiscordPoller(Config, get_username_color)
+
 # Register event_color filter
 app.jinja_env.filters['event_color'] = get_event_color
 
@@ -317,48 +490,59 @@ def newsensors():
     data = get_sensor_data()
     return jsonify(data)
 
+@app.route('/sensorhistory')
+def sensorhistory():
+    """Returns sensor readings for trends, ?hours= limits the range"""
+    hours = request.args.get('hours', type=float)
+    return jsonify(sensor_poller.get_history(hours * 3600 if hours else None))
+
+@app.route('/temperaturehistory')
+def temperaturehistory():
+    """Returns CPU temperature min/max/avg buckets, ?hours= (max 24) and ?buckets= set the range"""
+    hours = min(max(request.args.get('hours', 24, type=float), 0.1), 24)
+    buckets = min(max(request.args.get('buckets', 96, type=int), 1), 1440)
+    return jsonify(temp_monitor.get_history(hours * 3600, buckets))
+
 @app.route('/discordmessages')
 def discord_messages():
-    # Get not only message content, but also embeds and attachments
-    params = {
-        "limit": Config.DISCORD['MESSAGE_COUNT']
-    }
-    url = f"{Config.DISCORD_API_BASE_URL}/channels/{Config.DISCORD['CHANNEL_ID']}/messages"
-    headers = {"Authorization": f"Bot {Config.DISCORD['BOT_TOKEN']}"}
-    
-    r = requests.get(url, headers=headers, params=params)
-    if r.status_code == 200:
-        messages = r.json()
-        for m in messages:
-            username = m['author']['username']
-            m['color'] = get_username_color(username)
-            
-            # Ensure images are not suppressed (Proxy URLs are not filtered)
-            if 'attachments' in m and m['attachments']:
-                for attachment in m['attachments']:
-                    if 'proxy_url' in attachment and not 'url' in attachment:
-                        attachment['url'] = attachment['proxy_url']
-            
-            # Ensure embed images are not suppressed
-            if 'embeds' in m and m['embeds']:
-                for embed in m['embeds']:
-                    if 'image' in embed and 'proxy_url' in embed['image'] and not 'url' in embed['image']:
-                        embed['image']['url'] = embed['image']['proxy_url']
-                    if 'thumbnail' in embed and 'proxy_url' in embed['thumbnail'] and not 'url' in embed['thumbnail']:
-                        embed['thumbnail']['url'] = embed['thumbnail']['proxy_url']
-                        
-        return jsonify(messages)
-    return jsonify({"error": "Unable to fetch messages"}), r.status_code
+    messages = discord_poller.get()
+    if messages is None:
+        return jsonify({"error": "Unable to fetch messages"}), 502
+    return jsonify(messages)
 
 def load_stored_credentials():
-    if os.path.exists("token.json"):
+    """Shared credentials, None until the app is authorized"""
+    return credential_manager.get()
+
+# Bounded pool for the sources index() renders
+index_executor = ThreadPoolExecutor(max_workers=Config.INDEX_WORKERS, thread_name_prefix='index')
+
+def timed_source(name, fn):
+    """Runs an index() source and logs how long it took, even if it missed its deadline"""
+    start = time.monotonic()
+    try:
+        return fn()
+    finally:
+        app.logger.info(f"index() source {name}: {(time.monotonic() - start) * 1000:.0f} ms")
+
+def gather_sources(sources):
+    """Runs sources concurrently, each with its own deadline from INDEX_DEADLINES.
+
+    Returns (results, errors); sources that missed the deadline are in neither.
+    """
+    started = time.monotonic()
+    futures = {name: index_executor.submit(timed_source, name, fn) for name, fn in sources.items()}
+    results, errors = {}, {}
+    for name, future in futures.items():
+        deadline = Config.INDEX_DEADLINES.get(name, 5)
         try:
-            with open("token.json", 'r') as token_file:
-                token_data = json.load(token_file)
-                return google.oauth2.credentials.Credentials(**token_data)
-        except:
-            pass
-    return None
+            results[name] = future.result(timeout=max(0, started + deadline - time.monotonic()))
+        except FutureTimeoutError:
+            app.logger.warning(f"index() source {name} missed its {deadline}s deadline, rendering placeholder")
+        except Exception as e:
+            app.logger.error(f"Error in index() source {name}: {e}")
+            errors[name] = e
+    return results, errors
 
 @app.route('/')
 def index():
@@ -370,64 +554,48 @@ def index():
     album_title = ""
     error_message = None
 
-    try:
-        photos_service = googleapiclient.discovery.build(
-            'photoslibrary', 'v1', credentials=creds,
-            discoveryServiceUrl='https://photoslibrary.googleapis.com/$discovery/rest?version=v1'
-        )
+    today = datetime.date.today()
+    tomorrow = today + datetime.timedelta(days=1)
 
-        photo_batch, album_title = get_random_photo_batch(photos_service)
+    def load_calendar():
+        calendar_sync.ensure_synced()
+        return calendar_sync.grid(today)
+
+    # Taken before the deadlines: a batch popped by a source that misses its
+    # deadline would be thrown away, so only the synchronous search runs late
+    ready = ready_photo_batch()
+
+    def load_photos():
+        if ready:
+            return ready
+        app.logger.info("No prefetched batch ready, searching synchronously")
+        return get_random_photo_batch(build_photos_service(creds))
+
+    # All sources run at once; whatever misses its deadline is filled in by the front end
+    results, errors = gather_sources({
+        'photos': load_photos,
+        'calendar': load_calendar,
+        'weather': get_weather
+    })
+
+    if 'photos' in errors:
+        photo_batch = [{"error": f"Failed to get photos: {str(errors['photos'])}", "mediaType": "error"}]
+        album_title = "Error"
+    elif results.get('photos'):
+        photo_batch, album_title = results['photos']
+        record_batch_served(photo_batch, album_title)
+        size_media_urls(photo_batch, current_photo_box(request_screen()))
         # Check if we have an error message
         if photo_batch and len(photo_batch) > 0 and 'error' in photo_batch[0]:
             error_message = photo_batch[0]['error']
-    except Exception as e:
-        app.logger.error(f"Error getting photos: {e}")
-        photo_batch = [{"error": f"Failed to get photos: {str(e)}", "mediaType": "error"}]
-        album_title = "Error"
 
-    cal_service = googleapiclient.discovery.build('calendar', 'v3', credentials=creds)
-    today = datetime.date.today()
-    tomorrow = today + datetime.timedelta(days=1)
+    if results.get('calendar'):
+        weeks, events_by_day = results['calendar']
+    else:
+        # Grid from whatever the store has, /calendarevents fills it in
+        weeks, events_by_day = calendar_sync.grid(today)
 
-    start_of_week = today - datetime.timedelta(days=today.weekday())
-    end_of_range = start_of_week + datetime.timedelta(days=(Config.WEEKS_TO_SHOW * 7) - 1)
-    time_min = start_of_week.isoformat() + 'T00:00:00Z'
-    time_max = end_of_range.isoformat() + 'T23:59:59Z'
-    ev_res = cal_service.events().list(
-        calendarId=Config.FAMILY_CALENDAR_ID,
-        timeMin=time_min,
-        timeMax=time_max,
-        singleEvents=True,
-        orderBy='startTime',
-        timeZone='Europe/Vilnius'
-    ).execute()
-    events = ev_res.get('items', [])
-
-    events_by_day = defaultdict(list)
-    for e in events:
-        s = e['start'].get('dateTime', e['start'].get('date'))
-        day_str = s[:10]
-        events_by_day[day_str].append(e)
-
-    weeks = []
-    cur_day = start_of_week
-    for _ in range(Config.WEEKS_TO_SHOW):
-        row = []
-        for __ in range(7):
-            row.append(cur_day)
-            cur_day += datetime.timedelta(days=1)
-        weeks.append(row)
-
-    weather = get_weather()
-
-    session['credentials'] = {
-        'token': creds.token,
-        'refresh_token': creds.refresh_token,
-        'token_uri': creds.token_uri,
-        'client_id': creds.client_id,
-        'client_secret': creds.client_secret,
-        'scopes': creds.scopes
-    }
+    weather = results.get('weather')
 
     return render_template(
         "index.html",
@@ -436,6 +604,7 @@ def index():
         weather=weather,
         weeks=weeks,
         events_by_day=events_by_day,
+        calendar_version=calendar_version(today),
         today=today,
         tomorrow=tomorrow,
         weather_overlay=Config.WEATHER_OVERLAY,
@@ -453,24 +622,22 @@ def index():
         show_holidays=Config.SHOW_HOLIDAYS,
         holidays=Config.HOLIDAYS,
         config=Config,  # Added config object
-        error_message=error_message
+        thermal=temp_monitor.thermal_state(),
+        error_message=error_message,
+        pending=[name for name in ('photos', 'calendar', 'weather') if name not in results]
     )
 
 @app.route('/newphoto')
 def new_photo():
     """Returns a new batch of photos in JSON format"""
     try:
-        if 'credentials' not in session:
+        creds = load_stored_credentials()
+        if creds is None:
             return jsonify({"error": "Not authenticated"}), 401
-            
-        # Load credentials from the session.
-        creds = google.oauth2.credentials.Credentials(**session['credentials'])
-        # Save credentials back to the session
-        session['credentials'] = credentials_to_dict(creds)
-        
-        photos_service = googleapiclient.discovery.build('photoslibrary', 'v1', credentials=creds)
+
+        photos_service = build_photos_service(creds)
         
-        photo_batch, album_title = get_random_photo_batch(photos_service)
+        photo_batch, album_title = next_photo_batch(photos_service)
         
         # Check if photo_batch is None or has an error message
         if not photo_batch:
@@ -480,13 +647,9 @@ def new_photo():
         if 'error' in photo_batch[0]:
             return jsonify({"error": photo_batch[0]['error'], "photos": photo_batch, "album_title": album_title})
             
-        # Log the first photo/video in the batch that will be displayed
-        if photo_batch and len(photo_batch) > 0:
-            first_item = photo_batch[0]
-            media_type = first_item.get('mediaType', 'unknown')
-            filename = first_item.get('filename', 'unknown')
-            media_logger.info(f"[{album_title}] {filename} ({media_type})")
-            
+        # Displayed items are logged by the front end through /log_media_display/batch
+        record_batch_served(photo_batch, album_title)
+        size_media_urls(photo_batch, current_photo_box(request_screen()))
         return jsonify({"photos": photo_batch, "album_title": album_title})
         
     except Exception as e:
@@ -494,6 +657,48 @@ def new_photo():
         # Return error message but with 200 status so frontend can handle it
         return jsonify({"error": str(e), "photos": [{"error": str(e), "mediaType": "error"}], "album_title": "Error"})
 
+@app.route('/media/<media_item_id>')
+def media(media_item_id):
+    """Serves a photo from the local cache, downloading it on first use.
+    ?w=&h= give the size, as computed for the batch by size_media_urls(); other
+    sizes are snapped to the same steps so clients cannot fill the cache."""
+    width = request.args.get('w', type=int)
+    height = request.args.get('h', type=int)
+    if width and height:
+        variant = size_variant(snap_side(width, Config.MEDIA_SIZE_STEP), snap_side(height, Config.MEDIA_SIZE_STEP))
+    else:
+        variant = Config.MEDIA_CACHE_VARIANT
+    try:
+        cached = media_cache.get(media_item_id, variant, resolve_media_base_url)
+    except Exception as e:
+        app.logger.error(f"Error fetching media {media_item_id}: {e}")
+        return jsonify({"error": str(e)}), 502
+    if not cached:
+        return jsonify({"error": "Media not found"}), 404
+    path, mime_type = cached
+    response = send_file(path, mimetype=mime_type, conditional=True,
+                         max_age=Config.MEDIA_CACHE_HTTP_MAX_AGE)
+    response.headers['Cache-Control'] = f"public, max-age={Config.MEDIA_CACHE_HTTP_MAX_AGE}, immutable"
+    return response
+
+@app.route('/video/<media_item_id>')
+def video(media_item_id):
+    """Serves a transcoded video with Range support, or redirects to
+    Google Photos until the transcode is ready"""
+    path = video_cache.lookup(media_item_id)
+    if path:
+        # conditional=True answers Range requests with 206 Partial Content
+        return send_file(path, mimetype='video/mp4', conditional=True,
+                         max_age=Config.MEDIA_CACHE_HTTP_MAX_AGE)
+    try:
+        base_url = fresh_media_base_url(media_item_id)
+    except Exception as e:
+        app.logger.error(f"Error resolving video {media_item_id}: {e}")
+        return jsonify({"error": str(e)}), 502
+    if not base_url:
+        return jsonify({"error": "Media not found"}), 404
+    return redirect(f"{base_url}=dv")
+
 @app.route('/newweather')
 def newweather():
     w = get_weather()
@@ -501,46 +706,52 @@ def newweather():
         return jsonify(w)
     return jsonify({"error": "Unable to fetch weather"}), 500
 
+def calendar_grid_key(today):
+    """Grid layout identity; cells are only comparable within the same key"""
+    return f"{today.isoformat()}/{Config.WEEKS_TO_SHOW}"
+
+def calendar_cells(today):
+    """Rendered day cells {day: html} of the grid, rebuilt only when events or the date changed"""
+    def build():
+        weeks, events_by_day = calendar_sync.grid(today)
+        return {
+            day.isoformat(): render_template(
+                'calendar_cell.html',
+                day=day,
+                events_by_day=events_by_day,
+                today=today,
+                holidays=Config.HOLIDAYS,
+                summary_max_length=Config.EVENT_SUMMARY_MAX_LENGTH,
+                show_holidays=Config.SHOW_HOLIDAYS
+            ).strip()
+            for week in weeks for day in week
+        }
+    return calendar_sync.cached_view('cells', today, build)
+
+def calendar_version(today):
+    return calendar_grid.update(calendar_grid_key(today), calendar_cells(today))
+
 @app.route('/calendarevents')
 def calendarevents():
-    creds_data = session.get('credentials')
-    if not creds_data:
+    """Calendar grid fragment. With ?since=<version> only the day cells that changed
+    are returned as JSON, or 304 if none did."""
+    if load_stored_credentials() is None:
         return "No credentials", 403
 
-    creds = google.oauth2.credentials.Credentials(**creds_data)
-    cal_service = googleapiclient.discovery.build('calendar', 'v3', credentials=creds)
-
+    calendar_sync.ensure_synced()
     today = datetime.date.today()
-    start_of_week = today - datetime.timedelta(days=today.weekday())
-    end_of_range = start_of_week + datetime.timedelta(days=(Config.WEEKS_TO_SHOW * 7) - 1)
-    time_min = start_of_week.isoformat() + 'T00:00:00Z'
-    time_max = end_of_range.isoformat() + 'T23:59:59Z'
-
-    ev_res = cal_service.events().list(
-        calendarId=Config.FAMILY_CALENDAR_ID,
-        timeMin=time_min,
-        timeMax=time_max,
-        singleEvents=True,
-        orderBy='startTime',
-        timeZone='Europe/Vilnius'
-    ).execute()
-    events = ev_res.get('items', [])
-
-    events_by_day = defaultdict(list)
-    for e in events:
-        s = e['start'].get('dateTime', e['start'].get('date'))
-        day_str = s[:10]
-        events_by_day[day_str].append(e)
-
-    weeks = []
-    cur_day = start_of_week
-    for _ in range(Config.WEEKS_TO_SHOW):
-        row = []
-        for __ in range(7):
-            row.append(cur_day)
-            cur_day += datetime.timedelta(days=1)
-        weeks.append(row)
-
+    version = calendar_version(today)
+
+    since = request.args.get('since', type=int)
+    if since is not None:
+        changed = calendar_grid.changed_since(calendar_grid_key(today), since)
+        if changed is not None:
+            if not changed:
+                return '', 304
+            cells = calendar_cells(today)
+            return jsonify({"version": version, "cells": {day: cells[day] for day in changed}})
+
+    weeks, events_by_day = calendar_sync.grid(today)
     return render_template(
         'calendar_fragment.html',
         weeks=weeks,
@@ -548,7 +759,8 @@ def calendarevents():
         today=today,
         holidays=Config.HOLIDAYS,
         summary_max_length=Config.EVENT_SUMMARY_MAX_LENGTH,
-        show_holidays=Config.SHOW_HOLIDAYS
+        show_holidays=Config.SHOW_HOLIDAYS,
+        calendar_version=version
     )
 
 ###################################################################################
@@ -556,35 +768,13 @@ def calendarevents():
 ###################################################################################
 @app.route('/todayevents')
 def todayevents():
-    creds_data = session.get('credentials')
-    if not creds_data:
+    if load_stored_credentials() is None:
         return "No credentials", 403
 
-    creds = google.oauth2.credentials.Credentials(**creds_data)
-    cal_service = googleapiclient.discovery.build('calendar', 'v3', credentials=creds)
-
-    # Set time zone
-    vilnius_tz = ZoneInfo('Europe/Vilnius')
-
-    # Today's midnight in location time
-    now = datetime.datetime.now(vilnius_tz)
-    local_midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    # Day end (23:59:59) - 1 sec to next day
-    local_end = local_midnight + datetime.timedelta(days=1, seconds=-1)
-
-    # Convert to ISO format without 'Z' (since it's location time, not UTC)
-    time_min = local_midnight.isoformat()
-    time_max = local_end.isoformat()
-
-    ev_res = cal_service.events().list(
-        calendarId=Config.FAMILY_CALENDAR_ID,
-        timeMin=time_min,
-        timeMax=time_max,
-        singleEvents=True,
-        orderBy='startTime',
-        timeZone='Europe/Vilnius'
-    ).execute()
-    events = ev_res.get('items', [])
+    calendar_sync.ensure_synced()
+    # Local (Europe/Vilnius) day
+    today = datetime.datetime.now(ZoneInfo('Europe/Vilnius')).date()
+    events = calendar_sync.day_events(today)
 
     # Return fragment where colors will be
     return render_template(
@@ -593,8 +783,33 @@ def todayevents():
         summary_max_length=Config.EVENT_SUMMARY_MAX_LENGTH
     )
 
+@app.route('/stream')
+def stream():
+    """Server-Sent Events: pushes typed updates only when the data changed"""
+    last_event_id = request.headers.get('Last-Event-ID', type=int) or 0
+    subscription = event_bus.subscribe()
+
+    def generate():
+        try:
+            yield f"retry: {Config.STREAM_RETRY * 1000}\n\n"
+            # Latest state of each type the client has not seen yet
+            for message in event_bus.replay(last_event_id):
+                yield message
+            while True:
+                try:
+                    yield subscription.get(timeout=Config.STREAM_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            event_bus.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/authorize')
 def authorize():
+    # The OAuth flow is only needed while authorizing, keep it out of startup
+    import google_auth_oauthlib.flow
     flow = google_auth_oauthlib.flow.Flow.from_client_secrets_file(
         Config.CLIENT_SECRETS_FILE, scopes=SCOPES)
     flow.redirect_uri = url_for('oauth2callback', _external=True)
@@ -605,6 +820,7 @@ def authorize():
 
 @app.route('/oauth2callback')
 def oauth2callback():
+    import google_auth_oauthlib.flow
     st = session['state']
     flow = google_auth_oauthlib.flow.Flow.from_client_secrets_file(
         Config.CLIENT_SECRETS_FILE, scopes=SCOPES, state=st)
@@ -612,19 +828,8 @@ def oauth2callback():
     flow.fetch_token(authorization_response=request.url)
     creds = flow.credentials
     if not creds.refresh_token:
-        session.pop('credentials', None)
         return redirect(url_for('authorize'))
-    token_data = {
-        'token': creds.token,
-        'refresh_token': creds.refresh_token,
-        'token_uri': creds.token_uri,
-        'client_id': creds.client_id,
-        'client_secret': creds.client_secret,
-        'scopes': creds.scopes
-    }
-    with open("token.json", "w") as token_file:
-        json.dump(token_data, token_file)
-    session['credentials'] = token_data
+    credential_manager.set(creds)
     return redirect(url_for('index'))
 
 @app.route('/systemstatus')
@@ -636,10 +841,32 @@ def system_status():
             'memory': get_memory_usage(),
             'disk': get_disk_usage()
         },
-        'temperature': temp_monitor.get_status()
+        'temperature': temp_monitor.get_status(),
+        'media_index': media_index.get_status(),
+        'play_history': play_history.get_status(),
+        'google_services': google_services.get_status(),
+        'quota': api_quota.get_status(),
+        'credentials': credential_manager.get_status(),
+        'warm_start': warm_start.get_status(),
+        'photo_prefetch': photo_prefetcher.get_status(),
+        'calendar_sync': calendar_sync.get_status(),
+        'calendar_grid': calendar_grid.get_status(),
+        'weather': weather_service.get_status(),
+        'sensors': sensor_poller.get_status(),
+        'discord': discord_poller.get_status(),
+        'stream': event_bus.get_status(),
+        'media_cache': media_cache.get_status(),
+        'video_cache': video_cache.get_status(),
+        'media_log': media_display_log.get_status(),
+        'display': display_timing_status()
     }
     return jsonify(status)
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """Request, upstream, template and cache metrics in the Prometheus text format"""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def get_uptime():
     """Gets system uptime"""
     try:
@@ -704,52 +931,237 @@ def get_disk_usage():
         app.logger.error(f"Error getting disk usage: {e}")
         return {'error': str(e)}
 
-@app.route('/log_media_display', methods=['POST'])
-def log_media_display():
-    """Log when media items start and stop displaying"""
-    data = request.json
-    if data and 'event' in data and 'item_id' in data:
+def display_time(data):
+    """Returns when the front end showed an item, or now if it didn't say"""
+    try:
+        return datetime.datetime.fromisoformat(data['timestamp'].replace('Z', '+00:00')).timestamp()
+    except (KeyError, AttributeError, ValueError):
+        return time.time()
+
+def log_display_event(data):
+    """Logs one display event from the front end. Returns False if the event is not valid."""
+    if not isinstance(data, dict):
+        return False
+    if data.get('filename'):
+        message = f"[{data.get('album', '')}] {data['filename']} ({data.get('mediaType', 'unknown')})"
+        record = media_logger.makeRecord(media_logger.name, logging.INFO, __file__, 0, message, None, None)
+        # Batched events are logged with the time they were shown, not received
+        record.created = display_time(data)
+        record.msecs = (record.created % 1) * 1000
+        media_logger.handle(record)
+        return True
+    if 'event' in data and 'item_id' in data:
         event_type = data['event']
         item_id = data['item_id']
         album_id = data.get('album_id', 'unknown')
         app.logger.info(f"Media display event: {event_type} for item {item_id} in album {album_id}")
+        return True
+    return False
+
+# Front end layer swap timings: (transition ms, decode ms, preloaded)
+display_timings = deque(maxlen=500)
+
+def record_display_timings(events):
+    """Keeps the transition and decode times the front end reports with display events"""
+    for e in events:
+        if isinstance(e, dict) and isinstance(e.get('transition_ms'), (int, float)):
+            decode_ms = e.get('decode_ms')
+            display_timings.append((e['transition_ms'],
+                                    decode_ms if isinstance(decode_ms, (int, float)) else None,
+                                    bool(e.get('preloaded'))))
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def display_timing_status():
+    """Summarizes recent front end transitions for /systemstatus"""
+    timings = list(display_timings)
+    transitions = [t[0] for t in timings]
+    decodes = [t[1] for t in timings if t[1] is not None]
+    return {
+        'transitions': len(timings),
+        'preloaded_ratio': round(sum(1 for t in timings if t[2]) / len(timings), 3) if timings else None,
+        'transition_ms_p50': percentile(transitions, 0.5),
+        'transition_ms_p95': percentile(transitions, 0.95),
+        'decode_ms_p50': percentile(decodes, 0.5),
+        'decode_ms_p95': percentile(decodes, 0.95)
+    }
+
+def record_display_plays(events):
+    """Stores shown items in the play history and times the first one of this run"""
+    plays = [(e['item_id'], e.get('album_id'), display_time(e))
+             for e in events if isinstance(e, dict) and e.get('item_id')]
+    play_history.record(plays)
+    if plays:
+        warm_start.first_display(min(shown_at for _, _, shown_at in plays))
+
+@app.route('/log_media_display', methods=['POST'])
+def log_media_display():
+    """Log when media items start and stop displaying"""
+    data = request.get_json(silent=True)
+    if log_display_event(data):
+        record_display_plays([data])
+        record_display_timings([data])
         return jsonify({"success": True}), 200
     return jsonify({"success": False, "error": "Invalid data"}), 400
 
+@app.route('/log_media_display/batch', methods=['POST'])
+def log_media_display_batch():
+    """Logs a list of display events, as sent by navigator.sendBeacon"""
+    # sendBeacon can't always set the content type, so parse the body regardless
+    events = request.get_json(force=True, silent=True)
+    if not isinstance(events, list):
+        return jsonify({"success": False, "error": "Invalid data"}), 400
+    logged = sum(1 for event in events if log_display_event(event))
+    record_display_plays(events)
+    record_display_timings(events)
+    return jsonify({"success": True, "logged": logged, "rejected": len(events) - logged}), 200
+
 # Register shutdown function
 @app.teardown_appcontext
 def shutdown_session(exception=None):
     pass  # For now nothing
 
 def cleanup_resources():
+    credential_manager.stop()
     # Stop temperature monitoring
     if temp_monitor:
         temp_monitor.stop()
         app.logger.info("Temperature monitoring stopped")
+    media_index.stop()
+    photo_prefetcher.stop()
+    calendar_sync.stop()
+    weather_service.stop()
+    sensor_poller.stop()
+    discord_poller.stop()
+    video_cache.stop()
+    warm_start.stop()
+    media_display_log.stop()
     
 # Set exit process
 import atexit
 atexit.register(cleanup_resources)
 
-# Before app startup, start temperature monitoring
+def temperature_event():
+    status = temp_monitor.get_status()
+    return {
+        'override_active': status['override_active'],
+        'current_media_type': status['current_media_type'],
+        'thermal': temp_monitor.thermal_state()
+    }
+
+# Hit ratios on /metrics, from the counters the caches keep anyway
+metrics.add_cache('media', lambda: (media_cache.hits, media_cache.misses))
+metrics.add_cache('photo_batch', lambda: (photo_prefetcher.hits, photo_prefetcher.misses))
+metrics.add_cache('calendar_grid', lambda: (calendar_grid.partial + calendar_grid.not_modified, calendar_grid.resent))
+metrics.add_cache('google_clients', lambda: (google_services.reuses, google_services.builds))
+
+# Push data changes to /stream subscribers
+weather_service.add_listener(lambda: event_bus.publish('weather', weather_service.snapshot))
+discord_poller.add_listener(lambda: event_bus.publish('discord', discord_poller.get()))
+calendar_sync.add_listener(lambda: event_bus.publish('calendar', {'version': calendar_sync.version}))
+calendar_sync.add_listener(lambda: event_bus.publish('today', {
+    'version': calendar_sync.version,
+    'day': calendar_sync.notified_day.isoformat() if calendar_sync.notified_day else None
+}))
+sensor_poller.add_listener(lambda: event_bus.publish('sensors', get_sensor_data()))
+temp_monitor.add_listener(lambda media_types: event_bus.publish('temperature', temperature_event()))
+temp_monitor.add_level_listener(lambda level: event_bus.publish('temperature', temperature_event()))
+
+# Keep the warm start snapshot current; weather has its own snapshot file
+calendar_sync.add_listener(lambda: warm_start.update('calendar', calendar_sync.export()))
+discord_poller.add_listener(lambda: warm_start.update('discord', discord_poller.messages))
+
+def restore_warm_start():
+    """Fills the in-memory stores from the last snapshot before the workers start"""
+    if warm_start.get('calendar'):
+        calendar_sync.restore(warm_start.get('calendar'))
+    if warm_start.get('discord'):
+        discord_poller.restore(warm_start.get('discord'))
+
 def before_app_start():
+    restore_warm_start()
+    warm_start.start()
+    media_display_log.start()
+    credential_manager.start()
     temp_monitor.start()
     app.logger.info("Temperature monitoring started")
-
-# Start temperature monitoring
-before_app_start()
-
-def credentials_to_dict(credentials):
-    """Convert Google Credentials object to a dictionary."""
-    return {
-        'token': credentials.token,
-        'refresh_token': credentials.refresh_token,
-        'token_uri': credentials.token_uri,
-        'client_id': credentials.client_id,
-        'client_secret': credentials.client_secret,
-        'scopes': credentials.scopes
-    }
+    media_index.start(background_photos_service, get_all_albums)
+    photo_prefetcher.start()
+    calendar_sync.start()
+    weather_service.start()
+    sensor_poller.start()
+    discord_poller.start()
+    video_cache.start(fresh_media_base_url)
+
+# Nothing starts at import time: the debug reloader imports this module in
+# a watcher process that never serves, and importing must stay cheap
+services_lock = threading.Lock()
+services_started = False
+stores_lock = threading.Lock()
+stores_opened = False
+
+def open_stores():
+    """Opens the databases, cache indexes and snapshots the routes read, once"""
+    global stores_opened
+    with stores_lock:
+        if stores_opened:
+            return
+        warm_start.load()
+        media_index.open()
+        play_history.open()
+        weather_service.load_snapshot()
+        media_cache.open()
+        video_cache.open()
+        stores_opened = True
+
+def claim_services():
+    """Returns True to the one caller that gets to start the services"""
+    global services_started
+    with services_lock:
+        if services_started:
+            return False
+        services_started = True
+        return True
+
+def wait_for_socket(port, timeout=5.0):
+    """Waits until the server accepts connections on port"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+def start_services(port=None):
+    """Starts the background services, after claim_services(). With a port, waits
+    for the server to listen first, so loading client libraries doesn't delay the bind."""
+    if port:
+        wait_for_socket(port)
+    open_stores()
+    before_app_start()
+    # Client libraries and discovery documents, before the first request needs them
+    google_services.warm_up([('photoslibrary', 'v1', PHOTOS_DISCOVERY_URL), ('calendar', 'v3', None)])
+    app.logger.info("Background services started")
+
+@app.before_request
+def ensure_services_started():
+    """Opens the stores for the routes and starts the services on the first request
+    when served by something other than app.run"""
+    if not stores_opened:
+        open_stores()
+    if not services_started and claim_services():
+        threading.Thread(target=start_services, daemon=True).start()
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080, debug=True)
+    port = int(os.getenv('KIOSK_PORT', 8080))
+    # debug=True serves from a reloader child process; only that one starts services
+    if is_running_from_reloader() and claim_services():
+        threading.Thread(target=start_services, args=(port,), daemon=True).start()
+    app.run(host='0.0.0.0', port=port, debug=True)
 
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""Latency, upstream calls and allocations of the kiosk routes, against local fake upstreams.
+
+Starts fake_upstreams.FakeUpstreams in place of Google Photos, Google Calendar,
+meteo.lt and Discord, points the app at it (discovery documents and token.json
+in a scratch working directory, Config base urls for meteo.lt and Discord) and
+drives the routes through Flask's test client:
+
+  /  /newphoto  /calendarevents  /calendarevents?since=  /todayevents
+  /newweather  /discordmessages
+
+For each route the first request is reported on its own (it fills the stores),
+then --requests timed requests give latency percentiles and upstream calls per
+request, and --alloc-requests more under tracemalloc give the memory allocated
+per request. Background services are not started, so every upstream call is
+charged to the route that made it; Google API quotas are lifted so long runs
+are not throttled, injected 429s still trigger the backoff. Answers that are
+200 but carry an error (a photo batch from the backoff, say) are counted as
+errors, not successes, so their latencies are not mistaken for speedups.
+
+--latency and --rate-limit take one value for all upstreams or per upstream,
+e.g. --latency photos=150,calendar=80 --rate-limit photos=0.05. Results are
+saved with --json FILE; --compare FILE prints the change against an earlier run.
+No network access is needed.
+
+Usage: python benchmarks/bench_routes.py [--requests N] [--json FILE] [--compare FILE]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import datetime
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+from collections import Counter
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from fake_upstreams import FakeData, FakeUpstreams, UPSTREAMS, photos_discovery_doc, calendar_discovery_doc
+
+ROUTES = ['index', 'newphoto', 'calendarevents', 'calendarevents_since', 'todayevents',
+          'newweather', 'discordmessages']
+
+
+def per_upstream(value, cast):
+    """Parses '50' (all upstreams) or 'photos=150,meteo=30' into {upstream: value}"""
+    if '=' not in value:
+        return {name: cast(value) for name in UPSTREAMS if name != 'token'}
+    result = {}
+    for part in value.split(','):
+        name, _, v = part.partition('=')
+        if name not in UPSTREAMS:
+            raise argparse.ArgumentTypeError(f"Unknown upstream {name}, expected one of {', '.join(UPSTREAMS)}")
+        result[name] = cast(v)
+    return result
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of values"""
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def prepare_workdir(workdir, upstreams):
+    """Discovery documents and credentials pointing the Google clients at the fakes"""
+    root_url = upstreams.url + '/'
+    os.makedirs(os.path.join(workdir, 'discovery'))
+    for name, doc in (('photoslibrary.v1', photos_discovery_doc(root_url)),
+                      ('calendar.v3', calendar_discovery_doc(root_url))):
+        with open(os.path.join(workdir, 'discovery', f"{name}.json"), 'w') as f:
+            json.dump(doc, f)
+    expiry = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+    with open(os.path.join(workdir, 'token.json'), 'w') as f:
+        json.dump({
+            'token': 'bench-token',
+            'refresh_token': 'bench-refresh',
+            'token_uri': upstreams.url + '/token',
+            'client_id': 'bench-client',
+            'client_secret': 'bench-secret',
+            'expiry': expiry.strftime('%Y-%m-%dT%H:%M:%SZ')
+        }, f)
+
+
+def load_app(workdir, upstreams):
+    """Imports app.py configured for the fakes, with its files in workdir"""
+    os.environ.update({
+        'FAMILY_CALENDAR_ID': 'family@group.calendar.google.com',
+        'DISCORD_BOT_TOKEN': 'bench-token',
+        'DISCORD_CHANNEL_ID': '1'
+    })
+    from config import Config
+    Config.METEO_API_BASE_URL = upstreams.url + '/meteo'
+    Config.DISCORD_API_BASE_URL = upstreams.url + '/discord'
+    Config.GOOGLE_DAILY_QUOTAS = {}
+    Config.MEDIA_LOG_BUFFER_DIR = workdir
+
+    import app as kiosk
+    # Only what the routes do themselves is measured
+    kiosk.services_started = True
+    return kiosk
+
+
+def route_paths(kiosk):
+    """Route name -> function returning the path of the next request"""
+    def calendar_since():
+        # Renders the day cells if no request has yet, which needs an app context
+        with kiosk.app.app_context():
+            return f"/calendarevents?since={kiosk.calendar_version(datetime.date.today())}"
+
+    return {
+        'index': lambda: '/',
+        'newphoto': lambda: '/newphoto',
+        'calendarevents': lambda: '/calendarevents',
+        'calendarevents_since': calendar_since,
+        'todayevents': lambda: '/todayevents',
+        'newweather': lambda: '/newweather',
+        'discordmessages': lambda: '/discordmessages'
+    }
+
+
+def has_error(response):
+    """True if the answer carries an error: an error key, or an error photo batch in the page"""
+    if response.is_json:
+        payload = response.get_json(silent=True)
+        return isinstance(payload, dict) and 'error' in payload
+    # index.html embeds the photo batch as JSON
+    return b'"mediaType": "error"' in response.get_data()
+
+
+def measure_route(client, upstreams, path, requests, alloc_requests):
+    def get():
+        response = client.get(path())
+        error = has_error(response)
+        response.close()
+        return response.status_code, error
+
+    before = upstreams.snapshot()
+    start = time.perf_counter()
+    first_status, first_error = get()
+    first_ms = (time.perf_counter() - start) * 1000
+    first_upstream = FakeUpstreams.diff(before, upstreams.snapshot())
+
+    latencies = []
+    statuses = Counter()
+    errors = 0
+    before = upstreams.snapshot()
+    for _ in range(requests):
+        start = time.perf_counter()
+        status, error = get()
+        latencies.append((time.perf_counter() - start) * 1000)
+        statuses[status] += 1
+        errors += error
+    upstream = FakeUpstreams.diff(before, upstreams.snapshot())
+
+    # Allocations in a separate pass, tracemalloc slows everything down
+    peaks, retained = [], []
+    tracemalloc.start()
+    try:
+        for _ in range(alloc_requests):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            get()
+            after, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - current)
+            retained.append(after - current)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'requests': requests,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'errors': errors,
+        'first_status': first_status,
+        'first_error': first_error,
+        'first_ms': round(first_ms, 2),
+        'first_upstream': first_upstream,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p90_ms': round(percentile(latencies, 0.90), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'max_ms': round(max(latencies), 3),
+        'mean_ms': round(statistics.mean(latencies), 3),
+        'upstream_per_request': {name: round(c['requests'] / requests, 3) for name, c in upstream.items()},
+        'upstream_bytes_per_request': {name: round(c['bytes'] / requests) for name, c in upstream.items()},
+        'upstream_rate_limited': {name: c['rate_limited'] for name, c in upstream.items() if c['rate_limited']},
+        'alloc_peak_kb': round(statistics.median(peaks) / 1024, 1) if peaks else None,
+        'alloc_retained_kb': round(statistics.mean(retained) / 1024, 1) if retained else None
+    }
+
+
+def format_calls(calls):
+    return ' '.join(f"{name}={count:g}" for name, count in calls.items()) or '-'
+
+
+def report(results):
+    print(f"{'route':<22}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}{'first':>10}{'alloc':>10}  upstream calls/request")
+    for name, r in results.items():
+        print(f"{name:<22}{r['p50_ms']:>9.2f}{r['p90_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['max_ms']:>9.2f}"
+              f"{r['first_ms']:>10.1f}{r['alloc_peak_kb'] or 0:>8.0f}kB  {format_calls(r['upstream_per_request'])}")
+        non_200 = {status: count for status, count in r['statuses'].items() if status != '200'}
+        if non_200 or r['errors']:
+            print(f"{'':<22}statuses {r['statuses']}   error answers {r['errors']} of {r['requests']}")
+        if r['upstream_rate_limited']:
+            print(f"{'':<22}answered 429: {format_calls(r['upstream_rate_limited'])}")
+    print("(ms; first = first request of the run, filling the stores; alloc = median peak per request)")
+
+
+def compare(results, previous):
+    """Prints the change of every route against an earlier run"""
+    print(f"\nAgainst {previous.get('revision') or 'earlier run'} ({previous.get('timestamp')}):")
+    for name, r in results.items():
+        old = previous['routes'].get(name)
+        if not old:
+            continue
+        changes = []
+        for key in ('p50_ms', 'p90_ms', 'alloc_peak_kb'):
+            if old.get(key) and r.get(key) is not None:
+                changes.append(f"{key[:-3]} {(r[key] - old[key]) / old[key] * 100:+6.1f}%")
+        if old.get('errors', 0) != r['errors']:
+            changes.append(f"errors {old.get('errors', 0)} -> {r['errors']}")
+        if old['upstream_per_request'] != r['upstream_per_request']:
+            changes.append(f"upstream {format_calls(old['upstream_per_request'])} -> "
+                           f"{format_calls(r['upstream_per_request'])}")
+        print(f"  {name:<22}{'   '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200, help="timed requests per route")
+    parser.add_argument('--alloc-requests', type=int, default=20, help="requests per route under tracemalloc")
+    parser.add_argument('--routes', default=','.join(ROUTES), help="comma separated, from: " + ', '.join(ROUTES))
+    parser.add_argument('--albums', type=int, default=20)
+    parser.add_argument('--items', type=int, default=300, help="media items per album")
+    parser.add_argument('--events', type=int, default=60, help="calendar events in the grid")
+    parser.add_argument('--messages', type=int, default=30, help="Discord messages in the channel")
+    parser.add_argument('--latency', default='0', help="ms added by the upstreams")
+    parser.add_argument('--rate-limit', default='0', help="share of upstream requests answered with 429")
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--compare', help="earlier results to compare with")
+    parser.add_argument('--keep', action='store_true', help="keep the scratch directory and its bench.log")
+    args = parser.parse_args()
+
+    routes = [name for name in args.routes.split(',') if name]
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        parser.error(f"Unknown routes: {', '.join(sorted(unknown))}")
+    latency = {name: ms / 1000 for name, ms in per_upstream(args.latency, float).items()}
+    rate_limit = per_upstream(args.rate_limit, float)
+
+    # Relative to where the benchmark was started, not the scratch directory
+    json_path = os.path.abspath(args.json) if args.json else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    workdir = tempfile.mkdtemp(prefix='kiosk-bench-')
+    os.chdir(workdir)
+    # Same log level as on the kiosk, into a file instead of the terminal
+    logging.basicConfig(filename=os.path.join(workdir, 'bench.log'), level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    data = FakeData(albums=args.albums, items_per_album=args.items, events=args.events,
+                    messages=args.messages)
+    upstreams = FakeUpstreams(data, latency=latency, rate_limit=rate_limit).start()
+    prepare_workdir(workdir, upstreams)
+    kiosk = load_app(workdir, upstreams)
+    client = kiosk.app.test_client()
+    paths = route_paths(kiosk)
+
+    results = {}
+    for name in routes:
+        results[name] = measure_route(client, upstreams, paths[name], args.requests, args.alloc_requests)
+    upstreams.stop()
+
+    print(f"{args.requests} requests per route, {args.albums} albums x {args.items} items, "
+          f"{args.events} events, {args.messages} messages")
+    report(results)
+
+    output = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': sys.version.split()[0],
+        'settings': {
+            'requests': args.requests,
+            'alloc_requests': args.alloc_requests,
+            'albums': args.albums,
+            'items': args.items,
+            'events': args.events,
+            'messages': args.messages,
+            'latency_ms': {name: s * 1000 for name, s in latency.items()},
+            'rate_limit': rate_limit
+        },
+        'routes': results
+    }
+    if compare_path:
+        with open(compare_path, 'r') as f:
+            compare(results, json.load(f))
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(output, f, indent=2)
+    if args.keep:
+        print(f"Scratch directory kept: {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
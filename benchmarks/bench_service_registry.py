@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Per-request cost of getting a Google API client, before and after the service registry.
+
+Before: googleapiclient.discovery.build() on every request, as the routes used to do.
+        For photoslibrary the document is read from disk, so the network fetch
+        the old code made on every build is not even counted.
+After:  ServiceRegistry.get() handing out the shared client.
+
+Only the calendar client is measured by default because its discovery
+document ships with google-api-python-client; photoslibrary is measured too
+once discovery/photoslibrary.v1.json has been stored by a running kiosk.
+No network access is needed.
+
+Usage: python benchmarks/bench_service_registry.py [iterations]
+"""
+import os
+import sys
+import time
+import logging
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import google.oauth2.credentials
+import googleapiclient.discovery
+import googleapiclient.discovery_cache
+
+from config import Config
+from google_services import ServiceRegistry
+
+googleapiclient.discovery_cache.LOGGER.setLevel(logging.ERROR)
+
+DISCOVERY_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'discovery')
+
+
+def make_credentials(i):
+    # Each request used to rebuild Credentials from the session
+    return google.oauth2.credentials.Credentials(
+        token=f"token-{i}", refresh_token="refresh", client_id="client",
+        client_secret="secret", token_uri="https://oauth2.googleapis.com/token")
+
+
+def measure(fn, iterations):
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"  {name:<10} mean {statistics.mean(samples):8.3f} ms   "
+          f"median {statistics.median(samples):8.3f} ms   p95 {p95:8.3f} ms")
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    apis = [('calendar', 'v3')]
+    if os.path.exists(os.path.join(DISCOVERY_DIR, 'photoslibrary.v1.json')):
+        apis.append(('photoslibrary', 'v1'))
+
+    for api, version in apis:
+        def before(i):
+            if googleapiclient.discovery_cache.get_static_doc(api, version) is not None:
+                googleapiclient.discovery.build(api, version, credentials=make_credentials(i),
+                                                static_discovery=True)
+            else:
+                with open(os.path.join(DISCOVERY_DIR, f"{api}.{version}.json")) as f:
+                    googleapiclient.discovery.build_from_document(f.read(), credentials=make_credentials(i))
+
+        registry = ServiceRegistry(Config, DISCOVERY_DIR)
+
+        def after(i):
+            registry.get(api, version, make_credentials(i))
+
+        print(f"{api} {version} ({iterations} requests)")
+        report("before", measure(before, iterations))
+        report("after", measure(after, iterations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""Startup time of the kiosk app, to be tracked over releases.
+
+1. Import time: runs `python -X importtime -c "import app"` and lists the
+   modules app.py pulls in directly, slowest first.
+2. Time to first 200: starts `python app.py` (debug reloader included, as
+   kiosk.service runs it) and polls a route until it answers 200, reporting
+   when the port started accepting connections and when the first 200 came.
+
+Both run from a scratch working directory, so no token.json, databases or
+caches of a real kiosk are read or written; the app starts unauthorized.
+No network access is needed.
+
+Usage: python benchmarks/bench_startup.py [--runs N] [--path /systemstatus] [--json FILE]
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+import urllib.error
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_FILE = os.path.join(APP_DIR, 'app.py')
+
+
+def import_times(workdir):
+    """Returns (app cumulative ms, [(module, cumulative ms)] imported directly by app)"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import sys; sys.path.insert(0, {APP_DIR!r}); import app"],
+        cwd=workdir, capture_output=True, text=True, timeout=120
+    )
+    # Children are listed before their parent, indented two spaces per level
+    total, children = None, []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        name = name.strip()
+        if depth == 1:
+            children.append((name, int(cumulative) / 1000))
+        elif depth == 0:
+            if name == 'app':
+                total = int(cumulative) / 1000
+                break
+            children = []
+    if total is None:
+        raise RuntimeError(f"import app failed:\n{result.stderr[-2000:]}")
+    return total, sorted(children, key=lambda c: c[1], reverse=True)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def first_200(workdir, path, timeout=60.0):
+    """Starts app.py and returns (ms until the port accepts, ms until path answers 200)"""
+    port = free_port()
+    env = dict(os.environ, KIOSK_PORT=str(port))
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, APP_FILE], cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+    listening = None
+    try:
+        while time.perf_counter() - started < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"app.py exited with {proc.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=5) as r:
+                    if listening is None:
+                        listening = time.perf_counter()
+                    if r.status == 200:
+                        done = time.perf_counter()
+                        return (listening - started) * 1000, (done - started) * 1000
+            except urllib.error.HTTPError:
+                # Answered, just not 200 yet
+                if listening is None:
+                    listening = time.perf_counter()
+            except OSError:
+                pass
+            time.sleep(0.02)
+        raise RuntimeError(f"No 200 from {path} within {timeout}s")
+    finally:
+        # The reloader child is in the same session
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(10)
+
+
+def report(label, values, suffix=''):
+    print(f"{label:<32} median {statistics.median(values):8.1f} ms   min {min(values):8.1f} ms{suffix}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--path', default='/systemstatus', help="route polled for the first 200")
+    parser.add_argument('--top', type=int, default=15, help="direct imports to list")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    imports, listens, firsts = [], [], []
+    with tempfile.TemporaryDirectory(prefix='kiosk-startup-') as workdir:
+        for _ in range(args.runs):
+            imports.append(import_times(workdir))
+            listen_ms, first_ms = first_200(workdir, args.path)
+            listens.append(listen_ms)
+            firsts.append(first_ms)
+
+    totals = [total for total, _ in imports]
+    by_module = {}
+    for _, children in imports:
+        for name, ms in children:
+            by_module.setdefault(name, []).append(ms)
+    slowest = sorted(((name, statistics.median(ms)) for name, ms in by_module.items()),
+                     key=lambda c: c[1], reverse=True)[:args.top]
+
+    report('import app', totals, f"   ({args.runs} runs)")
+    for name, ms in slowest:
+        print(f"  {name:<30} {ms:8.1f} ms")
+    report('port accepting', listens)
+    report(f"first 200 {args.path}", firsts)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'timestamp': time.time(),
+                'python': sys.version.split()[0],
+                'runs': args.runs,
+                'path': args.path,
+                'import_app_ms': totals,
+                'slowest_imports_ms': dict(slowest),
+                'port_accepting_ms': listens,
+                'first_200_ms': firsts
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,369 @@
+"""Local stand-ins for Google Photos, Google Calendar, meteo.lt and Discord.
+
+One HTTP server answers all four with responses shaped like the real APIs:
+paged albums and mediaItems, calendar events with sync tokens, meteo.lt
+forecastTimestamps with an ETag, and Discord channel messages. Latency and
+429 responses can be injected per upstream. Every request is counted, so a
+benchmark can tell how many upstream calls a route made.
+
+Used by bench_routes.py; no network access is needed.
+"""
+import json
+import time
+import random
+import datetime
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+UPSTREAMS = ('photos', 'calendar', 'meteo', 'discord', 'token')
+
+# Largest pages the real APIs return
+ALBUMS_PAGE_LIMIT = 50
+MEDIA_ITEMS_PAGE_LIMIT = 100
+EVENTS_PAGE_LIMIT = 250
+
+
+def photos_discovery_doc(root_url):
+    """Discovery document covering the Photos Library methods the kiosk calls"""
+    def method(name, path, http_method, parameters=None, request=None, response=None):
+        desc = {
+            'id': f"photoslibrary.{name}",
+            'path': path,
+            'flatPath': path,
+            'httpMethod': http_method,
+            'parameters': parameters or {},
+            'parameterOrder': [p for p, d in (parameters or {}).items() if d.get('required')],
+            'response': {'$ref': response}
+        }
+        if request:
+            desc['request'] = {'$ref': request}
+        return desc
+
+    schemas = ['ListAlbumsResponse', 'SearchMediaItemsRequest', 'SearchMediaItemsResponse',
+               'BatchGetMediaItemsResponse', 'MediaItem']
+    return {
+        'kind': 'discovery#restDescription',
+        'discoveryVersion': 'v1',
+        'id': 'photoslibrary:v1',
+        'name': 'photoslibrary',
+        'version': 'v1',
+        'rootUrl': root_url,
+        'servicePath': '',
+        'baseUrl': root_url,
+        'batchPath': 'batch',
+        'protocol': 'rest',
+        'parameters': {},
+        'schemas': {name: {'id': name, 'type': 'object', 'properties': {}} for name in schemas},
+        'resources': {
+            'albums': {'methods': {
+                'list': method('albums.list', 'v1/albums', 'GET', {
+                    'pageSize': {'location': 'query', 'type': 'integer', 'format': 'int32'},
+                    'pageToken': {'location': 'query', 'type': 'string'},
+                    'excludeNonAppCreatedData': {'location': 'query', 'type': 'boolean'}
+                }, response='ListAlbumsResponse')
+            }},
+            'mediaItems': {'methods': {
+                'search': method('mediaItems.search', 'v1/mediaItems:search', 'POST',
+                                 request='SearchMediaItemsRequest', response='SearchMediaItemsResponse'),
+                'batchGet': method('mediaItems.batchGet', 'v1/mediaItems:batchGet', 'GET', {
+                    'mediaItemIds': {'location': 'query', 'type': 'string', 'repeated': True}
+                }, response='BatchGetMediaItemsResponse'),
+                'get': method('mediaItems.get', 'v1/mediaItems/{+mediaItemId}', 'GET', {
+                    'mediaItemId': {'location': 'path', 'type': 'string', 'required': True}
+                }, response='MediaItem')
+            }}
+        }
+    }
+
+
+def calendar_discovery_doc(root_url):
+    """The Calendar discovery document bundled with google-api-python-client, pointed at root_url"""
+    from googleapiclient import discovery_cache
+    doc = json.loads(discovery_cache.get_static_doc('calendar', 'v3'))
+    doc['rootUrl'] = root_url
+    doc['baseUrl'] = root_url + doc['servicePath']
+    doc.pop('mtlsRootUrl', None)
+    return doc
+
+
+class FakeData:
+    """Generated content of the fake APIs; the same seed gives the same content"""
+
+    def __init__(self, albums=20, items_per_album=300, video_every=10, events=60,
+                 messages=30, seed=1):
+        rng = random.Random(seed)
+        base_time = datetime.datetime(2024, 1, 1, 8, 0, 0)
+        self.albums = []
+        self.items = {}
+        self.album_items = {}
+        for a in range(albums):
+            album_id = f"album{a:04d}"
+            ids = []
+            for i in range(items_per_album):
+                item_id = f"{album_id}-item{i:05d}"
+                taken = base_time + datetime.timedelta(days=a * 7, minutes=i * 3)
+                metadata = {'creationTime': taken.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                            'width': str(rng.choice([4032, 3024, 1920])),
+                            'height': str(rng.choice([3024, 4032, 1080]))}
+                is_video = video_every and i % video_every == video_every - 1
+                if is_video:
+                    metadata['video'] = {'fps': 30, 'status': 'READY'}
+                else:
+                    metadata['photo'] = {'cameraMake': 'Google', 'cameraModel': 'Pixel'}
+                self.items[item_id] = {
+                    'id': item_id,
+                    'productUrl': f"https://photos.google.com/lr/photo/{item_id}",
+                    'mimeType': 'video/mp4' if is_video else 'image/jpeg',
+                    'filename': f"{'VID' if is_video else 'IMG'}_{i:05d}.{'mp4' if is_video else 'jpg'}",
+                    'mediaMetadata': metadata
+                }
+                ids.append(item_id)
+            self.album_items[album_id] = ids
+            self.albums.append({
+                'id': album_id,
+                'title': f"Album {a:04d}",
+                'productUrl': f"https://photos.google.com/lr/album/{album_id}",
+                'mediaItemsCount': str(items_per_album),
+                'coverPhotoMediaItemId': ids[0] if ids else None
+            })
+
+        # Spread over the weeks the calendar grid shows
+        today = datetime.date.today()
+        self.events = []
+        for e in range(events):
+            day = today + datetime.timedelta(days=rng.randint(-14, 34))
+            event = {
+                'kind': 'calendar#event',
+                'id': f"event{e:05d}",
+                'status': 'confirmed',
+                'summary': f"{rng.choice(['PE', 'LI', 'LA', 'DA', 'GI', 'BU'])} event {e}",
+                'updated': '2024-01-01T00:00:00.000Z'
+            }
+            if e % 7 == 0:
+                event['start'] = {'date': day.isoformat()}
+                event['end'] = {'date': (day + datetime.timedelta(days=1)).isoformat()}
+            else:
+                hour = rng.randint(7, 20)
+                event['start'] = {'dateTime': f"{day.isoformat()}T{hour:02d}:00:00+03:00",
+                                  'timeZone': 'Europe/Vilnius'}
+                event['end'] = {'dateTime': f"{day.isoformat()}T{hour:02d}:45:00+03:00",
+                                'timeZone': 'Europe/Vilnius'}
+            self.events.append(event)
+
+        # Hourly for three days, then every three hours, like meteo.lt
+        now = datetime.datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        self.forecast = {
+            'place': {'code': 'vilnius-paneriai', 'name': 'Vilnius (Paneriai)'},
+            'forecastType': 'long-term',
+            'forecastCreationTimeUtc': now.strftime('%Y-%m-%d %H:%M:%S'),
+            'forecastTimestamps': [{
+                'forecastTimeUtc': (now + datetime.timedelta(hours=h)).strftime('%Y-%m-%d %H:%M:%S'),
+                'airTemperature': round(rng.uniform(-5, 25), 1),
+                'feelsLikeTemperature': round(rng.uniform(-10, 25), 1),
+                'windSpeed': rng.randint(0, 12),
+                'windGust': rng.randint(0, 20),
+                'windDirection': rng.randint(0, 359),
+                'cloudCover': rng.randint(0, 100),
+                'seaLevelPressure': rng.randint(990, 1030),
+                'relativeHumidity': rng.randint(30, 100),
+                'totalPrecipitation': round(rng.uniform(0, 2), 1),
+                'conditionCode': rng.choice(['clear', 'partly-cloudy', 'cloudy-with-sunny-intervals',
+                                             'cloudy', 'light-rain', 'rain'])
+            } for h in list(range(72)) + list(range(72, 24 * 7, 3))]
+        }
+
+        self.messages = [{
+            'id': str(1200000000000000000 + m),
+            'type': 0,
+            'channel_id': '1',
+            'content': f"Message {m}",
+            'timestamp': (now - datetime.timedelta(minutes=messages - m)).isoformat() + '+00:00',
+            'author': {'id': str(100 + m % 4), 'username': ['petras', 'lina', 'darius', 'gintare'][m % 4]},
+            'attachments': ([{'id': str(m), 'filename': 'photo.jpg', 'url': f"https://cdn.example/{m}.jpg",
+                              'proxy_url': f"https://media.example/{m}.jpg"}] if m % 5 == 0 else []),
+            'embeds': []
+        } for m in range(messages)]
+
+
+class FakeUpstreams:
+    """HTTP server answering as all four upstreams, with injectable latency and 429s"""
+
+    def __init__(self, data, latency=None, rate_limit=None, seed=1):
+        """latency and rate_limit map an upstream name to seconds of delay and
+        to the share of its requests answered with 429"""
+        self.data = data
+        self.latency = dict(latency or {})
+        self.rate_limit = dict(rate_limit or {})
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {name: {'requests': 0, 'rate_limited': 0, 'bytes': 0} for name in UPSTREAMS}
+        self.sync_serial = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def snapshot(self):
+        """Copy of the per-upstream counters"""
+        with self.lock:
+            return {name: dict(c) for name, c in self.counts.items()}
+
+    @staticmethod
+    def diff(before, after):
+        """Counters of what happened between two snapshots, upstreams with no requests left out"""
+        return {name: {key: after[name][key] - before[name][key] for key in after[name]}
+                for name in after if after[name]['requests'] != before[name]['requests']}
+
+    # ------------------------------------------------------------------
+    # Responses
+    # ------------------------------------------------------------------
+
+    def route(self, method, path, query, body):
+        """Returns (upstream, status, headers, payload) for a request"""
+        if path == '/token':
+            return 'token', 200, {}, {'access_token': 'bench-token', 'expires_in': 3600,
+                                      'token_type': 'Bearer'}
+        if path.startswith('/v1/'):
+            return ('photos',) + self.photos(method, path[len('/v1/'):], query, body)
+        if path.startswith('/calendar/v3/'):
+            return ('calendar',) + self.calendar(query)
+        if path.startswith('/meteo/'):
+            return ('meteo',) + self.meteo()
+        if path.startswith('/discord/'):
+            return ('discord',) + self.discord(query)
+        return 'token', 404, {}, {'error': f"No fake for {path}"}
+
+    def photos(self, method, path, query, body):
+        data = self.data
+        if path == 'albums':
+            start = int(query.get('pageToken', ['0'])[0] or 0)
+            size = min(int(query.get('pageSize', [20])[0]), ALBUMS_PAGE_LIMIT)
+            page = {'albums': data.albums[start:start + size]}
+            if start + size < len(data.albums):
+                page['nextPageToken'] = str(start + size)
+            return 200, {}, page
+        if path == 'mediaItems:search' and method == 'POST':
+            ids = data.album_items.get(body.get('albumId'), [])
+            start = int(body.get('pageToken') or 0)
+            size = min(int(body.get('pageSize') or 25), MEDIA_ITEMS_PAGE_LIMIT)
+            page = {'mediaItems': [self.media_item(i) for i in ids[start:start + size]]}
+            if start + size < len(ids):
+                page['nextPageToken'] = str(start + size)
+            return 200, {}, page
+        if path == 'mediaItems:batchGet':
+            return 200, {}, {'mediaItemResults': [
+                {'mediaItem': self.media_item(i)} if i in data.items
+                else {'status': {'code': 5, 'message': 'Not found'}}
+                for i in query.get('mediaItemIds', [])
+            ]}
+        if path.startswith('mediaItems/') and path[len('mediaItems/'):] in data.items:
+            return 200, {}, self.media_item(path[len('mediaItems/'):])
+        return 404, {}, {'error': {'code': 404, 'message': 'Not found', 'status': 'NOT_FOUND'}}
+
+    def media_item(self, item_id):
+        item = dict(self.data.items[item_id])
+        item['baseUrl'] = f"{self.url}/lh/{item_id}"
+        return item
+
+    def calendar(self, query):
+        if 'syncToken' in query:
+            # Nothing changed since the last sync
+            page = {'items': []}
+        else:
+            start = int(query.get('pageToken', ['0'])[0] or 0)
+            size = min(int(query.get('maxResults', [EVENTS_PAGE_LIMIT])[0]), EVENTS_PAGE_LIMIT)
+            page = {'items': self.data.events[start:start + size]}
+            if start + size < len(self.data.events):
+                page['nextPageToken'] = str(start + size)
+                return 200, {}, dict(page, kind='calendar#events')
+        with self.lock:
+            self.sync_serial += 1
+            page['nextSyncToken'] = f"sync-{self.sync_serial}"
+        return 200, {}, dict(page, kind='calendar#events')
+
+    def meteo(self):
+        return 200, {'ETag': '"bench-forecast"'}, self.data.forecast
+
+    def discord(self, query):
+        messages = self.data.messages
+        limit = int(query.get('limit', ['50'])[0])
+        if 'after' in query:
+            after = int(query['after'][0])
+            newer = [m for m in messages if int(m['id']) > after]
+            return 200, {'X-RateLimit-Remaining': '4', 'X-RateLimit-Reset-After': '1'}, newer[:limit][::-1]
+        return 200, {'X-RateLimit-Remaining': '4', 'X-RateLimit-Reset-After': '1'}, messages[::-1][:limit]
+
+    def rate_limited(self, upstream):
+        """The 429 answer each upstream gives"""
+        if upstream == 'discord':
+            return 429, {'Retry-After': '1'}, {'message': 'You are being rate limited.',
+                                               'retry_after': 1.0, 'global': False}
+        if upstream == 'meteo':
+            return 429, {}, {'error': 'Too Many Requests'}
+        return 429, {}, {'error': {'code': 429, 'status': 'RESOURCE_EXHAUSTED',
+                                   'message': 'Quota exceeded for quota metric'}}
+
+    def handler_class(self):
+        upstreams = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def handle_request(self, method):
+                parsed = urllib.parse.urlparse(self.path)
+                query = urllib.parse.parse_qs(parsed.query)
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                body = json.loads(raw) if raw else {}
+
+                upstream, status, headers, payload = upstreams.route(method, parsed.path, query, body)
+                delay = upstreams.latency.get(upstream, 0)
+                if delay:
+                    time.sleep(delay)
+                with upstreams.lock:
+                    limited = upstreams.rng.random() < upstreams.rate_limit.get(upstream, 0)
+                if limited:
+                    status, headers, payload = upstreams.rate_limited(upstream)
+                elif upstream == 'meteo' and self.headers.get('If-None-Match') == headers['ETag']:
+                    status, payload = 304, None
+
+                content = json.dumps(payload).encode('utf-8') if payload is not None else b''
+                with upstreams.lock:
+                    counts = upstreams.counts[upstream]
+                    counts['requests'] += 1
+                    counts['rate_limited'] += limited
+                    counts['bytes'] += len(content)
+
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                if content:
+                    self.send_header('Content-Type', 'application/json; charset=UTF-8')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                self.handle_request('GET')
+
+            def do_POST(self):
+                self.handle_request('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,355 @@
+import time
+import hashlib
+import datetime
+import logging
+import threading
+from collections import defaultdict, OrderedDict
+
+from quota import QuotaExceeded
+from event_bus import ChangeNotifier
+
+logger = logging.getLogger('calendar_sync')
+
+TIME_ZONE = 'Europe/Vilnius'
+
+
+def event_start(event):
+    return event['start'].get('dateTime', event['start'].get('date'))
+
+
+def event_end(event):
+    end = event.get('end', {})
+    return end.get('dateTime', end.get('date')) or event_start(event)
+
+
+def in_window(event, window):
+    """True if the event overlaps the (first day, last day) window"""
+    first, last = window
+    return event_start(event)[:10] <= last.isoformat() and event_end(event)[:10] >= first.isoformat()
+
+
+def start_of_week(day):
+    return day - datetime.timedelta(days=day.weekday())
+
+
+class CalendarSync(ChangeNotifier):
+    """In-memory store of calendar events kept current with syncToken incremental sync"""
+
+    def __init__(self, config, service_factory):
+        """service_factory returns a Calendar service, or None without credentials"""
+        self.config = config
+        self.service_factory = service_factory
+        self.running = False
+        self.thread = None
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.events = {}
+        self.sync_token = None
+        self.window = None
+        self.version = 0
+        self.last_sync = None
+        self.full_syncs = 0
+        self.incremental_syncs = 0
+        self.views = {}
+        self.notified_day = None
+        # Filled from a warm start snapshot until the first sync
+        self.restored = False
+
+    def window_for(self, today):
+        """Returns (first day, last day) of the WEEKS_TO_SHOW grid"""
+        first = start_of_week(today)
+        return first, first + datetime.timedelta(days=(self.config.WEEKS_TO_SHOW * 7) - 1)
+
+    # ------------------------------------------------------------------
+    # Synchronization
+    # ------------------------------------------------------------------
+
+    def list_events(self, calendar_service, **params):
+        """Pages through events().list. Returns (items, nextSyncToken)."""
+        items = []
+        page_token = None
+        while True:
+            resp = calendar_service.events().list(
+                calendarId=self.config.FAMILY_CALENDAR_ID,
+                singleEvents=True,
+                timeZone=TIME_ZONE,
+                pageToken=page_token,
+                **params
+            ).execute()
+            items.extend(resp.get('items', []))
+            page_token = resp.get('nextPageToken')
+            if not page_token:
+                return items, resp.get('nextSyncToken')
+
+    def full_sync(self, calendar_service, window):
+        first, last = window
+        items, sync_token = self.list_events(
+            calendar_service,
+            timeMin=first.isoformat() + 'T00:00:00Z',
+            timeMax=last.isoformat() + 'T23:59:59Z'
+        )
+        events = {e['id']: e for e in items if e.get('status') != 'cancelled'}
+        with self.lock:
+            changed = events != self.events or window != self.window
+            self.events = events
+            self.sync_token = sync_token
+            self.window = window
+            if changed:
+                self.version += 1
+        self.full_syncs += 1
+        logger.info(f"Calendar full sync: {len(events)} events")
+        return changed
+
+    def incremental_sync(self, calendar_service):
+        """Applies the changes since the sync token. The delta covers the whole
+        calendar, so events outside the window are left out of the store."""
+        items, sync_token = self.list_events(calendar_service, syncToken=self.sync_token)
+        with self.lock:
+            changed = False
+            for e in items:
+                if e.get('status') == 'cancelled' or not in_window(e, self.window):
+                    # Also events moved out of the window
+                    changed = self.events.pop(e['id'], None) is not None or changed
+                elif self.events.get(e['id']) != e:
+                    self.events[e['id']] = e
+                    changed = True
+            self.sync_token = sync_token
+            if changed:
+                self.version += 1
+        self.incremental_syncs += 1
+        if changed:
+            logger.info(f"Calendar incremental sync: {len(items)} changes")
+        return changed
+
+    def sync(self):
+        """Brings the store up to date. Returns True if any event changed."""
+        calendar_service = self.service_factory()
+        if calendar_service is None:
+            return False
+
+        today = datetime.date.today()
+        with self.sync_lock:
+            changed = self.sync_window(calendar_service, self.window_for(today))
+        # Today's highlight and list move at midnight even without changes
+        if changed or today != self.notified_day:
+            self.notified_day = today
+            self.notify_change()
+        return changed
+
+    def sync_window(self, calendar_service, window):
+        import googleapiclient.errors
+        try:
+            if window != self.window or not self.sync_token:
+                changed = self.full_sync(calendar_service, window)
+            else:
+                try:
+                    changed = self.incremental_sync(calendar_service)
+                except googleapiclient.errors.HttpError as error:
+                    # Sync token expired, start over
+                    if error.resp.status != 410:
+                        raise
+                    logger.info("Calendar sync token expired, doing a full sync")
+                    changed = self.full_sync(calendar_service, window)
+        finally:
+            self.last_sync = time.time()
+        return changed
+
+    def ensure_synced(self):
+        """Syncs synchronously if the store has never been filled.
+
+        Errors are only logged: the caller serves whatever the store holds.
+        """
+        if self.last_sync is None and not self.restored:
+            with self.sync_lock:
+                synced = self.last_sync is not None
+            if not synced:
+                import googleapiclient.errors
+                try:
+                    self.sync()
+                except (QuotaExceeded, googleapiclient.errors.HttpError) as e:
+                    logger.error(f"Error syncing calendar: {e}")
+
+    def sync_loop(self):
+        """Main sync loop"""
+        logger.info("Calendar sync started")
+        while self.running:
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"Error syncing calendar: {e}")
+            time.sleep(self.config.CALENDAR_SYNC_INTERVAL)
+
+    def start(self):
+        """Starts syncing in a separate thread"""
+        if self.running:
+            logger.warning("Calendar sync already running")
+            return False
+
+        self.running = True
+        self.thread = threading.Thread(target=self.sync_loop, daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        """Stops syncing"""
+        if not self.running:
+            return
+
+        self.running = False
+        if self.thread:
+            self.thread.join(2.0)  # Wait max 2 seconds
+        logger.info("Calendar sync stopped")
+
+    # ------------------------------------------------------------------
+    # Warm start
+    # ------------------------------------------------------------------
+
+    def export(self):
+        """Returns the store in a JSON-friendly form"""
+        with self.lock:
+            return {
+                'events': list(self.events.values()),
+                'window': [day.isoformat() for day in self.window] if self.window else None
+            }
+
+    def restore(self, saved):
+        """Fills the store from export() output; the first sync replaces it"""
+        with self.lock:
+            if self.last_sync is not None or self.events:
+                return
+            self.events = {e['id']: e for e in saved.get('events', [])}
+            if saved.get('window'):
+                self.window = tuple(datetime.date.fromisoformat(day) for day in saved['window'])
+            self.version += 1
+            self.restored = True
+        logger.info(f"Restored {len(self.events)} calendar events from warm start snapshot")
+
+    # ------------------------------------------------------------------
+    # Derived views
+    # ------------------------------------------------------------------
+
+    def sorted_events(self):
+        with self.lock:
+            events = list(self.events.values())
+        events.sort(key=event_start)
+        return events
+
+    def cached_view(self, name, today, build):
+        """Returns a view derived from the store, rebuilt only when events or the date changed"""
+        key = (name, self.version, today)
+        with self.lock:
+            if key in self.views:
+                return self.views[key]
+        view = build()
+        with self.lock:
+            self.views = {k: v for k, v in self.views.items() if k[1] == self.version and k[2] == today}
+            self.views[key] = view
+        return view
+
+    def grid(self, today=None):
+        """Returns (weeks, events_by_day) for the calendar grid"""
+        today = today or datetime.date.today()
+
+        def build():
+            first, last = self.window_for(today)
+            first_str, last_str = first.isoformat(), last.isoformat()
+            events_by_day = defaultdict(list)
+            for e in self.sorted_events():
+                day_str = event_start(e)[:10]
+                if first_str <= day_str <= last_str:
+                    events_by_day[day_str].append(e)
+
+            weeks = []
+            cur_day = first
+            for _ in range(self.config.WEEKS_TO_SHOW):
+                row = []
+                for __ in range(7):
+                    row.append(cur_day)
+                    cur_day += datetime.timedelta(days=1)
+                weeks.append(row)
+            return weeks, events_by_day
+
+        return self.cached_view('grid', today, build)
+
+    def day_events(self, day=None):
+        """Returns the events taking place on a day, including ones that started earlier"""
+        day = day or datetime.date.today()
+
+        def build():
+            day_str = day.isoformat()
+            result = []
+            for e in self.sorted_events():
+                start, end = event_start(e)[:10], event_end(e)[:10]
+                # All-day events end on the (exclusive) next day
+                all_day = 'dateTime' not in e['start']
+                if start <= day_str and (end > day_str or (not all_day and end >= day_str)):
+                    result.append(e)
+            return result
+
+        return self.cached_view('day', day, build)
+
+    def get_status(self):
+        """Returns sync status as a dictionary"""
+        return {
+            'running': self.running,
+            'events': len(self.events),
+            'version': self.version,
+            'last_sync': datetime.datetime.fromtimestamp(self.last_sync).isoformat() if self.last_sync else None,
+            'full_syncs': self.full_syncs,
+            'incremental_syncs': self.incremental_syncs
+        }
+
+
+class GridVersions:
+    """Versions of the rendered calendar grid, fingerprinted per day cell,
+    so clients can fetch only the cells that changed"""
+
+    def __init__(self, history=8):
+        self.lock = threading.Lock()
+        # version -> (grid key, {day: fingerprint}), oldest first
+        self.history = OrderedDict()
+        self.max_history = history
+        # Counting from the start time keeps versions of a previous run from matching
+        self.version = int(time.time())
+        self.partial = 0
+        self.not_modified = 0
+        self.resent = 0
+
+    def update(self, key, cells):
+        """Registers the rendered cells {day: html} of the grid key. Returns the current version."""
+        fingerprints = {day: hashlib.sha1(html.encode('utf-8')).hexdigest() for day, html in cells.items()}
+        with self.lock:
+            latest = self.history.get(self.version)
+            if latest != (key, fingerprints):
+                self.version += 1
+                self.history[self.version] = (key, fingerprints)
+                while len(self.history) > self.max_history:
+                    self.history.popitem(last=False)
+            return self.version
+
+    def changed_since(self, key, since):
+        """Days whose cell changed since version since, or None if the whole grid must be sent.
+
+        The grid key changes on day rollover or a WEEKS_TO_SHOW change, which needs the full grid.
+        """
+        with self.lock:
+            old = self.history.get(since)
+            current = self.history.get(self.version)
+            if old is None or current is None or old[0] != key or current[0] != key:
+                self.resent += 1
+                return None
+            changed = [day for day, fingerprint in current[1].items() if old[1].get(day) != fingerprint]
+            if changed:
+                self.partial += 1
+            else:
+                self.not_modified += 1
+            return changed
+
+    def get_status(self):
+        """Returns grid version statistics as a dictionary"""
+        return {
+            'version': self.version,
+            'partial_updates': self.partial,
+            'not_modified': self.not_modified,
+            'full_resends': self.resent
+        }
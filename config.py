@@ -50,17 +50,26 @@ class Config:
         "UNITS": "metric",
         "REFRESH_INTERVAL": 3600,
     }
+    WEATHER_FETCH_TIMEOUT = 15    # s
 
     DISCORD = {
         "BOT_TOKEN": os.getenv("DISCORD_BOT_TOKEN"),
         "CHANNEL_ID": os.getenv("DISCORD_CHANNEL_ID"),
-        "MESSAGE_COUNT": 10
+        "MESSAGE_COUNT": 10,
+        "POLL_INTERVAL": 30,              # s - new messages check
+        "FULL_REFRESH_INTERVAL": 600,     # s - full reload picks up edits and deletes
+        "FETCH_TIMEOUT": 15               # s
     }
 
     BROADLINK = {
         "DISCOVER_TIMEOUT": 5,
         "TARGET_TYPE_PREFIX": "RM4",
     }
+    SENSOR_POLL_INTERVAL = 60     # s - how often the sensor is read
+    SENSOR_MAX_FAILURES = 3       # Failed reads before the device is discovered again
+    SENSOR_RETRY_MIN = 30         # s - first retry delay when the device is not found
+    SENSOR_RETRY_MAX = 1800       # s - longest retry delay
+    SENSOR_HISTORY_SIZE = 1440    # Readings kept for /sensorhistory (24 h at 60 s)
 
     # Overlay parameters
     PHOTO_CONTAINER = {
@@ -130,8 +139,101 @@ class Config:
 
     # Temperature monitoring settings
     TEMP_MONITORING = True          # Enable CPU temperature monitoring
-    TEMP_WARNING = 65               # Temperature (°C) at which to switch to photo mode
+    TEMP_WARNING = 65               # Temperature (°C) at which videos are paused (thermal level "hot")
     TEMP_CRITICAL = 80              # Critical temperature (°C) at which to restart device
-    TEMP_RECOVERY = 60              # Temperature (°C) below which to return to normal mode
+    TEMP_RECOVERY = 60              # Temperature (°C) below which videos are shown again
     TEMP_CHECK_INTERVAL = 10        # Check interval (seconds)
 
+    # Thermal governor levels, from the coolest. A level applies once the (projected)
+    # temperature reaches its TEMP and is left when it falls THERMAL_HYSTERESIS below it.
+    THERMAL_LEVELS = [
+        # IMAGE_SCALE - photo size, POLL_FACTOR - polling interval multiplier,
+        # VIDEO - show videos, PREFETCH_DEPTH - photo batches kept ready
+        {"NAME": "normal", "TEMP": 0, "IMAGE_SCALE": 1.0, "POLL_FACTOR": 1, "VIDEO": True, "PREFETCH_DEPTH": 3},
+        {"NAME": "warm", "TEMP": 60, "IMAGE_SCALE": 0.75, "POLL_FACTOR": 2, "VIDEO": True, "PREFETCH_DEPTH": 2},
+        {"NAME": "hot", "TEMP": TEMP_WARNING, "IMAGE_SCALE": 0.5, "POLL_FACTOR": 3, "VIDEO": False, "PREFETCH_DEPTH": 1},
+        {"NAME": "very hot", "TEMP": 72, "IMAGE_SCALE": 0.5, "POLL_FACTOR": 5, "VIDEO": False, "PREFETCH_DEPTH": 0},
+    ]
+    THERMAL_HYSTERESIS = TEMP_WARNING - TEMP_RECOVERY  # °C
+    THERMAL_TREND_WINDOW = 300      # s - readings used for the temperature trend
+    THERMAL_TREND_LOOKAHEAD = 120   # s - how far ahead a rising trend is projected
+
+
+    # Media catalog settings
+    MEDIA_INDEX_REFRESH_INTERVAL = 24 * 3600  # s - how often an indexed album is re-scanned
+    MEDIA_INDEX_CHECK_INTERVAL = 60           # s - background refresh check interval
+    MEDIA_INDEX_ALBUMS_PER_CHECK = 2          # albums re-scanned per check
+
+    # Play history settings
+    PLAY_HISTORY_HALF_LIFE = 3600             # s - an album's pick weight doubles per this time unseen
+    PLAY_HISTORY_REPEAT_WINDOW = 30 * 24 * 3600  # s - items shown within this time are avoided
+    PLAY_HISTORY_START_TRIES = 8              # Batch start positions compared per pick
+    PLAY_HISTORY_MAX_ITEMS = 50000            # Remembered items before old ones are pruned
+
+    # Photo batch prefetch settings
+    PHOTO_PREFETCH_DEPTH = 3                  # Ready batches kept in memory
+    PHOTO_PREFETCH_MAX_AGE = 50 * 60          # s - baseUrls expire after ~60 min
+    PHOTO_PREFETCH_INTERVAL = 300             # s - check for expired batches
+    PHOTO_PREFETCH_RETRY = 60                 # s - wait after a failed prefetch
+
+    # Local image cache settings
+    MEDIA_CACHE_VARIANT = "w1200-h800"        # Photo size used until the front end reports its screen
+    MEDIA_SIZE_STEP = 32                      # px - photo box rounding, absorbs small window changes
+    MEDIA_CACHE_MAX_BYTES = 500 * 1024 * 1024 # Disk space used by cached photos
+    MEDIA_CACHE_BASE_URL_MAX_AGE = 50 * 60    # s - baseUrls expire after ~60 min
+    MEDIA_CACHE_FETCH_TIMEOUT = 30            # s
+    MEDIA_CACHE_HTTP_MAX_AGE = 365 * 24 * 3600  # s - browser cache lifetime
+
+    # Media display log settings
+    MEDIA_LOG_BUFFER_DIR = "/dev/shm"         # tmpfs buffer, falls back to the temp directory
+    MEDIA_LOG_FLUSH_INTERVAL = 300            # s - how often the buffer is written to the SD card
+    MEDIA_LOG_MAX_BYTES = 1024 * 1024         # media_display.log size before it is rotated
+    MEDIA_LOG_BACKUP_COUNT = 3                # Rotated files kept
+    MEDIA_LOG_DEDUP_WINDOW = 120              # s - identical lines within this time are logged once
+    MEDIA_LOG_CLIENT_BATCH = 10               # Display events the front end sends at once
+
+    # Local video cache settings
+    VIDEO_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # Disk space used by transcoded videos
+    VIDEO_CACHE_QUEUE_SIZE = 10               # Videos waiting for the transcoder
+    VIDEO_TRANSCODE_WIDTH = 1280              # px - largest size the Pi decodes smoothly in software
+    VIDEO_TRANSCODE_HEIGHT = 720              # px
+    VIDEO_TRANSCODE_BITRATE = "2M"            # ffmpeg video bitrate
+    VIDEO_TRANSCODE_THREADS = 2               # ffmpeg threads, leaves cores for the browser
+    VIDEO_TRANSCODE_TIMEOUT = 600             # s - per video
+
+    # Google API client settings
+    GOOGLE_HTTP_POOL_SIZE = 4                 # Connections shared by all Google API clients
+
+    # Warm start settings
+    WARM_START_SAVE_INTERVAL = 60             # s - how often changed state is written to disk
+    WARM_START_FIRST_PHOTO_TARGET = 45        # s - from boot to the first photo on screen
+    WARM_START_BOOT_WINDOW = 300              # s - app started this soon after boot counts as a reboot
+
+    # OAuth credential settings
+    CREDENTIALS_REFRESH_MARGIN = 600          # s - access token is refreshed this long before it expires
+    CREDENTIALS_CHECK_INTERVAL = 60           # s - how often the expiry is checked
+
+    # Google API quota budget
+    GOOGLE_DAILY_QUOTAS = {                   # Requests per day, per API
+        "photoslibrary": 10000,
+        "calendar": 1000000
+    }
+    QUOTA_BURST_SECONDS = 3600                # s - bucket holds this much of the daily quota
+    QUOTA_LOW_FRACTION = 0.2                  # Below this share of the bucket background work waits
+    QUOTA_BACKOFF_BASE = 5                    # s - first backoff after a 429 or 5xx
+    QUOTA_BACKOFF_MAX = 900                   # s - longest backoff
+
+    # Calendar sync settings
+    CALENDAR_SYNC_INTERVAL = 60               # s - how often Google Calendar is asked for changes
+
+    # Server-Sent Events settings
+    STREAM_KEEPALIVE = 30                     # s - comment sent on idle streams
+    STREAM_RETRY = 5                          # s - browser reconnect delay
+
+    # Page rendering settings
+    INDEX_WORKERS = 3                         # Sources loaded concurrently by index()
+    INDEX_DEADLINES = {                       # s - sources slower than this are filled in later
+        "photos": 5,
+        "calendar": 4,
+        "weather": 3
+    }
@@ -0,0 +1,156 @@
+import os
+import json
+import datetime
+import logging
+import threading
+
+import metrics
+
+logger = logging.getLogger('credentials')
+
+
+class CredentialManager:
+    """Single in-process copy of the OAuth credentials, refreshed ahead of expiry
+    and written back to the token file whenever the access token changes"""
+
+    def __init__(self, config, path):
+        self.config = config
+        self.path = path
+        self.lock = threading.Lock()
+        self.creds = None
+        self.loaded = False
+        self.saved_token = None
+        self.running = False
+        self.thread = None
+        self.wakeup = threading.Event()
+        self.refreshes = 0
+        self.failures = 0
+        self.last_error = None
+
+    def load(self):
+        """Reads the token file (caller holds the lock)"""
+        import google.oauth2.credentials
+        self.loaded = True
+        try:
+            with open(self.path, 'r') as token_file:
+                token_data = json.load(token_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reading {self.path}: {e}")
+            return
+        try:
+            self.creds = google.oauth2.credentials.Credentials.from_authorized_user_info(token_data)
+        except ValueError as e:
+            logger.error(f"Stored credentials are incomplete: {e}")
+            return
+        self.saved_token = self.creds.token
+
+    def save(self):
+        """Writes the credentials atomically, expiry included (caller holds the lock)"""
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as token_file:
+                token_file.write(self.creds.to_json())
+            os.replace(tmp_path, self.path)
+            self.saved_token = self.creds.token
+        except OSError as e:
+            logger.error(f"Error saving credentials: {e}")
+
+    def get(self):
+        """Returns the shared credentials, or None until the app is authorized"""
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            return self.creds
+
+    def set(self, creds):
+        """Stores credentials from a completed authorization"""
+        with self.lock:
+            self.loaded = True
+            self.creds = creds
+            self.save()
+        self.wakeup.set()
+
+    def seconds_left(self):
+        creds = self.creds
+        if creds is None or creds.expiry is None:
+            return None
+        # google-auth keeps expiry as naive UTC
+        return (creds.expiry - datetime.datetime.utcnow()).total_seconds()
+
+    def refresh_if_needed(self):
+        """Refreshes the access token when it is within CREDENTIALS_REFRESH_MARGIN of expiring"""
+        import google.auth.exceptions
+        import google.auth.transport.requests
+        creds = self.get()
+        if creds is None or not creds.refresh_token:
+            return False
+        left = self.seconds_left()
+        if left is not None and left > self.config.CREDENTIALS_REFRESH_MARGIN:
+            # Clients may have refreshed on their own after a 401
+            if creds.token != self.saved_token:
+                with self.lock:
+                    self.save()
+            return False
+        try:
+            with metrics.upstream('oauth2', 'token.refresh'):
+                creds.refresh(google.auth.transport.requests.Request())
+        except google.auth.exceptions.RefreshError as e:
+            self.failures += 1
+            self.last_error = str(e)
+            logger.error(f"Error refreshing credentials: {e}")
+            return False
+        with self.lock:
+            self.save()
+        self.refreshes += 1
+        self.last_error = None
+        logger.info(f"Access token refreshed, valid until {creds.expiry} UTC")
+        return True
+
+    def refresh_loop(self):
+        """Main refresh loop"""
+        logger.info("Credential refresh started")
+        while self.running:
+            try:
+                self.refresh_if_needed()
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                logger.error(f"Error checking credentials: {e}")
+            self.wakeup.wait(self.config.CREDENTIALS_CHECK_INTERVAL)
+            self.wakeup.clear()
+
+    def start(self):
+        """Starts refreshing in a separate thread"""
+        if self.running:
+            logger.warning("Credential refresh already running")
+            return False
+
+        self.running = True
+        self.thread = threading.Thread(target=self.refresh_loop, daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        """Stops refreshing"""
+        if not self.running:
+            return
+
+        self.running = False
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(2.0)  # Wait max 2 seconds
+        logger.info("Credential refresh stopped")
+
+    def get_status(self):
+        """Returns credential status as a dictionary"""
+        left = self.seconds_left()
+        return {
+            'running': self.running,
+            'authorized': self.creds is not None,
+            'expires_in': round(left) if left is not None else None,
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+            'last_error': self.last_error
+        }
@@ -0,0 +1,214 @@
+import time
+import logging
+import threading
+
+import metrics
+from event_bus import ChangeNotifier
+
+logger = logging.getLogger('discord_poller')
+
+# Largest page Discord returns for a channel messages request
+PAGE_LIMIT = 100
+
+
+def prepare_message(m, color_for):
+    """Adds the username color and makes sure attachment and embed images have a url"""
+    m['color'] = color_for(m['author']['username'])
+
+    # Ensure images are not suppressed (Proxy URLs are not filtered)
+    for attachment in m.get('attachments') or []:
+        if 'proxy_url' in attachment and 'url' not in attachment:
+            attachment['url'] = attachment['proxy_url']
+
+    # Ensure embed images are not suppressed
+    for embed in m.get('embeds') or []:
+        for key in ('image', 'thumbnail'):
+            if key in embed and 'proxy_url' in embed[key] and 'url' not in embed[key]:
+                embed[key]['url'] = embed[key]['proxy_url']
+    return m
+
+
+class DiscordPoller(ChangeNotifier):
+    """Keeps the latest channel messages in memory, fetching only new ones"""
+
+    def __init__(self, config, color_for):
+        self.config = config
+        self.color_for = color_for
+        self.session = None
+        self.running = False
+        self.thread = None
+        self.lock = threading.Lock()
+        # Newest first, like the Discord API returns them
+        self.messages = []
+        self.version = 0
+        self.last_full_refresh = 0
+        self.blocked_until = 0
+        self.requests = 0
+        self.rate_limited = 0
+        self.error = None
+
+    def url(self):
+        return f"{self.config.DISCORD_API_BASE_URL}/channels/{self.config.DISCORD['CHANNEL_ID']}/messages"
+
+    def http(self):
+        """HTTP session, created on first use to keep requests out of startup"""
+        if self.session is None:
+            import requests
+            self.session = requests.Session()
+        return self.session
+
+    def fetch(self, params):
+        """Requests messages, honoring Discord's rate limit headers. Returns a list or None.
+
+        Never waits: while rate limited it returns None at once, so a request
+        thread calling it answers from memory; poll_loop does the waiting.
+        """
+        if self.blocked_until > time.time():
+            return None
+
+        self.requests += 1
+        with metrics.upstream('discord', 'messages') as call:
+            r = self.http().get(
+                self.url(),
+                headers={"Authorization": f"Bot {self.config.DISCORD['BOT_TOKEN']}"},
+                params=params,
+                timeout=self.config.DISCORD['FETCH_TIMEOUT']
+            )
+            call.record(r.status_code, len(r.content))
+
+        if r.status_code == 429:
+            self.rate_limited += 1
+            try:
+                retry_after = float(r.json().get('retry_after', 1))
+            except ValueError:
+                retry_after = float(r.headers.get('Retry-After', 1))
+            self.blocked_until = time.time() + retry_after
+            logger.warning(f"Discord rate limited, retrying after {retry_after:.1f}s")
+            return None
+
+        # Bucket exhausted: don't ask again before it resets
+        if r.headers.get('X-RateLimit-Remaining') == '0':
+            reset_after = float(r.headers.get('X-RateLimit-Reset-After', 1))
+            self.blocked_until = time.time() + reset_after
+
+        if r.status_code != 200:
+            self.error = f"Unable to fetch messages (HTTP {r.status_code})"
+            logger.warning(self.error)
+            return None
+        self.error = None
+        return r.json()
+
+    def full_refresh(self):
+        """Replaces the ring with the latest messages, picking up edits and deletes"""
+        messages = self.fetch({"limit": self.config.DISCORD['MESSAGE_COUNT']})
+        if messages is None:
+            return False
+        messages = [prepare_message(m, self.color_for) for m in messages]
+        messages.sort(key=lambda m: int(m['id']), reverse=True)
+        with self.lock:
+            changed = messages != self.messages
+            self.messages = messages
+            if changed:
+                self.version += 1
+        self.last_full_refresh = time.time()
+        if changed:
+            self.notify_change()
+        return changed
+
+    def fetch_new(self):
+        """Fetches only messages newer than the newest one known"""
+        with self.lock:
+            after = self.messages[0]['id'] if self.messages else None
+        if after is None:
+            return self.full_refresh()
+
+        new_messages = self.fetch({"after": after, "limit": PAGE_LIMIT})
+        if not new_messages:
+            return False
+        new_messages = [prepare_message(m, self.color_for) for m in new_messages]
+        with self.lock:
+            known = {m['id'] for m in self.messages}
+            merged = [m for m in new_messages if m['id'] not in known] + self.messages
+            merged.sort(key=lambda m: int(m['id']), reverse=True)
+            self.messages = merged[:self.config.DISCORD['MESSAGE_COUNT']]
+            self.version += 1
+        logger.info(f"{len(new_messages)} new Discord messages")
+        self.notify_change()
+        return True
+
+    def poll(self):
+        """Brings the ring up to date. Returns True if messages changed."""
+        if time.time() - self.last_full_refresh >= self.config.DISCORD['FULL_REFRESH_INTERVAL']:
+            return self.full_refresh()
+        return self.fetch_new()
+
+    def restore(self, messages):
+        """Shows messages from a warm start snapshot until the first poll"""
+        with self.lock:
+            if self.messages:
+                return
+            self.messages = list(messages)
+            self.version += 1
+
+    def get(self):
+        """Returns the latest messages, newest first, or None if never fetched"""
+        # Restored messages are served while the poller catches up
+        if self.last_full_refresh == 0 and not self.messages:
+            import requests
+            try:
+                self.poll()
+            except requests.RequestException as e:
+                self.error = str(e)
+        with self.lock:
+            if not self.messages and self.error:
+                return None
+            return list(self.messages)
+
+    def poll_loop(self):
+        """Main polling loop"""
+        logger.info("Discord polling started")
+        while self.running:
+            try:
+                self.poll()
+            except Exception as e:
+                self.error = str(e)
+                logger.error(f"Error polling Discord: {e}")
+            blocked = self.blocked_until - time.time()
+            if blocked > self.config.DISCORD['POLL_INTERVAL']:
+                logger.info(f"Discord rate limit, waiting {blocked:.1f}s")
+            time.sleep(max(self.config.DISCORD['POLL_INTERVAL'], blocked))
+
+    def start(self):
+        """Starts polling in a separate thread"""
+        if not self.config.DISCORD['BOT_TOKEN'] or not self.config.DISCORD['CHANNEL_ID']:
+            logger.info("Discord not configured, polling disabled")
+            return False
+
+        if self.running:
+            logger.warning("Discord polling already running")
+            return False
+
+        self.running = True
+        self.thread = threading.Thread(target=self.poll_loop, daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        """Stops polling"""
+        if not self.running:
+            return
+
+        self.running = False
+        if self.thread:
+            self.thread.join(2.0)  # Wait max 2 seconds
+        logger.info("Discord polling stopped")
+
+    def get_status(self):
+        """Returns polling status as a dictionary"""
+        return {
+            'running': self.running,
+            'messages': len(self.messages),
+            'requests': self.requests,
+            'rate_limited': self.rate_limited,
+            'error': self.error
+        }
@@ -0,0 +1,113 @@
+import json
+import queue
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger('event_bus')
+
+
+class ChangeNotifier:
+    """Mixin for background services that tell listeners when their data changed"""
+
+    def add_listener(self, callback):
+        """Registers a callback called without arguments after a change"""
+        self.__dict__.setdefault('listeners', []).append(callback)
+
+    def notify_change(self):
+        for callback in self.__dict__.get('listeners', []):
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error in change listener: {e}")
+
+
+class Subscription:
+    """Messages not yet sent to one stream client, at most one per event type.
+
+    Every event carries the full state of its type, so a newer one replaces
+    the unsent one and a slow client only skips states it would never see.
+    """
+
+    def __init__(self):
+        self.ready = threading.Condition()
+        # type -> message, oldest first
+        self.pending = OrderedDict()
+        self.coalesced = 0
+
+    def put(self, event_type, message):
+        with self.ready:
+            if event_type in self.pending:
+                self.coalesced += 1
+            self.pending[event_type] = message
+            # Keeps event ids ascending, so Last-Event-ID replay misses nothing
+            self.pending.move_to_end(event_type)
+            self.ready.notify()
+
+    def get(self, timeout=None):
+        """Returns the oldest unsent message, raising queue.Empty after timeout"""
+        with self.ready:
+            if not self.ready.wait_for(lambda: self.pending, timeout):
+                raise queue.Empty
+            return self.pending.popitem(last=False)[1]
+
+
+class EventBus:
+    """Fans typed update events out to Server-Sent Events subscribers"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.last_id = 0
+        # type -> (event id, payload json, formatted message)
+        self.latest = {}
+        self.published = 0
+        self.skipped = 0
+
+    def publish(self, event_type, data):
+        """Sends an event to all subscribers unless the payload is unchanged"""
+        payload = json.dumps(data, sort_keys=True, default=str)
+        with self.lock:
+            last = self.latest.get(event_type)
+            if last and last[1] == payload:
+                self.skipped += 1
+                return False
+            self.last_id += 1
+            message = f"id: {self.last_id}\nevent: {event_type}\ndata: {payload}\n\n"
+            self.latest[event_type] = (self.last_id, payload, message)
+            self.published += 1
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            subscription.put(event_type, message)
+        return True
+
+    def subscribe(self):
+        subscription = Subscription()
+        with self.lock:
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def replay(self, after_id=0):
+        """Returns the latest message of each type newer than after_id, oldest first"""
+        with self.lock:
+            latest = sorted(self.latest.values())
+            # Client saw a previous run of the app, send everything
+            if after_id > self.last_id:
+                after_id = 0
+        return [message for event_id, _, message in latest if event_id > after_id]
+
+    def get_status(self):
+        """Returns bus statistics as a dictionary"""
+        with self.lock:
+            subscribers = list(self.subscribers)
+            status = {
+                'subscribers': len(subscribers),
+                'published': self.published,
+                'skipped_unchanged': self.skipped
+            }
+        status['coalesced'] = sum(s.coalesced for s in subscribers)
+        return status
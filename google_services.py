@@ -0,0 +1,203 @@
+import os
+import json
+import queue
+import logging
+import threading
+import urllib.parse
+
+import metrics
+from quota import QuotaHttp
+
+logger = logging.getLogger('google_services')
+
+# The Google API client libraries take a noticeable part of startup on the Pi,
+# so they are imported where they are first needed, or by warm_up()
+
+# Last path segment of a Google API request -> API method, for metrics
+API_OPERATIONS = {
+    'albums': 'albums.list',
+    'mediaItems:search': 'mediaItems.search',
+    'mediaItems:batchGet': 'mediaItems.batchGet',
+    'events': 'events.list'
+}
+
+
+def api_operation(uri):
+    return API_OPERATIONS.get(urllib.parse.urlsplit(uri).path.rsplit('/', 1)[-1], 'other')
+
+
+class PooledHttp:
+    """httplib2-compatible transport that can be shared between threads.
+
+    httplib2.Http is not thread-safe, so each request checks out its own
+    connection object from a pool and returns it afterwards, keeping the
+    TLS connections alive between requests.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.pool = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.created < self.size:
+                self.created += 1
+                import googleapiclient.http
+                return googleapiclient.http.build_http()
+        return self.pool.get()
+
+    def release(self, http):
+        self.pool.put(http)
+
+    def request(self, *args, **kwargs):
+        http = self.acquire()
+        try:
+            return http.request(*args, **kwargs)
+        finally:
+            self.release(http)
+
+    @property
+    def timeout(self):
+        import googleapiclient.http
+        return googleapiclient.http.DEFAULT_HTTP_TIMEOUT_SEC
+
+    def close(self):
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class ServiceRegistry:
+    """Process-wide Google API clients built once from stored discovery documents"""
+
+    def __init__(self, config, directory, quota=None):
+        """quota, a QuotaGovernor, is charged for every API request made by the clients"""
+        self.config = config
+        self.directory = directory
+        self.quota = quota
+        self.lock = threading.Lock()
+        self.http = PooledHttp(config.GOOGLE_HTTP_POOL_SIZE)
+        self.docs = {}
+        # (api, version, client_id) -> (credentials, client built for them)
+        self.services = {}
+        self.builds = 0
+        self.reuses = 0
+
+    def doc_path(self, api, version):
+        return os.path.join(self.directory, f"{api}.{version}.json")
+
+    def discovery_doc(self, api, version, discovery_url=None):
+        """Returns the parsed discovery document, loading it only once.
+
+        Looks in the local discovery directory first, then in the documents
+        bundled with google-api-python-client. Documents found in neither are
+        downloaded once and stored in the discovery directory.
+        """
+        key = (api, version)
+        with self.lock:
+            if key in self.docs:
+                return self.docs[key]
+
+        import googleapiclient.discovery_cache
+        # Disable cache warning
+        googleapiclient.discovery_cache.LOGGER.setLevel(logging.ERROR)
+        content = None
+        try:
+            with open(self.doc_path(api, version), 'r') as f:
+                content = f.read()
+        except OSError:
+            content = googleapiclient.discovery_cache.get_static_doc(api, version)
+        if content is None:
+            content = self.download_doc(api, version, discovery_url)
+
+        doc = json.loads(content)
+        with self.lock:
+            self.docs[key] = doc
+        return doc
+
+    def download_doc(self, api, version, discovery_url):
+        """Fetches a discovery document and stores it for later runs"""
+        import googleapiclient.discovery
+        if discovery_url is None:
+            discovery_url = googleapiclient.discovery.V2_DISCOVERY_URI.format(api=api, apiVersion=version)
+        logger.info(f"Downloading discovery document for {api} {version}")
+        resp, content = self.http.request(discovery_url)
+        if resp.status >= 400:
+            raise RuntimeError(f"Discovery document for {api} {version} unavailable: HTTP {resp.status}")
+        content = content.decode('utf-8') if isinstance(content, bytes) else content
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = self.doc_path(api, version) + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(content)
+            os.replace(tmp_path, self.doc_path(api, version))
+        except OSError as e:
+            logger.warning(f"Could not store discovery document for {api}: {e}")
+        return content
+
+    def get(self, api, version, creds, discovery_url=None):
+        """Returns a client for the given credentials.
+
+        Clients are shared per account, so a token refreshed by one request is
+        reused by the next instead of being refreshed again. New credentials,
+        as after a re-authorization, replace the client built for the old ones.
+        """
+        key = (api, version, creds.client_id)
+        with self.lock:
+            built_for, service = self.services.get(key, (None, None))
+            if built_for is creds:
+                self.reuses += 1
+                return service
+
+        import google_auth_httplib2
+        import googleapiclient.discovery
+        doc = self.discovery_doc(api, version, discovery_url)
+        authed_http = google_auth_httplib2.AuthorizedHttp(creds, http=self.http)
+        # Timed inside the quota, so only requests that went out are measured
+        authed_http = metrics.UpstreamHttp(authed_http, metrics.registry, api, api_operation)
+        if self.quota:
+            # Outside the authorization, so token refreshes are not charged
+            authed_http = QuotaHttp(authed_http, self.quota, api)
+        service = googleapiclient.discovery.build_from_document(doc, http=authed_http)
+        with self.lock:
+            # Another thread may have built it meanwhile, keep the first one
+            built_for, existing = self.services.get(key, (None, None))
+            if built_for is creds:
+                service = existing
+            else:
+                self.services[key] = (creds, service)
+            self.builds += 1
+        return service
+
+    def warm_up(self, apis):
+        """Loads the client libraries and discovery documents ahead of the first request.
+
+        apis is a list of (api, version, discovery_url).
+        """
+        # Imported for their side effect of loading the modules
+        import google_auth_httplib2
+        import googleapiclient.discovery
+        for api, version, discovery_url in apis:
+            try:
+                self.discovery_doc(api, version, discovery_url)
+            except Exception as e:
+                logger.warning(f"Could not load discovery document for {api}: {e}")
+
+    def get_status(self):
+        """Returns registry statistics as a dictionary"""
+        with self.lock:
+            return {
+                'discovery_docs': [f"{api}.{version}" for api, version in self.docs],
+                'clients': len(self.services),
+                'builds': self.builds,
+                'reuses': self.reuses,
+                'http_connections': self.http.created
+            }
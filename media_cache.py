@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import metrics
+
+logger = logging.getLogger('media_cache')
+
+INDEX_FILE = 'index.json'
+
+
+class MediaCache:
+    """Size-capped on-disk LRU cache of sized Google Photos images"""
+
+    def __init__(self, config, directory):
+        self.config = config
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.fetch_locks = {}
+        # key -> {'file', 'size', 'sha256', 'mime_type'}, least recently used first
+        self.entries = OrderedDict()
+        self.verified = set()
+        self.total_size = 0
+        # media item id -> (baseUrl, resolved at)
+        self.base_urls = {}
+        self.hits = 0
+        self.misses = 0
+
+    def open(self):
+        """Creates the cache directory and loads its index"""
+        os.makedirs(self.directory, exist_ok=True)
+        self.load_index()
+
+    # ------------------------------------------------------------------
+    # Index persistence
+    # ------------------------------------------------------------------
+
+    def index_path(self):
+        return os.path.join(self.directory, INDEX_FILE)
+
+    def load_index(self):
+        """Loads the cache index, ignoring entries whose files are gone"""
+        try:
+            with open(self.index_path(), 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = []
+        for key, entry in saved:
+            if os.path.exists(os.path.join(self.directory, entry['file'])):
+                self.entries[key] = entry
+                self.total_size += entry['size']
+        logger.info(f"Media cache: {len(self.entries)} files, {self.total_size / 1048576:.1f} MB")
+
+    def save_index(self):
+        """Writes the index atomically, in LRU order (caller holds the lock)"""
+        tmp_path = self.index_path() + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(list(self.entries.items()), f)
+            os.replace(tmp_path, self.index_path())
+        except OSError as e:
+            logger.error(f"Error saving media cache index: {e}")
+
+    # ------------------------------------------------------------------
+    # baseUrl bookkeeping
+    # ------------------------------------------------------------------
+
+    def remember(self, item_id, base_url):
+        """Records a freshly resolved baseUrl for a media item"""
+        with self.lock:
+            self.base_urls[item_id] = (base_url, time.time())
+
+    def base_url(self, item_id):
+        """Returns a baseUrl that has not expired yet, or None"""
+        with self.lock:
+            known = self.base_urls.get(item_id)
+        if known and time.time() - known[1] < self.config.MEDIA_CACHE_BASE_URL_MAX_AGE:
+            return known[0]
+        return None
+
+    def forget(self, item_id):
+        """Marks the known baseUrl as expired"""
+        with self.lock:
+            self.base_urls.pop(item_id, None)
+
+    # ------------------------------------------------------------------
+    # Cached files
+    # ------------------------------------------------------------------
+
+    def cache_key(self, item_id, variant):
+        return f"{item_id}={variant}"
+
+    def lookup(self, item_id, variant, count=True):
+        """Returns (path, mime_type) for a cached image, or None.
+
+        count=False leaves the hit and miss counters alone, for re-checks.
+        """
+        key = self.cache_key(item_id, variant)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                self.entries.move_to_end(key)
+        if not entry:
+            self.misses += count
+            return None
+
+        path = os.path.join(self.directory, entry['file'])
+        # Check each file once per run, a corrupt file is fetched again
+        if key not in self.verified:
+            try:
+                with open(path, 'rb') as f:
+                    ok = hashlib.sha256(f.read()).hexdigest() == entry['sha256']
+            except OSError:
+                ok = False
+            if not ok:
+                logger.warning(f"Checksum mismatch for cached {key}, discarding")
+                self.discard(key)
+                self.misses += count
+                return None
+            self.verified.add(key)
+        self.hits += count
+        return path, entry['mime_type']
+
+    def discard(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry:
+                self.total_size -= entry['size']
+                self.save_index()
+        if entry:
+            try:
+                os.remove(os.path.join(self.directory, entry['file']))
+            except OSError:
+                pass
+
+    def store(self, item_id, variant, content, mime_type):
+        """Writes an image into the cache and evicts least recently used files"""
+        key = self.cache_key(item_id, variant)
+        filename = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        path = os.path.join(self.directory, filename)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+        evicted = []
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old:
+                self.total_size -= old['size']
+            self.entries[key] = {
+                'file': filename,
+                'size': len(content),
+                'sha256': hashlib.sha256(content).hexdigest(),
+                'mime_type': mime_type
+            }
+            self.total_size += len(content)
+            self.verified.add(key)
+            while self.total_size > self.config.MEDIA_CACHE_MAX_BYTES and len(self.entries) > 1:
+                old_key, old_entry = self.entries.popitem(last=False)
+                self.total_size -= old_entry['size']
+                self.verified.discard(old_key)
+                evicted.append(old_entry['file'])
+            self.save_index()
+        for old_file in evicted:
+            try:
+                os.remove(os.path.join(self.directory, old_file))
+            except OSError:
+                pass
+        if evicted:
+            logger.info(f"Evicted {len(evicted)} files from media cache")
+        return path, mime_type
+
+    def download(self, item_id, variant, base_url):
+        """Downloads a sized variant. Returns (path, mime_type), or None if the baseUrl expired."""
+        import requests
+        with metrics.upstream('photoslibrary', 'download') as call:
+            r = requests.get(f"{base_url}={variant}", timeout=self.config.MEDIA_CACHE_FETCH_TIMEOUT)
+            call.record(r.status_code, len(r.content))
+        if r.status_code in (401, 403, 404):
+            self.forget(item_id)
+            return None
+        r.raise_for_status()
+        mime_type = r.headers.get('Content-Type', 'image/jpeg').split(';')[0]
+        return self.store(item_id, variant, r.content, mime_type)
+
+    def get(self, item_id, variant, resolve_base_url):
+        """Returns (path, mime_type) of a cached image, downloading it if needed.
+
+        resolve_base_url(item_id) is called to refresh an expired baseUrl.
+        """
+        cached = self.lookup(item_id, variant)
+        if cached:
+            return cached
+
+        # One download per image even if it is requested concurrently
+        key = self.cache_key(item_id, variant)
+        with self.lock:
+            fetch_lock = self.fetch_locks.setdefault(key, threading.Lock())
+        with fetch_lock:
+            try:
+                # Downloaded while this request waited; the miss is counted already
+                cached = self.lookup(item_id, variant, count=False)
+                if cached:
+                    return cached
+                base_url = self.base_url(item_id)
+                result = self.download(item_id, variant, base_url) if base_url else None
+                if result is None:
+                    base_url = resolve_base_url(item_id)
+                    if not base_url:
+                        return None
+                    self.remember(item_id, base_url)
+                    result = self.download(item_id, variant, base_url)
+                return result
+            finally:
+                # store() has recorded the entry by now. A request that got this
+                # lock before it was popped may not remove a newer one.
+                with self.lock:
+                    if self.fetch_locks.get(key) is fetch_lock:
+                        del self.fetch_locks[key]
+
+    def cached_variants(self):
+        """Returns {item id: variant} of cached images, the most recently used variant per item"""
+        with self.lock:
+            keys = list(self.entries)
+        return dict(key.rsplit('=', 1) for key in keys)
+
+    def warm(self, batch, variant_for):
+        """Downloads the photos of a batch ahead of display, each at variant_for(item)"""
+        for item in batch:
+            if item.get('mediaType') != 'photo' or not item.get('baseUrl'):
+                continue
+            try:
+                self.get(item['id'], variant_for(item), lambda item_id: None)
+            except Exception as e:
+                logger.warning(f"Error warming media cache for {item.get('filename')}: {e}")
+
+    def get_status(self):
+        """Returns cache usage as a dictionary"""
+        with self.lock:
+            files = len(self.entries)
+        return {
+            'files': files,
+            'size': f"{self.total_size / 1048576:.1f} MB",
+            'max_size': f"{self.config.MEDIA_CACHE_MAX_BYTES / 1048576:.1f} MB",
+            'hits': self.hits,
+            'misses': self.misses
+        }
@@ -0,0 +1,454 @@
+import json
+import time
+import random
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger('media_index')
+
+# Google Photos mediaItems().batchGet accepts at most 50 ids per call
+BATCH_GET_LIMIT = 50
+# google.rpc.Code of a batchGet result for an item that no longer exists
+NOT_FOUND = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS albums (
+    id TEXT PRIMARY KEY,
+    title TEXT,
+    media_items_count INTEGER,
+    indexed_count INTEGER,
+    refreshed_at REAL,
+    photo_count INTEGER,
+    video_count INTEGER,
+    first_time TEXT,
+    last_time TEXT
+);
+CREATE TABLE IF NOT EXISTS media_items (
+    id TEXT NOT NULL,
+    album_id TEXT NOT NULL,
+    filename TEXT,
+    creation_time TEXT NOT NULL,
+    media_type TEXT NOT NULL,
+    mime_type TEXT,
+    width INTEGER,
+    height INTEGER,
+    video_metadata TEXT,
+    PRIMARY KEY (album_id, id)
+);
+CREATE INDEX IF NOT EXISTS idx_media_items_type_album
+    ON media_items (media_type, album_id);
+CREATE INDEX IF NOT EXISTS idx_media_items_album_time
+    ON media_items (album_id, creation_time);
+"""
+
+# Per-album eligibility summary, added to catalogs created before it existed
+SUMMARY_COLUMNS = {
+    'photo_count': 'INTEGER',
+    'video_count': 'INTEGER',
+    'first_time': 'TEXT',
+    'last_time': 'TEXT'
+}
+
+UPDATE_SUMMARY = """
+UPDATE albums SET
+    photo_count = (SELECT COUNT(*) FROM media_items WHERE album_id = albums.id AND media_type = 'photo'),
+    video_count = (SELECT COUNT(*) FROM media_items WHERE album_id = albums.id AND media_type = 'video'),
+    first_time = (SELECT MIN(creation_time) FROM media_items WHERE album_id = albums.id),
+    last_time = (SELECT MAX(creation_time) FROM media_items WHERE album_id = albums.id)
+"""
+
+# MEDIA_TYPES settings, each with its own set of eligible albums
+MEDIA_TYPE_SETTINGS = ("all", "photo", "video")
+
+
+def media_type_of(item):
+    """Returns "video" or "photo" for a Google Photos media item"""
+    return "video" if 'video' in item.get('mediaMetadata', {}) else "photo"
+
+
+def media_type_setting(media_types):
+    """Normalizes a MEDIA_TYPES setting"""
+    return (media_types or "all").lower()
+
+
+def media_type_filter(media_types):
+    """Returns the list of stored media types matching a MEDIA_TYPES setting"""
+    media_types = media_type_setting(media_types)
+    if media_types == "all":
+        return ["photo", "video"]
+    return [media_types]
+
+
+class MediaIndex:
+    """On-disk catalog of album contents, so batches are picked without paging the API"""
+
+    def __init__(self, config, path):
+        self.config = config
+        self.path = path
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.service_factory = None
+        self.albums_loader = None
+        # Bumped whenever the set of albums with items may have changed
+        self.version = 0
+        self.conn = None
+
+    def open(self):
+        """Opens the catalog, creating or upgrading its tables"""
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.executescript(SCHEMA)
+            self.add_summary_columns()
+
+    def add_summary_columns(self):
+        """Adds and fills the album summary columns in an older catalog (caller holds the lock)"""
+        existing = {r['name'] for r in self.conn.execute("PRAGMA table_info(albums)")}
+        missing = [name for name in SUMMARY_COLUMNS if name not in existing]
+        for name in missing:
+            self.conn.execute(f"ALTER TABLE albums ADD COLUMN {name} {SUMMARY_COLUMNS[name]}")
+        if missing:
+            self.conn.execute(UPDATE_SUMMARY + " WHERE refreshed_at IS NOT NULL")
+            logger.info("Built album summaries for existing media index")
+
+    # ------------------------------------------------------------------
+    # Catalog maintenance
+    # ------------------------------------------------------------------
+
+    def fetch_album_items(self, photos_service, album_id):
+        """Pages through all media items of an album"""
+        items = []
+        next_page_token = None
+        while True:
+            resp = photos_service.mediaItems().search(
+                body={'albumId': album_id, 'pageSize': 100, 'pageToken': next_page_token}
+            ).execute()
+            items.extend(resp.get('mediaItems', []))
+            next_page_token = resp.get('nextPageToken')
+            if not next_page_token:
+                break
+        return items
+
+    def sync_albums(self, albums):
+        """Stores album metadata and drops albums that no longer exist"""
+        now_ids = [a['id'] for a in albums]
+        with self.lock, self.conn:
+            for album in albums:
+                self.conn.execute(
+                    "INSERT INTO albums (id, title, media_items_count) VALUES (?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET title = excluded.title, "
+                    "media_items_count = excluded.media_items_count",
+                    (album['id'], album.get('title', 'Unknown Album'),
+                     int(album.get('mediaItemsCount', 0) or 0))
+                )
+            known = [r['id'] for r in self.conn.execute("SELECT id FROM albums")]
+            gone = set(known) - set(now_ids)
+            for album_id in gone:
+                self.conn.execute("DELETE FROM media_items WHERE album_id = ?", (album_id,))
+                self.conn.execute("DELETE FROM albums WHERE id = ?", (album_id,))
+            if gone:
+                self.version += 1
+        if gone:
+            logger.info(f"Removed {len(gone)} deleted albums from media index")
+
+    def store_album_items(self, album, items):
+        """Replaces the stored contents of an album with freshly fetched items"""
+        rows = []
+        for item in items:
+            meta = item.get('mediaMetadata', {})
+            # Items without creationTime were never shown, keep it that way
+            if not meta.get('creationTime'):
+                continue
+            rows.append((
+                item['id'],
+                album['id'],
+                item.get('filename', 'Unknown'),
+                meta['creationTime'],
+                media_type_of(item),
+                item.get('mimeType', ''),
+                int(meta.get('width', 0) or 0),
+                int(meta.get('height', 0) or 0),
+                json.dumps(meta.get('video', {}))
+            ))
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM media_items WHERE album_id = ?", (album['id'],))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO media_items (id, album_id, filename, creation_time, "
+                "media_type, mime_type, width, height, video_metadata) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self.conn.execute(
+                "INSERT INTO albums (id, title, media_items_count, indexed_count, refreshed_at) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET "
+                "title = excluded.title, indexed_count = excluded.indexed_count, "
+                "refreshed_at = excluded.refreshed_at",
+                (album['id'], album.get('title', 'Unknown Album'),
+                 int(album.get('mediaItemsCount', len(items)) or 0), len(items), time.time())
+            )
+            self.conn.execute(UPDATE_SUMMARY + " WHERE id = ?", (album['id'],))
+            self.version += 1
+        return len(rows)
+
+    def refresh_album(self, photos_service, album):
+        """Fetches an album from the API and stores its items"""
+        items = self.fetch_album_items(photos_service, album['id'])
+        stored = self.store_album_items(album, items)
+        logger.info(f"Indexed album {album.get('title', 'Unknown Album')}: {stored} items")
+        return stored
+
+    def stale_albums(self, limit):
+        """Returns albums never indexed or older than the refresh interval.
+
+        Sizes are not compared: mediaItemsCount comes from the album cache,
+        which can lag behind the API for weeks, so an album whose size
+        changed would look stale again right after every refresh.
+        """
+        cutoff = time.time() - self.config.MEDIA_INDEX_REFRESH_INTERVAL
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, title, media_items_count FROM albums "
+                "WHERE refreshed_at IS NULL OR refreshed_at < ? "
+                "ORDER BY refreshed_at IS NOT NULL, refreshed_at LIMIT ?",
+                (cutoff, limit)
+            ).fetchall()
+        return [{'id': r['id'], 'title': r['title'], 'mediaItemsCount': r['media_items_count']}
+                for r in rows]
+
+    def unindexed_albums(self):
+        """Returns albums whose contents have not been fetched yet"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, title, media_items_count FROM albums WHERE refreshed_at IS NULL"
+            ).fetchall()
+        return [{'id': r['id'], 'title': r['title'], 'mediaItemsCount': r['media_items_count']}
+                for r in rows]
+
+    def remove_items(self, item_ids):
+        """Drops media items that the API no longer returns"""
+        if not item_ids:
+            return
+        marks = ",".join("?" * len(item_ids))
+        with self.lock, self.conn:
+            album_ids = [r['album_id'] for r in self.conn.execute(
+                f"SELECT DISTINCT album_id FROM media_items WHERE id IN ({marks})", list(item_ids)
+            )]
+            self.conn.executemany("DELETE FROM media_items WHERE id = ?",
+                                  [(i,) for i in item_ids])
+            self.conn.executemany(UPDATE_SUMMARY + " WHERE id = ?", [(a,) for a in album_ids])
+            self.version += 1
+
+    def eligibility_clause(self, media_types, taken_after=None, taken_before=None):
+        """SQL condition and parameters selecting albums from their summary"""
+        counts = [f"{media_type}_count > 0" for media_type in media_type_filter(media_types)]
+        conditions = ["(" + " OR ".join(counts) + ")"]
+        params = []
+        # creationTime strings are RFC 3339 in UTC and compare in time order
+        if taken_after:
+            conditions.append("last_time >= ?")
+            params.append(taken_after)
+        if taken_before:
+            conditions.append("first_time <= ?")
+            params.append(taken_before)
+        return " AND ".join(conditions), params
+
+    def album_ids(self, media_types, taken_after=None, taken_before=None):
+        """Returns the ids of albums that have items of the given MEDIA_TYPES,
+        optionally only those with items taken within a date range"""
+        clause, params = self.eligibility_clause(media_types, taken_after, taken_before)
+        with self.lock:
+            rows = self.conn.execute(f"SELECT id FROM albums WHERE {clause}", params).fetchall()
+        return [r['id'] for r in rows]
+
+    def album_summaries(self):
+        """Returns {album id: summary} for indexed albums"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, title, photo_count, video_count, first_time, last_time, refreshed_at "
+                "FROM albums WHERE refreshed_at IS NOT NULL"
+            ).fetchall()
+        return {r['id']: dict(r) for r in rows}
+
+    # ------------------------------------------------------------------
+    # Batch selection
+    # ------------------------------------------------------------------
+
+    def pick_batch(self, media_types, count, album_id=None, start_picker=None):
+        """Picks a random album (or the given one) and a run of consecutive items from it.
+
+        start_picker(item_ids, count) may choose where the run starts, otherwise it is random.
+        Returns (items, album_title); items are catalog rows without baseUrls.
+        """
+        types = media_type_filter(media_types)
+        marks = ",".join("?" * len(types))
+        if album_id is None:
+            clause, params = self.eligibility_clause(media_types)
+            album_clause = f"(SELECT id FROM albums WHERE {clause} ORDER BY random() LIMIT 1)"
+            params = params + types
+        else:
+            album_clause = "?"
+            params = [album_id] + types
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT m.id, m.album_id, a.title, m.filename, m.creation_time, m.media_type, "
+                f"m.mime_type, m.width, m.height, m.video_metadata "
+                f"FROM media_items m JOIN albums a ON a.id = m.album_id "
+                f"WHERE m.album_id = {album_clause} AND m.media_type IN ({marks}) "
+                f"ORDER BY m.creation_time",
+                params
+            ).fetchall()
+        if not rows:
+            return [], None
+
+        total = len(rows)
+        if start_picker:
+            start_index = start_picker([r['id'] for r in rows], count)
+        else:
+            start_index = random.randint(0, total - 1)
+        batch = [self.row_to_item(rows[(start_index + i) % total])
+                 for i in range(min(count, total))]
+        return batch, rows[0]['title'] or 'Unknown Album'
+
+    def items_by_album(self, item_ids):
+        """Groups the catalog items with the given ids by album.
+
+        Returns {album_id: (album_title, items in creation time order)}.
+        """
+        item_ids = list(item_ids)
+        rows = []
+        with self.lock:
+            # Stay below SQLite's limit on query parameters
+            for i in range(0, len(item_ids), 500):
+                chunk = item_ids[i:i + 500]
+                rows.extend(self.conn.execute(
+                    f"SELECT m.id, m.album_id, a.title, m.filename, m.creation_time, m.media_type, "
+                    f"m.mime_type, m.width, m.height, m.video_metadata "
+                    f"FROM media_items m JOIN albums a ON a.id = m.album_id "
+                    f"WHERE m.id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall())
+        albums = {}
+        for row in sorted(rows, key=lambda r: r['creation_time']):
+            title, items = albums.setdefault(row['album_id'], (row['title'] or 'Unknown Album', []))
+            items.append(self.row_to_item(row))
+        return albums
+
+    def row_to_item(self, row):
+        """Converts a catalog row to the batch item format used by the front end"""
+        return {
+            'id': row['id'],
+            'albumId': row['album_id'],
+            'baseUrl': '',
+            'photo_time': row['creation_time'],
+            'filename': row['filename'],
+            'mediaType': row['media_type'],
+            'videoMetadata': json.loads(row['video_metadata'] or '{}'),
+            'mimeType': row['mime_type'],
+            'width': row['width'],
+            'height': row['height']
+        }
+
+    def resolve_base_urls(self, photos_service, batch):
+        """Fills in fresh baseUrls for the chosen items with mediaItems().batchGet.
+
+        Items the API no longer knows are dropped from the batch and the catalog;
+        items that failed for another reason are only dropped from the batch.
+        """
+        base_urls = {}
+        missing = []
+        ids = [item['id'] for item in batch]
+        for i in range(0, len(ids), BATCH_GET_LIMIT):
+            chunk = ids[i:i + BATCH_GET_LIMIT]
+            resp = photos_service.mediaItems().batchGet(mediaItemIds=chunk).execute()
+            # Results come in request order; failed ones carry a status instead of an id
+            for item_id, result in zip(chunk, resp.get('mediaItemResults', [])):
+                media_item = result.get('mediaItem')
+                if media_item:
+                    base_urls[media_item['id']] = media_item.get('baseUrl', '')
+                elif result.get('status', {}).get('code') == NOT_FOUND:
+                    missing.append(item_id)
+                else:
+                    logger.warning(f"Could not resolve {item_id}: {result.get('status')}")
+
+        if missing:
+            logger.info(f"{len(missing)} indexed items no longer available, removing")
+            self.remove_items(missing)
+
+        resolved = []
+        for item in batch:
+            if base_urls.get(item['id']):
+                item['baseUrl'] = base_urls[item['id']]
+                resolved.append(item)
+        return resolved
+
+    def get_status(self):
+        """Returns catalog size information as a dictionary"""
+        with self.lock:
+            albums = self.conn.execute(
+                "SELECT COUNT(*) AS total, COUNT(refreshed_at) AS indexed FROM albums"
+            ).fetchone()
+            items = self.conn.execute("SELECT COUNT(*) FROM media_items").fetchone()[0]
+            eligible = self.conn.execute(
+                "SELECT COUNT(CASE WHEN photo_count > 0 THEN 1 END) AS photo, "
+                "COUNT(CASE WHEN video_count > 0 THEN 1 END) AS video FROM albums"
+            ).fetchone()
+        return {
+            'running': self.running,
+            'albums': albums['total'],
+            'albums_indexed': albums['indexed'],
+            'albums_with_photos': eligible['photo'],
+            'albums_with_videos': eligible['video'],
+            'media_items': items
+        }
+
+    # ------------------------------------------------------------------
+    # Background refresh
+    # ------------------------------------------------------------------
+
+    def refresh_stale(self):
+        """Brings a few stale albums up to date"""
+        photos_service = self.service_factory()
+        if photos_service is None:
+            return
+        self.sync_albums(self.albums_loader(photos_service))
+        for album in self.stale_albums(self.config.MEDIA_INDEX_ALBUMS_PER_CHECK):
+            self.refresh_album(photos_service, album)
+
+    def refresh_loop(self):
+        """Main refresh loop"""
+        logger.info("Media index refresh started")
+        while self.running:
+            try:
+                self.refresh_stale()
+            except Exception as e:
+                logger.error(f"Error refreshing media index: {e}")
+            time.sleep(self.config.MEDIA_INDEX_CHECK_INTERVAL)
+
+    def start(self, service_factory, albums_loader):
+        """Starts incremental refresh in a separate thread.
+
+        service_factory returns a Photos service (or None without credentials),
+        albums_loader returns the album list for that service.
+        """
+        if self.running:
+            logger.warning("Media index refresh already running")
+            return False
+
+        self.service_factory = service_factory
+        self.albums_loader = albums_loader
+        self.running = True
+        self.thread = threading.Thread(target=self.refresh_loop, daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        """Stops background refresh"""
+        if not self.running:
+            return
+
+        self.running = False
+        if self.thread:
+            self.thread.join(2.0)  # Wait max 2 seconds
+        logger.info("Media index refresh stopped")
@@ -0,0 +1,167 @@
+import os
+import queue
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener
+
+logger = logging.getLogger('media_log')
+
+
+class TmpfsBatchHandler(logging.Handler):
+    """Appends records to a buffer in tmpfs and moves them to the log file in batches.
+
+    The SD card sees one append per flush instead of one write per record.
+    Records repeating a message logged within dedup_window seconds are dropped.
+    """
+
+    def __init__(self, path, buffer_dir, max_bytes, backup_count, dedup_window):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.dedup_window = dedup_window
+        if not buffer_dir or not os.path.isdir(buffer_dir):
+            buffer_dir = tempfile.gettempdir()
+        self.buffer_path = os.path.join(buffer_dir, os.path.basename(path) + '.buffer')
+        self.buffer_lock = threading.Lock()
+        self.recent = OrderedDict()
+        self.buffered = 0
+        self.written = 0
+        self.duplicates = 0
+        self.flushes = 0
+        self.rotations = 0
+
+    def is_duplicate(self, message, now):
+        while self.recent and next(iter(self.recent.values())) < now - self.dedup_window:
+            self.recent.popitem(last=False)
+        if message in self.recent:
+            return True
+        self.recent[message] = now
+        return False
+
+    def emit(self, record):
+        try:
+            if self.is_duplicate(record.getMessage(), record.created):
+                self.duplicates += 1
+                return
+            line = self.format(record) + '\n'
+            with self.buffer_lock:
+                with open(self.buffer_path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+                self.buffered += 1
+        except Exception:
+            self.handleError(record)
+
+    def rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            src, dst = f"{self.path}.{i}", f"{self.path}.{i + 1}"
+            if os.path.exists(src):
+                os.replace(src, dst)
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.rotations += 1
+
+    def flush(self):
+        """Moves the buffered records to the log file in one write"""
+        with self.buffer_lock:
+            try:
+                with open(self.buffer_path, 'r', encoding='utf-8') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                return
+            if data:
+                try:
+                    if os.path.getsize(self.path) + len(data.encode('utf-8')) > self.max_bytes:
+                        self.rotate()
+                except FileNotFoundError:
+                    pass
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(data)
+                self.written += self.buffered
+                self.flushes += 1
+            os.remove(self.buffer_path)
+            self.buffered = 0
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+class MediaDisplayLog:
+    """Non-blocking logging pipeline: loggers put records on a queue, a listener
+    thread writes them to the tmpfs buffer, and a flush thread moves them to disk"""
+
+    def __init__(self, config, path):
+        self.config = config
+        self.queue = queue.Queue(-1)
+        self.handler = TmpfsBatchHandler(
+            path,
+            config.MEDIA_LOG_BUFFER_DIR,
+            config.MEDIA_LOG_MAX_BYTES,
+            config.MEDIA_LOG_BACKUP_COUNT,
+            config.MEDIA_LOG_DEDUP_WINDOW
+        )
+        self.listener = QueueListener(self.queue, self.handler)
+        self.running = False
+        self.thread = None
+        self.wakeup = threading.Event()
+
+    def attach(self, target_logger, formatter):
+        """Routes a logger's records through the queue"""
+        self.handler.setFormatter(formatter)
+        target_logger.addHandler(QueueHandler(self.queue))
+
+    def flush_loop(self):
+        """Main flush loop"""
+        logger.info("Media display log flushing started")
+        while self.running:
+            self.wakeup.wait(self.config.MEDIA_LOG_FLUSH_INTERVAL)
+            self.wakeup.clear()
+            try:
+                self.handler.flush()
+            except Exception as e:
+                logger.error(f"Error flushing media display log: {e}")
+
+    def start(self):
+        """Starts the listener and the flush thread"""
+        if self.running:
+            logger.warning("Media display log already running")
+            return False
+
+        # Records buffered before a crash are still in tmpfs
+        self.handler.flush()
+        self.running = True
+        self.listener.start()
+        self.thread = threading.Thread(target=self.flush_loop, daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        """Writes out queued records and stops"""
+        if not self.running:
+            return
+
+        self.running = False
+        self.listener.stop()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(2.0)  # Wait max 2 seconds
+        self.handler.flush()
+        logger.info("Media display log stopped")
+
+    def get_status(self):
+        """Returns pipeline statistics as a dictionary"""
+        return {
+            'running': self.running,
+            'queued': self.queue.qsize(),
+            'buffered': self.handler.buffered,
+            'written': self.handler.written,
+            'duplicates_dropped': self.handler.duplicates,
+            'flushes': self.handler.flushes,
+            'rotations': self.handler.rotations,
+            'buffer': self.handler.buffer_path
+        }
@@ -0,0 +1,55 @@
+import re
+import math
+
+# Largest side requested from Google Photos or accepted by /media
+MAX_SIDE = 4096
+
+
+def parse_length(value, total):
+    """Converts a PHOTO_CONTAINER length ("60%", "800px" or a number) to pixels of total"""
+    value = str(value).strip()
+    if value.endswith('%'):
+        return total * float(value[:-1]) / 100
+    if value.endswith('px'):
+        return float(value[:-2])
+    return float(value)
+
+
+def parse_variant(variant):
+    """Returns (width, height) of a size parameter string like "w1200-h800" """
+    match = re.match(r'w(\d+)-h(\d+)', variant)
+    return (int(match.group(1)), int(match.group(2))) if match else (1200, 800)
+
+
+def size_variant(width, height):
+    """Google Photos size parameters for a box"""
+    return f"w{width}-h{height}"
+
+
+def photo_box(container, screen_width, screen_height, dpr, step=1):
+    """Returns the device pixel (width, height) of the photo area, rounded up to step"""
+    width = parse_length(container.get('width', '100%'), screen_width) * dpr
+    height = parse_length(container.get('height', '100%'), screen_height) * dpr
+    return (clamp_side(math.ceil(width / step) * step),
+            clamp_side(math.ceil(height / step) * step))
+
+
+def fit_size(width, height, box_width, box_height, step=1):
+    """Size at which a width x height item fills the box without upscaling,
+    rounded down to step.
+
+    Items with unknown dimensions get the whole box.
+    """
+    if not width or not height:
+        return snap_side(box_width, step), snap_side(box_height, step)
+    scale = min(box_width / width, box_height / height, 1.0)
+    return snap_side(math.ceil(width * scale), step), snap_side(math.ceil(height * scale), step)
+
+
+def clamp_side(value):
+    return max(1, min(int(value), MAX_SIDE))
+
+
+def snap_side(value, step=1):
+    """Rounds a side down to a multiple of step, keeping at least one step"""
+    return clamp_side(max(step, int(value) // step * step))
@@ -0,0 +1,236 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# s - upper bounds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# name -> (type, help)
+METRICS = {
+    'kiosk_http_request_duration_seconds': ('histogram', 'Time spent handling requests, per route'),
+    'kiosk_http_requests_total': ('counter', 'Requests handled, per route and status'),
+    'kiosk_http_response_bytes_total': ('counter', 'Response body bytes sent, per route'),
+    'kiosk_template_render_duration_seconds': ('histogram', 'Time spent rendering templates'),
+    'kiosk_upstream_request_duration_seconds': ('histogram', 'Time spent waiting for upstream services'),
+    'kiosk_upstream_requests_total': ('counter', 'Upstream requests, per response status'),
+    'kiosk_upstream_errors_total': ('counter', 'Failed upstream requests, per error'),
+    'kiosk_upstream_received_bytes_total': ('counter', 'Response bytes received from upstream services'),
+    'kiosk_cache_hits_total': ('counter', 'Cache lookups answered from the cache'),
+    'kiosk_cache_misses_total': ('counter', 'Cache lookups that had to fetch or build'),
+    'kiosk_cache_hit_ratio': ('gauge', 'Share of cache lookups answered from the cache')
+}
+
+
+class Histogram:
+    """Latency histogram with fixed buckets, exposed in the Prometheus layout"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # Per bucket, the last one is +Inf; made cumulative when rendered
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class UpstreamCall:
+    """Outcome of an upstream request, filled in by the caller"""
+
+    def __init__(self):
+        self.status = None
+        self.bytes = 0
+
+    def record(self, status, size=0):
+        self.status = status
+        self.bytes = size
+
+
+def error_kind(e):
+    """Bounded label for an exception: the HTTP status if it carries one, else its class"""
+    resp = getattr(e, 'resp', None)
+    status = getattr(resp, 'status', None)
+    if status:
+        return f"http_{status}"
+    return type(e).__name__
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in labels) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """Request, upstream, template and cache metrics kept in memory and
+    rendered in the Prometheus text format.
+
+    Recording takes one lock and a few additions, cheap enough to stay on.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # name -> {labels: value or Histogram}, labels a tuple of (name, value)
+        self.values = {name: {} for name in METRICS}
+        # cache name -> function returning (hits, misses)
+        self.caches = {}
+
+    def inc(self, name, labels, amount=1):
+        with self.lock:
+            series = self.values[name]
+            series[labels] = series.get(labels, 0) + amount
+
+    def observe(self, name, labels, seconds):
+        with self.lock:
+            histogram = self.values[name].get(labels)
+            if histogram is None:
+                histogram = self.values[name][labels] = Histogram()
+            histogram.observe(seconds)
+
+    def observe_request(self, route, method, status, seconds, size):
+        labels = (('route', route), ('method', method))
+        self.observe('kiosk_http_request_duration_seconds', labels, seconds)
+        self.inc('kiosk_http_requests_total', labels + (('status', status),))
+        if size:
+            self.inc('kiosk_http_response_bytes_total', (('route', route),), size)
+
+    def observe_upstream(self, upstream, operation, seconds, call, error=None):
+        labels = (('upstream', upstream), ('operation', operation))
+        self.observe('kiosk_upstream_request_duration_seconds', labels, seconds)
+        self.inc('kiosk_upstream_requests_total',
+                 labels + (('status', call.status or ('error' if error else 'ok')),))
+        if error is None and call.status and call.status >= 400:
+            error = f"http_{call.status}"
+        if error:
+            self.inc('kiosk_upstream_errors_total', labels + (('error', error),))
+        if call.bytes:
+            self.inc('kiosk_upstream_received_bytes_total', labels, call.bytes)
+
+    @contextmanager
+    def upstream(self, upstream, operation):
+        """Times the upstream request made in the with block.
+
+        The block can record the response status and size on the yielded
+        UpstreamCall; an exception is counted as an error and re-raised.
+        """
+        call = UpstreamCall()
+        started = time.perf_counter()
+        try:
+            yield call
+        except Exception as e:
+            self.observe_upstream(upstream, operation, time.perf_counter() - started, call, error_kind(e))
+            raise
+        self.observe_upstream(upstream, operation, time.perf_counter() - started, call)
+
+    def add_cache(self, name, counts):
+        """Exposes a cache's hit ratio; counts() returns the (hits, misses) it keeps anyway"""
+        self.caches[name] = counts
+
+    def cache_values(self):
+        values = {'kiosk_cache_hits_total': {}, 'kiosk_cache_misses_total': {}, 'kiosk_cache_hit_ratio': {}}
+        for name, counts in self.caches.items():
+            hits, misses = counts()
+            labels = (('cache', name),)
+            values['kiosk_cache_hits_total'][labels] = hits
+            values['kiosk_cache_misses_total'][labels] = misses
+            values['kiosk_cache_hit_ratio'][labels] = round(hits / (hits + misses), 4) if hits + misses else 0.0
+        return values
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self.lock:
+            values = {name: {labels: (value if not isinstance(value, Histogram) else
+                                      (list(value.counts), value.sum, value.count))
+                             for labels, value in series.items()}
+                      for name, series in self.values.items()}
+        values.update(self.cache_values())
+
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(values[name].items(), key=lambda s: str(s[0])):
+                if kind != 'histogram':
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(LATENCY_BUCKETS + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(total)}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def instrument(self, app):
+        """Times every request and template render of a Flask app"""
+        from flask import g, request, before_render_template, template_rendered
+
+        @app.before_request
+        def start_request_timer():
+            g.metrics_started = time.perf_counter()
+
+        @app.after_request
+        def record_request(response):
+            started = g.pop('metrics_started', None)
+            if started is not None:
+                # The rule, not the path, keeps the number of series bounded
+                route = request.url_rule.rule if request.url_rule else 'unmatched'
+                self.observe_request(route, request.method, response.status_code,
+                                     time.perf_counter() - started, response.content_length)
+            return response
+
+        rendering = threading.local()
+
+        def template_started(sender, template, context, **extra):
+            rendering.__dict__.setdefault('started', []).append(time.perf_counter())
+
+        def template_done(sender, template, context, **extra):
+            started = getattr(rendering, 'started', None)
+            if started:
+                self.observe('kiosk_template_render_duration_seconds',
+                             (('template', template.name or 'string'),), time.perf_counter() - started.pop())
+
+        # Flask's signals hold receivers weakly
+        before_render_template.connect(template_started, app, weak=False)
+        template_rendered.connect(template_done, app, weak=False)
+
+
+class UpstreamHttp:
+    """httplib2-compatible wrapper that records each request as an upstream call"""
+
+    def __init__(self, http, registry, upstream, operation):
+        """operation(uri) names the API method a request belongs to"""
+        self.http = http
+        self.registry = registry
+        self.upstream = upstream
+        self.operation = operation
+
+    def request(self, uri, *args, **kwargs):
+        with self.registry.upstream(self.upstream, self.operation(uri)) as call:
+            resp, content = self.http.request(uri, *args, **kwargs)
+            call.record(resp.status, len(content) if content else 0)
+        return resp, content
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+
+# Shared by all modules, the way loggers are
+registry = MetricsRegistry()
+upstream = registry.upstream
+add_cache = registry.add_cache
+render = registry.render
+instrument = registry.instrument
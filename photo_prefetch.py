@@ -0,0 +1,140 @@
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger('photo_prefetch')
+
+
+class PhotoPrefetcher:
+    """Keeps a bounded queue of ready-to-show photo batches"""
+
+    def __init__(self, config, batch_factory):
+        """batch_factory returns (batch, album_title), or None when it can't run yet"""
+        self.config = config
+        self.batch_factory = batch_factory
+        self.running = False
+        self.thread = None
+        self.queue = deque()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.generation = 0
+        # Lowered by the thermal governor to cut background work
+        self.depth_limit = None
+        self.hits = 0
+        self.misses = 0
+
+    def depth(self):
+        """Number of batches the worker keeps ready"""
+        if self.depth_limit is not None:
+            return min(self.config.PHOTO_PREFETCH_DEPTH, self.depth_limit)
+        return self.config.PHOTO_PREFETCH_DEPTH
+
+    def drop_expired(self):
+        """Drops batches whose baseUrls are about to expire"""
+        cutoff = time.time() - self.config.PHOTO_PREFETCH_MAX_AGE
+        with self.lock:
+            while self.queue and self.queue[0]['created'] < cutoff:
+                entry = self.queue.popleft()
+                logger.info(f"Dropping expired prefetched batch from {entry['album_title']}")
+
+    def pop(self):
+        """Returns (batch, album_title) of the oldest ready batch, or None"""
+        self.drop_expired()
+        with self.lock:
+            entry = self.queue.popleft() if self.queue else None
+            if entry:
+                self.hits += 1
+            else:
+                self.misses += 1
+        # Refill in the background
+        self.wakeup.set()
+        if entry is None:
+            return None
+        return entry['batch'], entry['album_title']
+
+    def flush(self, reason=""):
+        """Discards all ready batches, e.g. after MEDIA_TYPES changed"""
+        with self.lock:
+            dropped = len(self.queue)
+            self.queue.clear()
+            self.generation += 1
+        logger.info(f"Flushed {dropped} prefetched batches {reason}".strip())
+        self.wakeup.set()
+
+    def fill(self):
+        """Produces batches until the queue is full. Returns False if a batch could not be made."""
+        while self.running:
+            self.drop_expired()
+            with self.lock:
+                if len(self.queue) >= self.depth():
+                    return True
+                generation = self.generation
+            result = self.batch_factory()
+            if not result:
+                return False
+            batch, album_title = result
+            if not batch or 'error' in batch[0]:
+                logger.warning(f"Prefetch failed: {album_title}")
+                return False
+            with self.lock:
+                # Batch was made for settings that were flushed meanwhile
+                if generation != self.generation:
+                    continue
+                self.queue.append({
+                    'batch': batch,
+                    'album_title': album_title,
+                    'created': time.time()
+                })
+                queued = len(self.queue)
+            logger.info(f"Prefetched batch from {album_title} ({queued}/{self.depth()} ready)")
+        return True
+
+    def prefetch_loop(self):
+        """Main prefetch loop"""
+        logger.info("Photo prefetch started")
+        while self.running:
+            try:
+                ok = self.fill()
+            except Exception as e:
+                logger.error(f"Error prefetching photo batch: {e}")
+                ok = False
+            # Wait until a batch is taken, settings change or it is time to retry
+            timeout = self.config.PHOTO_PREFETCH_INTERVAL if ok else self.config.PHOTO_PREFETCH_RETRY
+            self.wakeup.wait(timeout)
+            self.wakeup.clear()
+
+    def start(self):
+        """Starts prefetching in a separate thread"""
+        if self.running:
+            logger.warning("Photo prefetch already running")
+            return False
+
+        self.running = True
+        self.thread = threading.Thread(target=self.prefetch_loop, daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        """Stops prefetching"""
+        if not self.running:
+            return
+
+        self.running = False
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(2.0)  # Wait max 2 seconds
+        logger.info("Photo prefetch stopped")
+
+    def get_status(self):
+        """Returns prefetch queue status as a dictionary"""
+        with self.lock:
+            ages = [int(time.time() - e['created']) for e in self.queue]
+        return {
+            'running': self.running,
+            'ready': len(ages),
+            'depth': self.depth(),
+            'ages': ages,
+            'hits': self.hits,
+            'misses': self.misses
+        }
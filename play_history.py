@@ -0,0 +1,247 @@
+import time
+import random
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger('play_history')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS album_plays (
+    album_id TEXT PRIMARY KEY,
+    last_shown REAL NOT NULL,
+    shows INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS item_plays (
+    item_id TEXT PRIMARY KEY,
+    album_id TEXT,
+    last_shown REAL NOT NULL,
+    shows INTEGER NOT NULL
+);
+"""
+
+# Albums not shown for this many half lives weigh the same as never shown ones
+MAX_HALF_LIVES = 24
+# The tree is rebuilt once its total shrank this much, before float cancellation shows
+REBUILD_SHRINK = 2.0 ** -26
+
+
+class WeightTree:
+    """Fenwick tree of weights: O(log n) updates and weighted sampling"""
+
+    def __init__(self, weights):
+        self.size = len(weights)
+        self.tree = [0.0] * (self.size + 1)
+        for i, w in enumerate(weights):
+            self.tree[i + 1] += w
+            parent = (i + 1) + ((i + 1) & -(i + 1))
+            if parent <= self.size:
+                self.tree[parent] += self.tree[i + 1]
+        self.total = sum(weights)
+
+    def update(self, index, delta):
+        self.total += delta
+        i = index + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def find(self, target):
+        """Returns the index whose cumulative weight range contains target"""
+        pos = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and self.tree[nxt] <= target:
+                pos = nxt
+                target -= self.tree[nxt]
+            step >>= 1
+        return min(pos, self.size - 1)
+
+
+class AlbumPool:
+    """Albums eligible under one MEDIA_TYPES setting, with their weight tree"""
+
+    def __init__(self, album_ids):
+        self.order = list(album_ids)
+        self.positions = {a: i for i, a in enumerate(self.order)}
+        self.tree = WeightTree([])
+        self.built_total = 0.0
+
+    def build(self, weights):
+        self.tree = WeightTree(weights)
+        self.built_total = self.tree.total
+
+
+class PlayHistory:
+    """Remembers what was shown and steers selection toward least recently shown albums and items"""
+
+    def __init__(self, config, path):
+        self.config = config
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = None
+        self.albums = {}    # album_id -> [last_shown, shows]
+        self.items = {}     # item_id -> last_shown, only within PLAY_HISTORY_REPEAT_WINDOW
+        # MEDIA_TYPES setting -> AlbumPool, so switching types needs no rebuild
+        self.pools = {}
+        self.epoch = time.time()
+        self.albums_key = None
+        self.rebuilds = 0
+        self.picks = 0
+
+    def open(self):
+        """Opens the store and loads the plays that still matter"""
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.load()
+
+    def load(self):
+        cutoff = time.time() - self.config.PLAY_HISTORY_REPEAT_WINDOW
+        with self.lock, self.conn:
+            self.conn.executescript(SCHEMA)
+            # Older item plays no longer matter, keep the store compact
+            self.conn.execute("DELETE FROM item_plays WHERE last_shown < ?", (cutoff,))
+            for row in self.conn.execute("SELECT album_id, last_shown, shows FROM album_plays"):
+                self.albums[row['album_id']] = [row['last_shown'], row['shows']]
+            for row in self.conn.execute("SELECT item_id, last_shown FROM item_plays"):
+                self.items[row['item_id']] = row['last_shown']
+        logger.info(f"Loaded play history: {len(self.albums)} albums, {len(self.items)} recent items")
+
+    # ------------------------------------------------------------------
+    # Album weights
+    # ------------------------------------------------------------------
+
+    def weight(self, album_id):
+        """Pick weight of an album: doubles with every half life since it was last shown.
+
+        Weights are relative to self.epoch, so they don't change while time passes
+        and only the album that was just shown has to be updated in the tree.
+        """
+        half_life = self.config.PLAY_HISTORY_HALF_LIFE
+        last_shown = self.albums.get(album_id, [0, 0])[0]
+        last_shown = max(last_shown, self.epoch - MAX_HALF_LIVES * half_life)
+        return 2.0 ** ((self.epoch - last_shown) / half_life)
+
+    def rebuild(self, pools=None, now=None):
+        if pools is not None:
+            self.pools = {name: AlbumPool(album_ids) for name, album_ids in pools.items()}
+        self.epoch = now or time.time()
+        for pool in self.pools.values():
+            pool.build([self.weight(a) for a in pool.order])
+        self.rebuilds += 1
+
+    def set_albums(self, pools):
+        """Sets the albums eligible for picking, {MEDIA_TYPES setting: album ids}"""
+        with self.lock:
+            self.rebuild(pools)
+
+    def sync_albums(self, key, loader):
+        """Reloads the eligible albums from loader() only when key changed"""
+        if key != self.albums_key:
+            self.set_albums(loader())
+            self.albums_key = key
+
+    def pick_album(self, pool_name):
+        """Returns a weighted random album id from a pool, or None when no album is eligible"""
+        with self.lock:
+            pool = self.pools.get(pool_name)
+            if not pool or not pool.order or pool.tree.total <= 0:
+                return None
+            self.picks += 1
+            return pool.order[pool.tree.find(random.random() * pool.tree.total)]
+
+    def mark_album(self, album_id, when):
+        old_weight = self.weight(album_id)
+        entry = self.albums.setdefault(album_id, [0, 0])
+        entry[0] = max(entry[0], when)
+        delta = self.weight(album_id) - old_weight
+        shrunk = False
+        for pool in self.pools.values():
+            if album_id in pool.positions:
+                pool.tree.update(pool.positions[album_id], delta)
+            shrunk = shrunk or pool.tree.total < pool.built_total * REBUILD_SHRINK
+        # Shown albums shrink the totals; rebase the weights on the current time
+        if shrunk:
+            self.rebuild(now=when)
+
+    def reserve(self, album_id):
+        """Lowers an album's weight right when a batch is taken from it, before it is shown.
+
+        Keeps prefetched batches from coming out of the same album. Not persisted.
+        """
+        with self.lock:
+            self.mark_album(album_id, time.time())
+
+    # ------------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------------
+
+    def record(self, plays):
+        """Stores plays, a list of (item_id, album_id, shown_at).
+
+        item_id None records a batch served from the album, which counts as one album show.
+        """
+        if not plays:
+            return
+        with self.lock, self.conn:
+            if len(self.items) > self.config.PLAY_HISTORY_MAX_ITEMS:
+                cutoff = time.time() - self.config.PLAY_HISTORY_REPEAT_WINDOW
+                self.items = {i: t for i, t in self.items.items() if t >= cutoff}
+                self.conn.execute("DELETE FROM item_plays WHERE last_shown < ?", (cutoff,))
+            for item_id, album_id, shown_at in plays:
+                if album_id:
+                    shows = 0 if item_id else 1
+                    self.mark_album(album_id, shown_at)
+                    self.albums[album_id][1] += shows
+                    self.conn.execute(
+                        "INSERT INTO album_plays (album_id, last_shown, shows) VALUES (?, ?, ?) "
+                        "ON CONFLICT(album_id) DO UPDATE SET "
+                        "last_shown = MAX(last_shown, excluded.last_shown), shows = shows + excluded.shows",
+                        (album_id, shown_at, shows)
+                    )
+                if item_id:
+                    self.items[item_id] = max(self.items.get(item_id, 0), shown_at)
+                    self.conn.execute(
+                        "INSERT INTO item_plays (item_id, album_id, last_shown, shows) VALUES (?, ?, ?, 1) "
+                        "ON CONFLICT(item_id) DO UPDATE SET "
+                        "last_shown = MAX(last_shown, excluded.last_shown), shows = shows + 1",
+                        (item_id, album_id, shown_at)
+                    )
+
+    # ------------------------------------------------------------------
+    # Start index selection
+    # ------------------------------------------------------------------
+
+    def pick_start(self, item_ids, count):
+        """Chooses where a batch starts in an album, avoiding recently shown items.
+
+        Compares a few random start positions and keeps the one with the fewest
+        items shown within PLAY_HISTORY_REPEAT_WINDOW, preferring older plays on ties.
+        """
+        total = len(item_ids)
+        cutoff = time.time() - self.config.PLAY_HISTORY_REPEAT_WINDOW
+        best, best_score = 0, None
+        with self.lock:
+            for _ in range(min(self.config.PLAY_HISTORY_START_TRIES, total)):
+                start = random.randint(0, total - 1)
+                shown = [self.items.get(item_ids[(start + i) % total], 0)
+                         for i in range(min(count, total))]
+                recent = [t for t in shown if t >= cutoff]
+                score = (len(recent), max(recent, default=0))
+                if best_score is None or score < best_score:
+                    best, best_score = start, score
+                if not recent:
+                    break
+        return best
+
+    def get_status(self):
+        """Returns play history statistics as a dictionary"""
+        with self.lock:
+            return {
+                'albums_shown': len(self.albums),
+                'recent_items': len(self.items),
+                'eligible_albums': {name: len(pool.order) for name, pool in self.pools.items()},
+                'picks': self.picks,
+                'rebuilds': self.rebuilds
+            }
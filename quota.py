@@ -0,0 +1,199 @@
+import time
+import random
+import logging
+import datetime
+import threading
+from collections import deque
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger('quota')
+
+# Google API daily quotas reset at midnight Pacific Time
+QUOTA_TIME_ZONE = ZoneInfo('America/Los_Angeles')
+# Requests counted for the usage rate in the forecast
+RATE_WINDOW = 3600
+
+
+class QuotaExceeded(Exception):
+    """Raised instead of sending a request the budget does not allow"""
+
+    def __init__(self, api, retry_in):
+        super().__init__(f"{api} API budget exhausted, retry in {retry_in:.0f}s")
+        self.api = api
+        self.retry_in = retry_in
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at rate tokens per second"""
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        """Takes one token. Returns 0 on success, otherwise the seconds until one is available."""
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class ApiBudget:
+    """Request budget and backoff state of one Google API"""
+
+    def __init__(self, name, daily_limit, config):
+        self.name = name
+        self.daily_limit = daily_limit
+        # The bucket refills at the daily quota spread over the day, so even
+        # a sustained burst cannot use more than the quota
+        self.bucket = TokenBucket(
+            capacity=max(1, daily_limit * config.QUOTA_BURST_SECONDS / 86400),
+            rate=daily_limit / 86400
+        )
+        self.backoff_until = 0
+        self.failures = 0
+        self.day = None
+        self.used_today = 0
+        self.recent = deque()
+        self.requests = 0
+        self.throttled = 0
+        self.rate_limited = 0
+        self.server_errors = 0
+
+
+class QuotaGovernor:
+    """Shared budget for all Google API calls: token buckets sized to the daily
+    quotas and exponential backoff with jitter after 429 and 5xx responses"""
+
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.budgets = {api: ApiBudget(api, limit, config)
+                        for api, limit in config.GOOGLE_DAILY_QUOTAS.items()}
+
+    def budget(self, api):
+        if api not in self.budgets:
+            # APIs without a configured quota are only backed off, never throttled
+            self.budgets[api] = ApiBudget(api, float('inf'), self.config)
+        return self.budgets[api]
+
+    def acquire(self, api):
+        """Takes one request from the budget, raising QuotaExceeded if none is left"""
+        now = time.monotonic()
+        with self.lock:
+            budget = self.budget(api)
+            wait = budget.backoff_until - now
+            if wait <= 0 and budget.daily_limit != float('inf'):
+                wait = budget.bucket.take(now)
+            if wait > 0:
+                budget.throttled += 1
+                raise QuotaExceeded(api, wait)
+            self.count(budget, now)
+
+    def count(self, budget, now):
+        day = datetime.datetime.now(QUOTA_TIME_ZONE).date()
+        if day != budget.day:
+            budget.day = day
+            budget.used_today = 0
+        budget.used_today += 1
+        budget.requests += 1
+        budget.recent.append(now)
+        while budget.recent and budget.recent[0] < now - RATE_WINDOW:
+            budget.recent.popleft()
+
+    def record_response(self, api, status, retry_after=None):
+        """Updates the backoff state from a response status"""
+        with self.lock:
+            budget = self.budget(api)
+            if status != 429 and status < 500:
+                budget.failures = 0
+                return
+            if status == 429:
+                budget.rate_limited += 1
+            else:
+                budget.server_errors += 1
+            budget.failures += 1
+            delay = min(self.config.QUOTA_BACKOFF_MAX,
+                        self.config.QUOTA_BACKOFF_BASE * 2 ** (budget.failures - 1))
+            # Half fixed, half random, so retries from several workers spread out
+            delay = delay / 2 + random.uniform(0, delay / 2)
+            if retry_after:
+                delay = max(delay, retry_after)
+            budget.backoff_until = time.monotonic() + delay
+        logger.warning(f"{api} API answered {status}, backing off for {delay:.0f}s")
+
+    def low(self, api):
+        """True while backing off or when less than QUOTA_LOW_FRACTION of the bucket is left.
+        Background work waits then, leaving the rest for what is on screen."""
+        now = time.monotonic()
+        with self.lock:
+            budget = self.budget(api)
+            if budget.backoff_until > now:
+                return True
+            if budget.daily_limit == float('inf'):
+                return False
+            budget.bucket.refill(now)
+            return budget.bucket.tokens < budget.bucket.capacity * self.config.QUOTA_LOW_FRACTION
+
+    def forecast(self, budget):
+        """Projected requests by the quota reset at the current hourly rate"""
+        now = datetime.datetime.now(QUOTA_TIME_ZONE)
+        midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1),
+                                             datetime.time(), tzinfo=QUOTA_TIME_ZONE)
+        rate = len(budget.recent) / RATE_WINDOW
+        used = budget.used_today if budget.day == now.date() else 0
+        return used + rate * (midnight - now).total_seconds()
+
+    def get_status(self):
+        """Returns the budget of every API as a dictionary"""
+        now = time.monotonic()
+        status = {}
+        with self.lock:
+            for api, budget in self.budgets.items():
+                limited = budget.daily_limit != float('inf')
+                if limited:
+                    budget.bucket.refill(now)
+                projected = self.forecast(budget)
+                status[api] = {
+                    'tokens': round(budget.bucket.tokens, 1) if limited else None,
+                    'capacity': round(budget.bucket.capacity, 1) if limited else None,
+                    'used_today': budget.used_today,
+                    'daily_limit': budget.daily_limit if limited else None,
+                    'projected_today': round(projected),
+                    'projected_fraction': round(projected / budget.daily_limit, 3) if limited else None,
+                    'backoff': round(max(0, budget.backoff_until - now), 1),
+                    'requests': budget.requests,
+                    'throttled': budget.throttled,
+                    'rate_limited': budget.rate_limited,
+                    'server_errors': budget.server_errors
+                }
+        return status
+
+
+class QuotaHttp:
+    """httplib2-compatible wrapper that charges each request to an API budget"""
+
+    def __init__(self, http, governor, api):
+        self.http = http
+        self.governor = governor
+        self.api = api
+
+    def request(self, *args, **kwargs):
+        self.governor.acquire(self.api)
+        resp, content = self.http.request(*args, **kwargs)
+        retry_after = resp.get('retry-after')
+        self.governor.record_response(
+            self.api, resp.status,
+            float(retry_after) if retry_after and retry_after.isdigit() else None
+        )
+        return resp, content
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
@@ -0,0 +1,150 @@
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+import metrics
+from event_bus import ChangeNotifier
+
+logger = logging.getLogger('sensors')
+
+
+class SensorPoller(ChangeNotifier):
+    """Polls the Broadlink RM4 sensors in the background over one authenticated handle"""
+
+    def __init__(self, config):
+        self.config = config
+        self.running = False
+        self.thread = None
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.device = None
+        self.failures = 0
+        self.retry_delay = config.SENSOR_RETRY_MIN
+        self.discoveries = 0
+        self.last_error = None
+        self.history = deque(maxlen=config.SENSOR_HISTORY_SIZE)
+        # Raised by the thermal governor to poll less often
+        self.interval_factor = 1
+
+    def discover(self):
+        """Finds and authenticates the sensor device. Returns True on success."""
+        # Loaded here, only the sensor thread needs it
+        import broadlink
+        self.discoveries += 1
+        with metrics.upstream('broadlink', 'discover'):
+            devices = broadlink.discover(timeout=self.config.BROADLINK["DISCOVER_TIMEOUT"])
+        for d in devices:
+            if d.type.startswith(self.config.BROADLINK["TARGET_TYPE_PREFIX"]):
+                with metrics.upstream('broadlink', 'auth'):
+                    d.auth()
+                self.device = d
+                self.failures = 0
+                logger.info(f"Found sensor device {d.type} at {d.host[0]}")
+                return True
+        self.last_error = "Sensor device not found"
+        return False
+
+    def poll(self):
+        """Takes one reading. Returns True on success."""
+        if self.device is None and not self.discover():
+            return False
+        try:
+            with metrics.upstream('broadlink', 'check_sensors'):
+                data = self.device.check_sensors()
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            logger.warning(f"Sensor read failed ({self.failures}): {e}")
+            if self.failures >= self.config.SENSOR_MAX_FAILURES:
+                logger.warning("Too many sensor failures, will discover the device again")
+                self.device = None
+            return False
+
+        self.failures = 0
+        self.last_error = None
+        with self.lock:
+            self.history.append((time.time(), data.get("temperature"), data.get("humidity")))
+        self.notify_change()
+        return True
+
+    def poll_loop(self):
+        """Main polling loop"""
+        logger.info("Sensor polling started")
+        while self.running:
+            try:
+                ok = self.poll()
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Error polling sensors: {e}")
+                ok = False
+
+            if ok or self.device is not None:
+                self.retry_delay = self.config.SENSOR_RETRY_MIN
+                delay = self.config.SENSOR_POLL_INTERVAL * self.interval_factor
+            else:
+                # Device lost: back off before broadcasting discovery again
+                delay = self.retry_delay
+                self.retry_delay = min(self.retry_delay * 2, self.config.SENSOR_RETRY_MAX)
+            self.wakeup.wait(delay)
+            self.wakeup.clear()
+
+    def start(self):
+        """Starts polling in a separate thread"""
+        if self.running:
+            logger.warning("Sensor polling already running")
+            return False
+
+        self.running = True
+        self.thread = threading.Thread(target=self.poll_loop, daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        """Stops polling"""
+        if not self.running:
+            return
+
+        self.running = False
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(2.0)  # Wait max 2 seconds
+        logger.info("Sensor polling stopped")
+
+    def latest(self):
+        """Returns the newest reading as a dictionary"""
+        with self.lock:
+            last = self.history[-1] if self.history else None
+        result = {}
+        if last:
+            result = {
+                "temperature": last[1],
+                "humidity": last[2],
+                "time": datetime.fromtimestamp(last[0]).isoformat()
+            }
+        if self.last_error and (last is None or self.device is None):
+            result["error"] = self.last_error
+        return result
+
+    def get_history(self, seconds=None):
+        """Returns readings, optionally only those from the last given seconds"""
+        cutoff = time.time() - seconds if seconds else 0
+        with self.lock:
+            readings = [r for r in self.history if r[0] >= cutoff]
+        return [{
+            "time": datetime.fromtimestamp(t).isoformat(),
+            "temperature": temperature,
+            "humidity": humidity
+        } for t, temperature, humidity in readings]
+
+    def get_status(self):
+        """Returns polling status as a dictionary"""
+        return {
+            'running': self.running,
+            'device': self.device.type if self.device else None,
+            'failures': self.failures,
+            'discoveries': self.discoveries,
+            'readings': len(self.history),
+            'last_error': self.last_error
+        }
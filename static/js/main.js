@@ -10,6 +10,8 @@ const PHOTO_DURATION = window.PHOTO_DURATION || 30;
 const WEATHER_REFRESH_INTERVAL = window.WEATHER_REFRESH_INTERVAL || 3600;
 
 let progressIntervalId = null;
+// Šiluminio reguliatoriaus lygis, atnaujinamas per 'temperature' įvykį
+let thermal = window.THERMAL || { image_scale: 1, poll_factor: 1, video: true };
 
 /* ========================
    NUOTRAUKŲ RODYMO FUNKCIJOS
@@ -42,136 +44,345 @@ function startProgressBar() {
 }
 
 function nextMedia() {
+  // Kol procesorius per karštas, video praleidžiame
+  while (!thermal.video && currentBatch && currentIndex < currentBatch.length - 1 &&
+         currentBatch[currentIndex + 1].mediaType === "video") {
+    currentIndex++;
+  }
   if (currentBatch && currentIndex < currentBatch.length - 1) {
     currentIndex++;
     showMedia(currentBatch[currentIndex]);
-    startProgressBar();
   } else {
     updatePhotoBatch();
   }
 }
 
-function showMedia(m) {
-  const display = document.getElementById('photo-display');
-  if (!display) return;
+// Nuotraukos adresas: serveris jį jau apskaičiavo pagal ekrano dydį ir orientaciją
+function photoUrl(m) {
+  if (m.url) {
+    return m.url;
+  }
+  const scale = thermal.image_scale || 1;
+  return m.baseUrl + "=w" + Math.round(1200 * scale) + "-h" + Math.round(800 * scale);
+}
+
+// Ekrano dydis fiziniais taškais, kad serveris siųstų ne daugiau pikselių nei rodoma
+function screenParams() {
+  const sw = window.innerWidth;
+  const sh = window.innerHeight;
+  const dpr = window.devicePixelRatio || 1;
+  // Slapukas - kad ir pirmas puslapio batch būtų tinkamo dydžio
+  document.cookie = "kiosk_screen=" + sw + "x" + sh + "x" + dpr + "; path=/; max-age=31536000";
+  return "sw=" + sw + "&sh=" + sh + "&dpr=" + dpr;
+}
+
+// Periodinis kvietimas, retinamas kai procesorius įkaista
+function pollEvery(fn, ms) {
+  setTimeout(() => {
+    fn();
+    pollEvery(fn, ms);
+  }, ms * (thermal.poll_factor || 1));
+}
+
+// Iš anksto paruoštos (atsisiųstos ir dekoduotos) medijos: raktas -> Promise<{el, decodeMs}>
+const preloadCache = new Map();
+const PRELOAD_CACHE_SIZE = 4;
+// Ilgiau nelaukiame - rodome tai, kas spėjo užsikrauti
+const PREPARE_TIMEOUT_MS = 10000;
+let activeLayer = 0;
+let showSeq = 0;
+
+function mediaKey(m) {
+  return m.id + "|" + (m.mediaType === "video" ? videoUrl(m) : photoUrl(m));
+}
+
+// Video iš vietinės talpyklos maršruto, jei serveris jį nurodė
+function videoUrl(m) {
+  return m.url || m.baseUrl;
+}
+
+// Nustatome, ar plotis, ar aukštis turi tilpti
+function fitPhoto(imgEl) {
+  let w = imgEl.naturalWidth;
+  let h = imgEl.naturalHeight;
+  if (h > w) {
+    // Vertikali nuotrauka
+    imgEl.style.height = '100%';
+    imgEl.style.width = 'auto';
+    imgEl.style.top = '0';
+    imgEl.style.bottom = '0';
+  } else {
+    // Horizontali
+    imgEl.style.width = '100%';
+    imgEl.style.height = 'auto';
+    imgEl.style.bottom = '0';
+    imgEl.style.top = 'auto';
+  }
+}
+
+function createVideoElement(m) {
+  let videoEl = document.createElement('video');
+  videoEl.src = videoUrl(m);
+  videoEl.style.position = 'absolute';
+  videoEl.style.left = '50%';
+  videoEl.style.transform = 'translateX(-50%)';
+  videoEl.style.objectFit = 'contain';
+  videoEl.style.margin = 0;
+  videoEl.style.maxWidth = '100%';
+  videoEl.style.maxHeight = '100%';
+  videoEl.style.bottom = '0';
+
+  // Video atributai
+  videoEl.controls = false; // Slėpti video kontroles
+  videoEl.muted = !window.VIDEO_SOUND; // Pagal konfiguraciją
+  videoEl.playsInline = true;
+  // Iš anksto tik metaduomenys, pats video - kai parodomas
+  videoEl.preload = 'metadata';
+  return videoEl;
+}
+
+function createPhotoElement(m) {
+  let imgEl = document.createElement('img');
+  // Vietinis kešas (/media/<id>), o jei jo nėra - tiesiai iš Google
+  imgEl.src = photoUrl(m); // reikiamo dydžio parametrai
+  imgEl.style.position = 'absolute';
+  imgEl.style.left = '50%';
+  imgEl.style.transform = 'translateX(-50%)';
+  imgEl.style.objectFit = 'contain';
+  imgEl.style.margin = 0;
+  return imgEl;
+}
 
-  // Išvalome seną mediją
-  display.innerHTML = '';
-  
-  // Log displayed media to server
-  logMediaDisplay(m);
+// Atsisiunčia ir dekoduoja mediją paslėptame elemente, kad parodymas būtų momentinis
+function prepareMedia(m) {
+  const key = mediaKey(m);
+  if (preloadCache.has(key)) return preloadCache.get(key);
 
+  const started = performance.now();
+  let prepared;
   if (m.mediaType === "video") {
-    // Sukuriame video elementą
-    let videoEl = document.createElement('video');
-    videoEl.id = 'current-video';
-    videoEl.src = m.baseUrl;
-    videoEl.style.position = 'absolute';
-    videoEl.style.left = '50%';
-    videoEl.style.transform = 'translateX(-50%)';
-    videoEl.style.objectFit = 'contain';
-    videoEl.style.margin = 0;
-    videoEl.style.maxWidth = '100%';
-    videoEl.style.maxHeight = '100%';
-    videoEl.style.bottom = '0';
-    
-    // Video atributai
-    videoEl.controls = false; // Slėpti video kontroles
-    videoEl.autoplay = true;
-    videoEl.muted = !window.VIDEO_SOUND; // Pagal konfiguraciją
-    videoEl.playsInline = true;
-    
-    // Kai video baigsis, keičiame į sekančią mediją
-    videoEl.onended = function() {
-      clearInterval(progressIntervalId); // Sustabdome progreso juostą
-      nextMedia();
-    };
-    
-    // Jei video ilgesnis nei nustatyta, nustatome laikmatį
-    videoEl.onloadedmetadata = function() {
-      let duration = videoEl.duration;
-      if (duration > window.VIDEO_DURATION) {
-        setTimeout(() => {
-          clearInterval(progressIntervalId);
-          nextMedia();
-        }, window.VIDEO_DURATION * 1000);
-      }
-    };
-    
-    display.appendChild(videoEl);
+    const videoEl = createVideoElement(m);
+    prepared = new Promise(resolve => {
+      const timer = setTimeout(() => resolve({ el: videoEl, decodeMs: null }), PREPARE_TIMEOUT_MS);
+      const done = () => {
+        clearTimeout(timer);
+        resolve({ el: videoEl, decodeMs: performance.now() - started });
+      };
+      videoEl.addEventListener('loadedmetadata', done, { once: true });
+      videoEl.addEventListener('error', done, { once: true });
+    });
   } else {
-    // Sukuriame naują <img> elementą nuotraukai
-    let imgEl = document.createElement('img');
-    imgEl.id = 'current-photo';
-    imgEl.src = m.baseUrl + "=w1200-h800"; // reikiamo dydžio parametrai
-    imgEl.style.position = 'absolute';
-    imgEl.style.left = '50%';
-    imgEl.style.transform = 'translateX(-50%)';
-    imgEl.style.objectFit = 'contain';
-    imgEl.style.margin = 0;
-
-    // Kai paveikslas užsikraus, nustatome, ar plotis, ar aukštis turi tilpti
-    imgEl.onload = function() {
-      let w = imgEl.naturalWidth;
-      let h = imgEl.naturalHeight;
-      if (h > w) {
-        // Vertikali nuotrauka
-        imgEl.style.height = '100%';
-        imgEl.style.width = 'auto';
-        imgEl.style.top = '0';
-        imgEl.style.bottom = '0';
-      } else {
-        // Horizontali
-        imgEl.style.width = '100%';
-        imgEl.style.height = 'auto';
-        imgEl.style.bottom = '0';
-        imgEl.style.top = 'auto';
-      }
-    };
+    const imgEl = createPhotoElement(m);
+    const decoded = imgEl.decode ? imgEl.decode() : new Promise((resolve, reject) => {
+      imgEl.onload = resolve;
+      imgEl.onerror = reject;
+    });
+    const timeout = new Promise((resolve, reject) => setTimeout(reject, PREPARE_TIMEOUT_MS));
+    prepared = Promise.race([decoded, timeout])
+      .then(() => {
+        fitPhoto(imgEl);
+        return { el: imgEl, decodeMs: performance.now() - started };
+      })
+      .catch(() => {
+        // Nepavyko laiku dekoduoti - rodome kaip yra
+        imgEl.onload = () => fitPhoto(imgEl);
+        return { el: imgEl, decodeMs: null };
+      });
+  }
 
-    display.appendChild(imgEl);
+  preloadCache.set(key, prepared);
+  while (preloadCache.size > PRELOAD_CACHE_SIZE) {
+    preloadCache.delete(preloadCache.keys().next().value);
   }
+  return prepared;
+}
 
-  // Parodome informacijos overlay (albumo pavadinimas, data, kiek liko nuotraukų)
-  let remain = currentBatch.length - (currentIndex + 1);
-  const overlay = document.getElementById('photo-overlay-content');
-  if (overlay) {
-    let text = currentAlbum + "<br>" 
-             + m.photo_time.replace("T", " ").replace("Z", "") 
-             + " (liko #" + remain + ")"
-             + (m.mediaType === "video" ? " 📹" : "");
-    overlay.innerHTML = text;
+// Parodo paruoštą elementą paslėptame sluoksnyje ir paslepia seną
+function swapLayer(el, id) {
+  const layers = [document.getElementById('photo-layer-a'), document.getElementById('photo-layer-b')];
+  const current = layers[activeLayer];
+  const next = layers[1 - activeLayer];
+
+  next.innerHTML = '';
+  el.id = id;
+  next.appendChild(el);
+  next.style.visibility = 'visible';
+  current.style.visibility = 'hidden';
+
+  // Sustabdome seną video, kad nekrautų tinklo ir procesoriaus
+  const oldVideo = current.querySelector('video');
+  if (oldVideo) {
+    oldVideo.pause();
+    oldVideo.removeAttribute('src');
+    oldVideo.load();
   }
-  
-  // Paleiskime progreso juostą tik nuotraukoms (video turi savo progresą)
-  if (m.mediaType !== "video") {
-    startProgressBar();
+  current.innerHTML = '';
+  activeLayer = 1 - activeLayer;
+}
+
+function startVideo(videoEl, seq) {
+  // Video turi savo progresą
+  clearInterval(progressIntervalId);
+
+  // Kai video baigsis, keičiame į sekančią mediją
+  videoEl.onended = function() {
+    if (seq !== showSeq) return;
+    clearInterval(progressIntervalId); // Sustabdome progreso juostą
+    nextMedia();
+  };
+
+  // Jei video ilgesnis nei nustatyta, nustatome laikmatį
+  const limitDuration = () => {
+    if (videoEl.duration > window.VIDEO_DURATION) {
+      setTimeout(() => {
+        if (seq !== showSeq) return;
+        clearInterval(progressIntervalId);
+        nextMedia();
+      }, window.VIDEO_DURATION * 1000);
+    }
+  };
+  if (videoEl.readyState >= 1) {
+    limitDuration();
+  } else {
+    videoEl.addEventListener('loadedmetadata', limitDuration, { once: true });
+  }
+
+  videoEl.play().catch(e => console.error("Video play failed:", e));
+}
+
+// Paruošia kitą batch elementą ir, artėjant pabaigai, kito batch pirmą elementą
+function preloadAhead() {
+  let i = currentIndex + 1;
+  while (!thermal.video && i < currentBatch.length && currentBatch[i].mediaType === "video") {
+    i++;
+  }
+  if (i < currentBatch.length) {
+    prepareMedia(currentBatch[i]);
+  }
+  if (currentIndex >= currentBatch.length - 2) {
+    fetchNextBatch().catch(e => console.error('Error prefetching next photo batch:', e));
   }
 }
 
+function showMedia(m) {
+  const display = document.getElementById('photo-display');
+  if (!display) return;
+
+  const seq = ++showSeq;
+  const requested = performance.now();
+  const key = mediaKey(m);
+  const preloaded = preloadCache.has(key);
+  const prepared = prepareMedia(m);
+  preloadCache.delete(key);
+
+  prepared.then(({ el, decodeMs }) => {
+    // Kol ruošėme, jau buvo paprašyta kitos medijos
+    if (seq !== showSeq) return;
+
+    swapLayer(el, m.mediaType === "video" ? 'current-video' : 'current-photo');
+
+    // Log displayed media to server (kartu su perjungimo trukme)
+    logMediaDisplay(m, {
+      transition_ms: Math.round(performance.now() - requested),
+      decode_ms: decodeMs === null ? null : Math.round(decodeMs),
+      preloaded: preloaded
+    });
+
+    // Parodome informacijos overlay (albumo pavadinimas, data, kiek liko nuotraukų)
+    let remain = currentBatch.length - (currentIndex + 1);
+    const overlay = document.getElementById('photo-overlay-content');
+    if (overlay) {
+      let text = currentAlbum + "<br>"
+               + m.photo_time.replace("T", " ").replace("Z", "")
+               + " (liko #" + remain + ")"
+               + (m.mediaType === "video" ? " 📹" : "");
+      overlay.innerHTML = text;
+    }
+
+    // Progreso juosta tik nuotraukoms (video turi savo progresą)
+    if (m.mediaType === "video") {
+      startVideo(el, seq);
+    } else {
+      startProgressBar();
+    }
+
+    preloadAhead();
+  });
+}
+
 // New function to log displayed media to server
-function logMediaDisplay(mediaItem) {
+// Rodymo įvykiai kaupiami ir siunčiami paketais, o ne po vieną užklausą
+let pendingDisplayEvents = [];
+
+function logMediaDisplay(mediaItem, timing) {
   // Don't log error items
   if (mediaItem.mediaType === "error" || !mediaItem.filename) return;
-  
-  fetch('/log_media_display', {
+
+  pendingDisplayEvents.push(Object.assign({
+    album: currentAlbum,
+    item_id: mediaItem.id,
+    album_id: mediaItem.albumId,
+    filename: mediaItem.filename,
+    mediaType: mediaItem.mediaType,
+    timestamp: new Date().toISOString()
+  }, timing || {}));
+  if (pendingDisplayEvents.length >= (window.MEDIA_LOG_BATCH || 10)) {
+    flushDisplayEvents();
+  }
+}
+
+function flushDisplayEvents() {
+  if (pendingDisplayEvents.length === 0) return;
+  const body = JSON.stringify(pendingDisplayEvents);
+  pendingDisplayEvents = [];
+
+  // sendBeacon veikia ir uždarant puslapį
+  const blob = new Blob([body], { type: 'application/json' });
+  if (navigator.sendBeacon && navigator.sendBeacon('/log_media_display/batch', blob)) {
+    return;
+  }
+  fetch('/log_media_display/batch', {
     method: 'POST',
     headers: {
       'Content-Type': 'application/json',
     },
-    body: JSON.stringify({
-      album: currentAlbum,
-      filename: mediaItem.filename,
-      mediaType: mediaItem.mediaType,
-      timestamp: new Date().toISOString()
-    })
+    body: body,
+    keepalive: true
   })
   .catch(error => console.error('Error logging media display:', error));
 }
 
+// Neišsiųsti įvykiai neturi dingti perkraunant ar uždarant puslapį
+document.addEventListener('visibilitychange', () => {
+  if (document.visibilityState === 'hidden') flushDisplayEvents();
+});
+window.addEventListener('pagehide', flushDisplayEvents);
+
+// Kitas batch parsiunčiamas iš anksto, kol rodomi paskutiniai dabartinio elementai
+let nextBatchPromise = null;
+
+function fetchNextBatch() {
+  if (!nextBatchPromise) {
+    nextBatchPromise = fetch('/newphoto?' + screenParams())
+      .then(r => r.json())
+      .then(d => {
+        if (!d.error && d.photos && d.photos.length > 0) {
+          prepareMedia(d.photos[0]);
+        }
+        return d;
+      })
+      .catch(e => {
+        nextBatchPromise = null;
+        throw e;
+      });
+  }
+  return nextBatchPromise;
+}
+
 function updatePhotoBatch() {
-  fetch('/newphoto')
-    .then(r => r.json())
+  const batchPromise = fetchNextBatch();
+  nextBatchPromise = null;
+  batchPromise
     .then(d => {
       if (d.error) {
         console.error("Error:", d.error);
@@ -182,7 +393,6 @@ function updatePhotoBatch() {
       currentIndex = 0;
       if (currentBatch.length > 0) {
         showMedia(currentBatch[0]);
-        startProgressBar();
       }
     })
     .catch(e => console.error('Error fetching new photo batch:', e));
@@ -199,74 +409,54 @@ function updateWeather() {
         console.error("Weather refresh error:", d.error);
         return;
       }
-      let overlay = document.getElementById('weather-overlay');
-      if (!overlay) return;
-
-      let html = "";
-      d.daily.forEach(day => {
-        let dt = new Date(day.dt * 1000);
-        let weekday = dt.toLocaleString('en-US', { weekday: 'short' });
-        let code = day.weather[0].description;
-        let tempMin = Math.round(day.main.temp_min);
-        let tempMax = Math.round(day.main.temp_max);
-
-        // Sudedame vieno dienos "stulpelio" HTML
-        let iconUrl = `/static/meteo-icons/day/${code}.png`;
-        html += `
-          <div style="text-align: center; border-right: 1px solid rgba(255,255,255,0.3); padding: 0 10px;">
-            <div style="font-size: 1em; font-weight: bold; margin-bottom: 0px;">${weekday}</div>
-            <div><img src="${iconUrl}" alt="${code}" style="width: 60px; height: 60px;" /></div>
-            <div style="font-size: 1.2em;">${tempMin}° / ${tempMax}°</div>
-          </div>
-        `;
-      });
-      overlay.innerHTML = html;
+      renderWeather(d);
     })
     .catch(e => console.error("Error refreshing weather:", e));
 }
 
+// Pakeičiame DOM tik tada, kai HTML tikrai pasikeitė
+const renderedHtml = new WeakMap();
+function setHtmlIfChanged(el, html) {
+  if (renderedHtml.get(el) !== html) {
+    renderedHtml.set(el, html);
+    el.innerHTML = html;
+  }
+}
+
+function renderWeather(d) {
+  let overlay = document.getElementById('weather-overlay');
+  if (!overlay) return;
+
+  let html = "";
+  d.daily.forEach(day => {
+    let dt = new Date(day.dt * 1000);
+    let weekday = dt.toLocaleString('en-US', { weekday: 'short' });
+    let code = day.weather[0].description;
+    let tempMin = Math.round(day.main.temp_min);
+    let tempMax = Math.round(day.main.temp_max);
+
+    // Sudedame vieno dienos "stulpelio" HTML
+    let iconUrl = `/static/meteo-icons/day/${code}.png`;
+    html += `
+      <div style="text-align: center; border-right: 1px solid rgba(255,255,255,0.3); padding: 0 10px;">
+        <div style="font-size: 1em; font-weight: bold; margin-bottom: 0px;">${weekday}</div>
+        <div><img src="${iconUrl}" alt="${code}" style="width: 60px; height: 60px;" /></div>
+        <div style="font-size: 1.2em;">${tempMin}° / ${tempMax}°</div>
+      </div>
+    `;
+  });
+  setHtmlIfChanged(overlay, html);
+}
+
 /* ========================
    DISCORD ŽINUČIŲ ATNAUJINIMAS
    ======================== */
+let lastDiscordMessages = null;
+
 function updateDiscordMessages() {
   fetch('/discordmessages')
     .then(r => r.json())
-    .then(d => {
-      let overlay = document.getElementById('discord-overlay');
-      if (!overlay) return;
-
-      let html = "";
-      const sixHoursAgo = Date.now() - 6 * 3600 * 1000;
-      // Imame tik paskutines 6 val. žinutes
-      const recentMessages = d.filter(msg => new Date(msg.timestamp) >= sixHoursAgo);
-
-      if (recentMessages.length > 0) {
-        // Imame tik 10 naujausių
-        const lastMessages = recentMessages.slice(0, 10).reverse();
-        lastMessages.forEach(msg => {
-          const msgTime = new Date(msg.timestamp);
-          // +2 val. (paprasta korekcija, neatsižvelgiant į DST)
-          msgTime.setHours(msgTime.getHours() + 2);
-
-          const hh = String(msgTime.getHours()).padStart(2, '0');
-          const mm = String(msgTime.getMinutes()).padStart(2, '0');
-
-          const shortUsername = msg.author.username.substring(0, 2);
-          const usernameColor = msg.color;
-
-          html += `
-            <div style="margin-bottom: 10px; font-size: 1em;">
-              ${hh}:${mm}
-              <strong style="background-color: ${usernameColor};"> ${shortUsername}: </strong>
-              ${msg.content}
-            </div>
-          `;
-        });
-      } else {
-        html = "<div>No new messages in channel</div>";
-      }
-      overlay.innerHTML = html;
-    })
+    .then(d => renderDiscordMessages(d))
     .catch(e => {
       console.error("Error fetching Discord messages:", e);
       let overlay = document.getElementById('discord-overlay');
@@ -274,21 +464,90 @@ function updateDiscordMessages() {
     });
 }
 
+function renderDiscordMessages(d) {
+  if (!Array.isArray(d)) {
+    console.error("Discord messages error:", d && d.error);
+    return;
+  }
+  lastDiscordMessages = d;
+  let overlay = document.getElementById('discord-overlay');
+  if (!overlay) return;
+
+  let html = "";
+  const sixHoursAgo = Date.now() - 6 * 3600 * 1000;
+  // Imame tik paskutines 6 val. žinutes
+  const recentMessages = d.filter(msg => new Date(msg.timestamp) >= sixHoursAgo);
+
+  if (recentMessages.length > 0) {
+    // Imame tik 10 naujausių
+    const lastMessages = recentMessages.slice(0, 10).reverse();
+    lastMessages.forEach(msg => {
+      const msgTime = new Date(msg.timestamp);
+      // +2 val. (paprasta korekcija, neatsižvelgiant į DST)
+      msgTime.setHours(msgTime.getHours() + 2);
+
+      const hh = String(msgTime.getHours()).padStart(2, '0');
+      const mm = String(msgTime.getMinutes()).padStart(2, '0');
+
+      const shortUsername = msg.author.username.substring(0, 2);
+      const usernameColor = msg.color;
+
+      html += `
+        <div style="margin-bottom: 10px; font-size: 1em;">
+          ${hh}:${mm}
+          <strong style="background-color: ${usernameColor};"> ${shortUsername}: </strong>
+          ${msg.content}
+        </div>
+      `;
+    });
+  } else {
+    html = "<div>No new messages in channel</div>";
+  }
+  setHtmlIfChanged(overlay, html);
+}
+
 /* ========================
    KALENDORIAUS ATNAUJINIMAS
    ======================== */
-function updateCalendarEvents() {
-  fetch('/calendarevents')
-    .then(r => r.text())
-    .then(html => {
-      let container = document.getElementById('calendar-container');
-      if (container) {
-        container.innerHTML = html;
+// Siunčiame turimą versiją: serveris grąžina tik pasikeitusius langelius arba 304
+function updateCalendarEvents(full) {
+  let container = document.getElementById('calendar-container');
+  let table = container && container.querySelector('.calendar-table');
+  let since = (!full && table) ? table.dataset.version : '';
+  fetch('/calendarevents' + (since ? '?since=' + encodeURIComponent(since) : ''))
+    .then(r => {
+      if (r.status === 304) {
+        return;
+      }
+      if ((r.headers.get('Content-Type') || '').includes('application/json')) {
+        return r.json().then(patchCalendarCells);
       }
+      // Visa lentelė: nauja diena arba kitas savaičių skaičius
+      return r.text().then(html => {
+        if (container) {
+          container.innerHTML = html;
+        }
+      });
     })
     .catch(e => console.error('Error fetching calendar events:', e));
 }
 
+// Pakeičiame tik nurodytų dienų langelius, likusi lentelė neperpiešiama
+function patchCalendarCells(d) {
+  let table = document.querySelector('#calendar-container .calendar-table');
+  if (!table) {
+    return updateCalendarEvents(true);
+  }
+  for (const [day, html] of Object.entries(d.cells)) {
+    let cell = table.querySelector('td[data-day="' + day + '"]');
+    if (!cell) {
+      return updateCalendarEvents(true);
+    }
+    cell.outerHTML = html;
+  }
+  table.dataset.version = d.version;
+}
+
 /* ========================
    ŠIANDIENOS ĮVYKIŲ FRAGMENTAS
    ======================== */
@@ -312,46 +571,7 @@ function updateSensorOverlay() {
   // Naudojame window.location.origin kad veiktų su bet kokiu hostu
   fetch(window.location.origin + '/newsensors')
     .then(r => r.json())
-    .then(d => {
-      let sensorDiv = document.getElementById('sensor-data');
-      if (!sensorDiv) return;
-
-      if (d.error) {
-        // Show error but still display CPU temp if available
-        let errorText = "Sensors error: " + d.error;
-        if (d.cpu_temp) {
-          const cpuColor = getTempColor(d.cpu_temp);
-          errorText += ` | <span style="color:${cpuColor}">${d.cpu_temp.toFixed(1)}°C</span>`;
-        }
-        sensorDiv.innerHTML = errorText;
-      } else {
-        // Show both environmental sensor and CPU temperature
-        let sensorText = "";
-        
-        // Add environmental temperature and humidity if available
-        if (d.temperature !== undefined && d.humidity !== undefined) {
-          sensorText = `${d.temperature}°C - ${d.humidity}%`;
-        }
-        
-        // Add CPU temperature if available with color coding
-        if (d.cpu_temp !== undefined) {
-          const cpuColor = getTempColor(d.cpu_temp);
-          if (sensorText) {
-            sensorText += ` | <span style="color:${cpuColor}">${d.cpu_temp.toFixed(1)}°C</span>`;
-          } else {
-            sensorText = `<span style="color:${cpuColor}">${d.cpu_temp.toFixed(1)}°C</span>`;
-          }
-        }
-        
-        // If we have no data at all
-        if (!sensorText) {
-          sensorText = "No sensor data available";
-        }
-        
-        console.log("Sensor data updated:", sensorText); // Debug log
-        sensorDiv.innerHTML = sensorText;
-      }
-    })
+    .then(d => renderSensorOverlay(d))
     .catch(e => {
       console.error("Error fetching sensor data:", e);
       let sensorDiv = document.getElementById('sensor-data');
@@ -359,6 +579,82 @@ function updateSensorOverlay() {
     });
 }
 
+function renderSensorOverlay(d) {
+  let sensorDiv = document.getElementById('sensor-data');
+  if (!sensorDiv) return;
+
+  if (d.error) {
+    // Show error but still display CPU temp if available
+    let errorText = "Sensors error: " + d.error;
+    if (d.cpu_temp) {
+      const cpuColor = getTempColor(d.cpu_temp);
+      errorText += ` | <span style="color:${cpuColor}">${d.cpu_temp.toFixed(1)}°C</span>`;
+    }
+    setHtmlIfChanged(sensorDiv, errorText);
+  } else {
+    // Show both environmental sensor and CPU temperature
+    let sensorText = "";
+    
+    // Add environmental temperature and humidity if available
+    if (d.temperature !== undefined && d.humidity !== undefined) {
+      sensorText = `${d.temperature}°C - ${d.humidity}%`;
+    }
+    
+    // Add CPU temperature if available with color coding
+    if (d.cpu_temp !== undefined) {
+      const cpuColor = getTempColor(d.cpu_temp);
+      if (sensorText) {
+        sensorText += ` | <span style="color:${cpuColor}">${d.cpu_temp.toFixed(1)}°C</span>`;
+      } else {
+        sensorText = `<span style="color:${cpuColor}">${d.cpu_temp.toFixed(1)}°C</span>`;
+      }
+    }
+    
+    // If we have no data at all
+    if (!sensorText) {
+      sensorText = "No sensor data available";
+    }
+    
+    setHtmlIfChanged(sensorDiv, sensorText);
+  }
+}
+
+/* ========================
+   SERVERIO ĮVYKIŲ SRAUTAS (SSE)
+   ======================== */
+// Serveris siunčia atnaujinimus tik kai duomenys pasikeičia
+function connectStream() {
+  const source = new EventSource('/stream');
+
+  source.addEventListener('weather', e => renderWeather(JSON.parse(e.data)));
+  source.addEventListener('discord', e => renderDiscordMessages(JSON.parse(e.data)));
+  source.addEventListener('calendar', () => updateCalendarEvents());
+  source.addEventListener('today', () => updateTodayEvents());
+  source.addEventListener('sensors', e => renderSensorOverlay(JSON.parse(e.data)));
+  source.addEventListener('temperature', e => {
+    const d = JSON.parse(e.data);
+    window.MEDIA_TYPES = d.current_media_type;
+    if (d.thermal) {
+      thermal = d.thermal;
+      // Sustabdome rodomą video, jei jis dabar per daug kaitina
+      if (!thermal.video && document.getElementById('current-video')) {
+        clearInterval(progressIntervalId);
+        nextMedia();
+      }
+    }
+    console.log("Temperature override:", d.override_active, "media types:", d.current_media_type,
+                "thermal level:", d.thermal && d.thermal.name);
+  });
+
+  source.onerror = () => {
+    // Naršyklė jungiasi iš naujo pati, nebent srautas uždarytas visam laikui
+    if (source.readyState === EventSource.CLOSED) {
+      console.warn("Stream closed, reconnecting in 5 s");
+      setTimeout(connectStream, 5000);
+    }
+  };
+}
+
 // Helper function to get color based on temperature
 function getTempColor(temp) {
   if (temp < 60) return "#4CAF50"; // Green (normal)
@@ -391,29 +687,44 @@ function updateSchedule() {
    PRADINIS PUSLAPIO UŽKROVIMAS
    ======================== */
 document.addEventListener('DOMContentLoaded', () => {
-  // 1) Nuotraukos (jei jau turime batch iš serverio)
+  // Išsaugome ekrano dydį kitam puslapio užkrovimui
+  screenParams();
+
+  // 1) Nuotraukos (jei jau turime batch iš serverio, kitaip - parsisiunčiame)
   if (currentBatch.length > 0) {
     showMedia(currentBatch[0]);
-    startProgressBar();
+  } else {
+    updatePhotoBatch();
   }
 
-  // 2) Orų atnaujinimas
-  updateWeather();
-  setInterval(updateWeather, WEATHER_REFRESH_INTERVAL * 1000);
-
-  // 3) Discord žinutės
-  updateDiscordMessages();
-  setInterval(updateDiscordMessages, 60000);
-
-  // 4) Kalendoriaus fragmentas
-  setInterval(updateCalendarEvents, 60000);
-
-  // 5) Šiandienos įvykių fragmentas
-  setInterval(updateTodayEvents, 60000);
+  // Serveris atvaizdavo vietos rezervavimo blokus lėtiems šaltiniams
+  const pending = window.PENDING_SOURCES || [];
+  if (pending.includes('calendar')) {
+    updateCalendarEvents();
+    updateTodayEvents();
+  }
+  if (pending.includes('weather')) {
+    updateWeather();
+  }
 
-  // 6) Sensorių overlay
-  updateSensorOverlay();
-  setInterval(updateSensorOverlay, 60000);
+  // 2-6) Orai, Discord, kalendorius, šiandienos įvykiai ir sensoriai
+  if (window.EventSource) {
+    // Serveris atsiunčia dabartinę būseną iškart prisijungus
+    connectStream();
+    // Senesnės nei 6 val. žinutės dingsta be naujų duomenų
+    pollEvery(() => {
+      if (lastDiscordMessages) renderDiscordMessages(lastDiscordMessages);
+    }, 60000);
+  } else {
+    updateWeather();
+    pollEvery(updateWeather, WEATHER_REFRESH_INTERVAL * 1000);
+    updateDiscordMessages();
+    pollEvery(updateDiscordMessages, 60000);
+    pollEvery(updateCalendarEvents, 60000);
+    pollEvery(updateTodayEvents, 60000);
+    updateSensorOverlay();
+    pollEvery(updateSensorOverlay, 60000);
+  }
 
   // 7) Laikrodis ir data
   updateSchedule();
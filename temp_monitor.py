@@ -3,6 +3,8 @@ import time
 import logging
 import threading
 import subprocess
+from array import array
+from collections import deque
 from datetime import datetime
 
 # Create logger
@@ -13,6 +15,110 @@ logging.basicConfig(
 
 logger = logging.getLogger('temp_monitor')
 
+HISTORY_SECONDS = 24 * 60 * 60  # Keep only the last 24 hours
+
+
+class TempHistory:
+    """Fixed-size ring buffer of temperature readings.
+
+    Timestamps and values live in two preallocated array('d') columns, so
+    appending and evicting are O(1) and allocate nothing.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        self.start = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, value, max_age=HISTORY_SECONDS):
+        """Adds a reading and drops readings older than max_age seconds"""
+        with self.lock:
+            if self.count == self.capacity:
+                # Full: overwrite the oldest reading
+                self.start = (self.start + 1) % self.capacity
+                self.count -= 1
+            pos = (self.start + self.count) % self.capacity
+            self.times[pos] = timestamp
+            self.values[pos] = value
+            self.count += 1
+            cutoff = timestamp - max_age
+            while self.count and self.times[self.start] <= cutoff:
+                self.start = (self.start + 1) % self.capacity
+                self.count -= 1
+
+    def _time_at(self, i):
+        return self.times[(self.start + i) % self.capacity]
+
+    def _first_at_or_after(self, timestamp):
+        """Index (0 = oldest) of the first reading not older than timestamp"""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._time_at(mid) < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def last(self, n):
+        """Returns the newest n readings as (timestamp, value) tuples, oldest first"""
+        with self.lock:
+            n = min(n, self.count)
+            return [(self._time_at(i), self.values[(self.start + i) % self.capacity])
+                    for i in range(self.count - n, self.count)]
+
+    def downsample(self, since, until, buckets):
+        """Aggregates readings between since and until into equal time buckets.
+
+        Returns a list of (bucket start, min, max, avg, count); empty buckets are skipped.
+        """
+        width = (until - since) / buckets
+        mins = [None] * buckets
+        maxs = [None] * buckets
+        sums = [0.0] * buckets
+        counts = [0] * buckets
+        with self.lock:
+            for i in range(self._first_at_or_after(since), self.count):
+                pos = (self.start + i) % self.capacity
+                t = self.times[pos]
+                if t >= until:
+                    break
+                b = min(int((t - since) / width), buckets - 1)
+                v = self.values[pos]
+                if counts[b] == 0 or v < mins[b]:
+                    mins[b] = v
+                if counts[b] == 0 or v > maxs[b]:
+                    maxs[b] = v
+                sums[b] += v
+                counts[b] += 1
+        return [(since + b * width, mins[b], maxs[b], sums[b] / counts[b], counts[b])
+                for b in range(buckets) if counts[b]]
+
+    def trend(self, seconds, now):
+        """Returns the temperature change in °C per minute over the last given seconds"""
+        with self.lock:
+            first = self._first_at_or_after(now - seconds)
+            points = [(self._time_at(i), self.values[(self.start + i) % self.capacity])
+                      for i in range(first, self.count)]
+        # Too short a span to tell a trend from noise
+        if len(points) < 2 or points[-1][0] - points[0][0] < seconds / 2:
+            return 0.0
+        # Least squares slope, less jumpy than comparing the first and last reading
+        mean_t = sum(t for t, _ in points) / len(points)
+        mean_v = sum(v for _, v in points) / len(points)
+        variance = sum((t - mean_t) ** 2 for t, _ in points)
+        if variance == 0:
+            return 0.0
+        covariance = sum((t - mean_t) * (v - mean_v) for t, v in points)
+        return covariance / variance * 60
+
+
 class TemperatureMonitor:
     def __init__(self, config):
         self.config = config
@@ -21,8 +127,46 @@ class TemperatureMonitor:
         self.original_media_type = config.MEDIA_TYPES
         self.override_active = False
         self.last_temp = 0
-        self.temp_history = []
+        # Room for 24 hours of readings plus some slack for timing jitter
+        self.temp_history = TempHistory(HISTORY_SECONDS // max(1, config.TEMP_CHECK_INTERVAL) + 16)
         self.start_time = datetime.now()
+        self.listeners = []
+        self.level_listeners = []
+        self.level = 0
+        self.trend = 0.0
+        self.transitions = deque(maxlen=20)
+
+    def add_listener(self, callback):
+        """Registers a callback called with the new MEDIA_TYPES value when it changes"""
+        self.listeners.append(callback)
+
+    def add_level_listener(self, callback):
+        """Registers a callback called with the new thermal level settings when the level changes"""
+        self.level_listeners.append(callback)
+
+    def thermal_level(self):
+        """Returns the settings of the current thermal level"""
+        return self.config.THERMAL_LEVELS[self.level]
+
+    def thermal_state(self):
+        """Returns the current thermal level for the front end"""
+        level = self.thermal_level()
+        return {
+            'level': self.level,
+            'name': level['NAME'],
+            'image_scale': level['IMAGE_SCALE'],
+            'poll_factor': level['POLL_FACTOR'],
+            'video': level['VIDEO'],
+            'prefetch_depth': level['PREFETCH_DEPTH']
+        }
+
+    def notify_media_type_change(self):
+        """Tells listeners that MEDIA_TYPES changed"""
+        for callback in self.listeners:
+            try:
+                callback(self.config.MEDIA_TYPES)
+            except Exception as e:
+                logger.error(f"Error in media type listener: {e}")
         
     def get_cpu_temperature(self):
         """Gets CPU temperature on Raspberry Pi"""
@@ -47,17 +191,80 @@ class TemperatureMonitor:
     
     def log_temperature(self, temp):
         """Records temperature in history"""
-        self.temp_history.append((datetime.now(), temp))
-        # Keep only the last 24 hours
-        cutoff = datetime.now().timestamp() - 24 * 60 * 60
-        self.temp_history = [entry for entry in self.temp_history if entry[0].timestamp() > cutoff]
+        self.temp_history.append(time.time(), temp)
         self.last_temp = temp
+
+    def get_history(self, seconds, buckets):
+        """Returns min/max/avg of the readings in the last given seconds, in equal buckets"""
+        now = time.time()
+        since = now - seconds
+        return {
+            'start': datetime.fromtimestamp(since).isoformat(),
+            'end': datetime.fromtimestamp(now).isoformat(),
+            'bucket_seconds': seconds / buckets,
+            'buckets': [{
+                'time': datetime.fromtimestamp(t).isoformat(),
+                'min': round(lo, 2),
+                'max': round(hi, 2),
+                'avg': round(avg, 2),
+                'count': count
+            } for t, lo, hi, avg, count in self.temp_history.downsample(since, now, buckets)]
+        }
     
+    def govern(self, temp):
+        """Moves the thermal level with the temperature and its trend. Returns True if it changed."""
+        levels = self.config.THERMAL_LEVELS
+        self.trend = self.temp_history.trend(self.config.THERMAL_TREND_WINDOW, time.time())
+        # A rising temperature is acted on before it gets there
+        projected = temp + max(self.trend, 0) * self.config.THERMAL_TREND_LOOKAHEAD / 60
+
+        level = self.level
+        while level + 1 < len(levels) and projected >= levels[level + 1]['TEMP']:
+            level += 1
+        # Cool down one step at a time, and only once clearly below the level
+        if (level == self.level and level > 0 and self.trend <= 0
+                and temp <= levels[level]['TEMP'] - self.config.THERMAL_HYSTERESIS):
+            level -= 1
+        if level == self.level:
+            return False
+
+        log = logger.warning if level > self.level else logger.info
+        log(f"Temperature {temp}°C (trend {self.trend:+.2f}°C/min): thermal level "
+            f"{levels[self.level]['NAME']} -> {levels[level]['NAME']}")
+        self.transitions.append({
+            'time': datetime.now().isoformat(),
+            'from': levels[self.level]['NAME'],
+            'to': levels[level]['NAME'],
+            'temp': temp,
+            'trend': round(self.trend, 2)
+        })
+        self.level = level
+        self.apply_video_setting()
+        for callback in self.level_listeners:
+            try:
+                callback(levels[level])
+            except Exception as e:
+                logger.error(f"Error in thermal level listener: {e}")
+        return True
+
+    def apply_video_setting(self):
+        """Switches to photo-only mode while the thermal level pauses videos"""
+        if not self.thermal_level()['VIDEO'] and not self.override_active:
+            # Save original setting
+            self.original_media_type = self.config.MEDIA_TYPES
+            # Switch to photo-only mode
+            self.config.MEDIA_TYPES = "photo"
+            self.override_active = True
+            self.notify_media_type_change()
+        elif self.thermal_level()['VIDEO'] and self.override_active:
+            # Restore original setting
+            self.config.MEDIA_TYPES = self.original_media_type
+            self.override_active = False
+            self.notify_media_type_change()
+
     def handle_temperature(self, temp):
         """Handles temperature logic and protection"""
-        from app import app  # Import here to avoid circular import
-        
-        if not hasattr(self.config, 'TEMP_WARNING') or not hasattr(self.config, 'TEMP_CRITICAL'):
+        if not hasattr(self.config, 'THERMAL_LEVELS') or not hasattr(self.config, 'TEMP_CRITICAL'):
             logger.warning("Temperature limits not set in config file")
             return
             
@@ -76,21 +283,9 @@ class TemperatureMonitor:
             except Exception as e:
                 logger.error(f"Failed to reboot: {e}")
         
-        # If temperature is above warning limit, switch to photo mode
-        elif temp >= self.config.TEMP_WARNING and not self.override_active:
-            logger.warning(f"Temperature reached {temp}°C. Switching to photo-only mode.")
-            # Save original setting
-            self.original_media_type = self.config.MEDIA_TYPES
-            # Switch to photo-only mode
-            self.config.MEDIA_TYPES = "photo"
-            self.override_active = True
-            
-        # If temperature dropped, return to original mode
-        elif temp <= self.config.TEMP_RECOVERY and self.override_active:
-            logger.info(f"Temperature dropped to {temp}°C. Returning to normal mode.")
-            # Restore original setting
-            self.config.MEDIA_TYPES = self.original_media_type
-            self.override_active = False
+        # Otherwise scale the workload to the temperature
+        else:
+            self.govern(temp)
     
     def monitor_loop(self):
         """Main monitoring loop"""
@@ -139,5 +334,9 @@ class TemperatureMonitor:
             'original_media_type': self.original_media_type,
             'current_media_type': self.config.MEDIA_TYPES,
             'uptime': str(datetime.now() - self.start_time),
-            'temp_history': [(t[0].isoformat(), t[1]) for t in self.temp_history[-10:]]  # Last 10 records
+            'thermal_level': self.thermal_level()['NAME'],
+            'trend': round(self.trend, 2),  # °C per minute
+            'thermal_transitions': list(self.transitions),
+            'temp_history': [(datetime.fromtimestamp(t).isoformat(), v)
+                             for t, v in self.temp_history.last(10)]  # Last 10 records
         } 
\ No newline at end of file
@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+import subprocess
+from collections import OrderedDict, deque
+
+logger = logging.getLogger('video_cache')
+
+INDEX_FILE = 'index.json'
+
+
+class VideoCache:
+    """Size-capped cache of videos transcoded for software decoding on the Pi"""
+
+    def __init__(self, config, directory):
+        self.config = config
+        self.directory = directory
+        self.lock = threading.Lock()
+        # key -> {'file', 'size'}, least recently used first
+        self.entries = OrderedDict()
+        self.total_size = 0
+        self.pending = deque()
+        self.wakeup = threading.Event()
+        self.running = False
+        self.thread = None
+        # Set by the thermal governor while videos are not shown
+        self.paused = False
+        self.ffmpeg = shutil.which('ffmpeg')
+        self.process = None
+        self.resolve_base_url = None
+        self.transcoded = 0
+        self.failures = 0
+        self.last_error = None
+
+    def open(self):
+        """Creates the cache directory and loads its index"""
+        os.makedirs(self.directory, exist_ok=True)
+        self.load_index()
+
+    def profile(self):
+        """Transcode settings; files made with other settings are not used"""
+        return (f"{self.config.VIDEO_TRANSCODE_WIDTH}x{self.config.VIDEO_TRANSCODE_HEIGHT}-"
+                f"{self.config.VIDEO_TRANSCODE_BITRATE}-{self.config.VIDEO_DURATION}s")
+
+    def cache_key(self, item_id):
+        return f"{item_id}@{self.profile()}"
+
+    # ------------------------------------------------------------------
+    # Index persistence
+    # ------------------------------------------------------------------
+
+    def index_path(self):
+        return os.path.join(self.directory, INDEX_FILE)
+
+    def load_index(self):
+        """Loads the cache index, ignoring entries whose files are gone"""
+        try:
+            with open(self.index_path(), 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = []
+        for key, entry in saved:
+            if os.path.exists(os.path.join(self.directory, entry['file'])):
+                self.entries[key] = entry
+                self.total_size += entry['size']
+        # Transcodes interrupted by a restart
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp.mp4'):
+                os.remove(os.path.join(self.directory, name))
+        logger.info(f"Video cache: {len(self.entries)} files, {self.total_size / 1048576:.1f} MB")
+
+    def save_index(self):
+        """Writes the index atomically, in LRU order (caller holds the lock)"""
+        tmp_path = self.index_path() + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(list(self.entries.items()), f)
+            os.replace(tmp_path, self.index_path())
+        except OSError as e:
+            logger.error(f"Error saving video cache index: {e}")
+
+    # ------------------------------------------------------------------
+    # Cached files
+    # ------------------------------------------------------------------
+
+    def lookup(self, item_id):
+        """Returns the path of a transcoded video, or None"""
+        key = self.cache_key(item_id)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                self.entries.move_to_end(key)
+        if not entry:
+            return None
+        return os.path.join(self.directory, entry['file'])
+
+    def store(self, key, filename):
+        """Adds a finished file to the index and evicts least recently used files"""
+        size = os.path.getsize(os.path.join(self.directory, filename))
+        evicted = []
+        with self.lock:
+            self.entries[key] = {'file': filename, 'size': size}
+            self.total_size += size
+            while self.total_size > self.config.VIDEO_CACHE_MAX_BYTES and len(self.entries) > 1:
+                old_key, old_entry = self.entries.popitem(last=False)
+                self.total_size -= old_entry['size']
+                evicted.append(old_entry['file'])
+            self.save_index()
+        for old_file in evicted:
+            try:
+                os.remove(os.path.join(self.directory, old_file))
+            except OSError:
+                pass
+        if evicted:
+            logger.info(f"Evicted {len(evicted)} files from video cache")
+
+    # ------------------------------------------------------------------
+    # Transcoding
+    # ------------------------------------------------------------------
+
+    def enqueue(self, item_id):
+        """Queues a video for transcoding unless it is cached or already queued.
+
+        Only the id is queued: a job can wait longer than a baseUrl lives, so
+        the url is resolved when the transcode starts.
+        """
+        if not self.ffmpeg or self.lookup(item_id):
+            return False
+        with self.lock:
+            if item_id in self.pending:
+                return False
+            if len(self.pending) >= self.config.VIDEO_CACHE_QUEUE_SIZE:
+                # Upcoming videos matter more than old ones
+                self.pending.popleft()
+            self.pending.append(item_id)
+        self.wakeup.set()
+        return True
+
+    def ffmpeg_command(self, source, target):
+        width = self.config.VIDEO_TRANSCODE_WIDTH
+        height = self.config.VIDEO_TRANSCODE_HEIGHT
+        bitrate = self.config.VIDEO_TRANSCODE_BITRATE
+        return [
+            self.ffmpeg, '-nostdin', '-loglevel', 'error', '-y',
+            '-i', source,
+            # Only what is shown, ffmpeg stops reading the source there
+            '-t', str(self.config.VIDEO_DURATION),
+            '-vf', (f"scale=w='min({width},iw)':h='min({height},ih)':force_original_aspect_ratio=decrease,"
+                    f"scale=trunc(iw/2)*2:trunc(ih/2)*2"),
+            '-c:v', 'libx264', '-preset', 'veryfast', '-profile:v', 'main', '-pix_fmt', 'yuv420p',
+            '-b:v', bitrate, '-maxrate', bitrate, '-bufsize', bitrate,
+            '-c:a', 'aac', '-b:a', '128k',
+            '-threads', str(self.config.VIDEO_TRANSCODE_THREADS),
+            # Index at the front so playback and Range requests start right away
+            '-movflags', '+faststart',
+            target
+        ]
+
+    def transcode(self, item_id, base_url):
+        """Transcodes one video from its download url. Returns True on success."""
+        key = self.cache_key(item_id)
+        filename = hashlib.sha1(key.encode('utf-8')).hexdigest() + '.mp4'
+        path = os.path.join(self.directory, filename)
+        tmp_path = path + '.tmp.mp4'
+        started = time.time()
+        self.process = subprocess.Popen(
+            self.ffmpeg_command(f"{base_url}=dv", tmp_path),
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+        )
+        # Leave the CPU to the browser. Set from here: a preexec_fn is not
+        # safe to run in a fork of this multi-threaded process.
+        try:
+            os.setpriority(os.PRIO_PROCESS, self.process.pid, 10)
+        except OSError:
+            pass
+        try:
+            _, stderr = self.process.communicate(timeout=self.config.VIDEO_TRANSCODE_TIMEOUT)
+            ok = self.process.returncode == 0
+            error = stderr.strip()[-500:] or f"ffmpeg exited with {self.process.returncode}"
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.communicate()
+            ok = False
+            error = f"Transcode of {item_id} timed out"
+        finally:
+            self.process = None
+        if not ok:
+            self.last_error = error
+            self.failures += 1
+            logger.warning(f"Video transcode failed for {item_id}: {self.last_error}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+
+        os.replace(tmp_path, path)
+        self.store(key, filename)
+        self.transcoded += 1
+        logger.info(f"Transcoded video {item_id} in {time.time() - started:.1f}s")
+        return True
+
+    def transcode_loop(self):
+        """Main transcode loop, one video at a time"""
+        logger.info("Video transcoding started")
+        while self.running:
+            with self.lock:
+                item_id = self.pending.popleft() if self.pending and not self.paused else None
+            if item_id is None:
+                self.wakeup.wait(60)
+                self.wakeup.clear()
+                continue
+            if self.lookup(item_id):
+                continue
+            try:
+                base_url = self.resolve_base_url(item_id)
+                if not base_url:
+                    logger.info(f"No download url for video {item_id}, skipping")
+                    continue
+                self.transcode(item_id, base_url)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                logger.error(f"Error transcoding video {item_id}: {e}")
+
+    def start(self, resolve_base_url):
+        """Starts transcoding in a separate thread.
+
+        resolve_base_url(item_id) returns a baseUrl that has not expired, or None.
+        """
+        if not self.ffmpeg:
+            logger.info("ffmpeg not found, videos are played from Google Photos")
+            return False
+
+        if self.running:
+            logger.warning("Video transcoding already running")
+            return False
+
+        self.resolve_base_url = resolve_base_url
+        self.running = True
+        self.thread = threading.Thread(target=self.transcode_loop, daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        """Stops transcoding after the current video"""
+        if not self.running:
+            return
+
+        self.running = False
+        self.wakeup.set()
+        process = self.process
+        if process:
+            process.terminate()
+        if self.thread:
+            self.thread.join(2.0)  # Wait max 2 seconds
+        logger.info("Video transcoding stopped")
+
+    def get_status(self):
+        """Returns cache and transcoder status as a dictionary"""
+        with self.lock:
+            files = len(self.entries)
+            queued = len(self.pending)
+        return {
+            'running': self.running,
+            'ffmpeg': bool(self.ffmpeg),
+            'paused': self.paused,
+            'files': files,
+            'size': f"{self.total_size / 1048576:.1f} MB",
+            'max_size': f"{self.config.VIDEO_CACHE_MAX_BYTES / 1048576:.1f} MB",
+            'queued': queued,
+            'transcoded': self.transcoded,
+            'failures': self.failures,
+            'last_error': self.last_error
+        }
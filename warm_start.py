@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger('warm_start')
+
+# Reboot-to-first-photo measurements kept in the snapshot
+FIRST_PHOTO_HISTORY = 10
+
+
+def system_uptime():
+    """Seconds since boot, or None where /proc/uptime is not available"""
+    try:
+        with open('/proc/uptime', 'r') as f:
+            return float(f.readline().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class WarmStart:
+    """Last good state of the screen on disk, served right after a restart
+    while the live sources catch up in the background"""
+
+    def __init__(self, config, path):
+        self.config = config
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = {}
+        self.dirty = False
+        self.running = False
+        self.thread = None
+        self.wakeup = threading.Event()
+        self.started_at = time.time()
+        self.uptime_at_start = system_uptime()
+        self.batch_taken = False
+        self.first_photo = None
+        self.saves = 0
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                self.data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable warm start snapshot: {e}")
+            return
+        logger.info(f"Loaded warm start snapshot: {', '.join(sorted(self.data))}")
+
+    def save(self):
+        """Writes the snapshot atomically if anything changed"""
+        with self.lock:
+            if not self.dirty:
+                return
+            content = json.dumps(self.data)
+            self.dirty = False
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(content)
+            os.replace(tmp_path, self.path)
+            self.saves += 1
+        except OSError as e:
+            logger.error(f"Error saving warm start snapshot: {e}")
+
+    def get(self, name):
+        with self.lock:
+            return self.data.get(name)
+
+    def update(self, name, value):
+        """Replaces one part of the snapshot; it reaches the disk with the next save"""
+        # A copy, the live objects keep changing
+        value = json.loads(json.dumps(value, default=str))
+        with self.lock:
+            if self.data.get(name) != value:
+                self.data[name] = value
+                self.dirty = True
+
+    def take_batch(self):
+        """Returns the saved photo batch once per run, for the first page after a restart"""
+        with self.lock:
+            if self.batch_taken:
+                return None
+            self.batch_taken = True
+            return self.data.get('batch')
+
+    def first_display(self, shown_at):
+        """Records how long the first photo of this run took to appear"""
+        with self.lock:
+            if self.first_photo is not None:
+                return
+            uptime = system_uptime()
+            measurement = {
+                'at': shown_at,
+                'since_start': round(shown_at - self.started_at, 1),
+                'since_boot': None
+            }
+            # Only a start right after boot measures a reboot
+            if (uptime is not None and self.uptime_at_start is not None
+                    and self.uptime_at_start < self.config.WARM_START_BOOT_WINDOW):
+                measurement['since_boot'] = round(uptime - (time.time() - shown_at), 1)
+            self.first_photo = measurement
+            history = self.data.get('first_photos', [])[-(FIRST_PHOTO_HISTORY - 1):]
+            self.data['first_photos'] = history + [measurement]
+            self.dirty = True
+        self.wakeup.set()
+        logger.info(f"First photo {measurement['since_start']}s after start, "
+                    f"{measurement['since_boot']}s after boot "
+                    f"(target {self.config.WARM_START_FIRST_PHOTO_TARGET}s)")
+
+    def save_loop(self):
+        """Main save loop"""
+        logger.info("Warm start snapshots started")
+        while self.running:
+            self.wakeup.wait(self.config.WARM_START_SAVE_INTERVAL)
+            self.wakeup.clear()
+            self.save()
+
+    def start(self):
+        """Starts saving in a separate thread"""
+        if self.running:
+            logger.warning("Warm start snapshots already running")
+            return False
+
+        self.running = True
+        self.thread = threading.Thread(target=self.save_loop, daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        """Stops saving after writing the latest state"""
+        if not self.running:
+            return
+
+        self.running = False
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(2.0)  # Wait max 2 seconds
+        self.save()
+        logger.info("Warm start snapshots stopped")
+
+    def get_status(self):
+        """Returns snapshot contents and first photo timing as a dictionary"""
+        target = self.config.WARM_START_FIRST_PHOTO_TARGET
+        with self.lock:
+            first_photo = self.first_photo
+            history = list(self.data.get('first_photos', []))
+            parts = sorted(name for name in self.data if name != 'first_photos')
+        reboots = [m['since_boot'] for m in history if m.get('since_boot') is not None]
+        return {
+            'running': self.running,
+            'parts': parts,
+            'saves': self.saves,
+            'first_photo': first_photo,
+            'first_photo_target': target,
+            'target_met': (first_photo['since_boot'] <= target
+                           if first_photo and first_photo['since_boot'] is not None else None),
+            'recent_reboots': reboots
+        }
@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import datetime
+import logging
+import threading
+
+import metrics
+from event_bus import ChangeNotifier
+
+logger = logging.getLogger('weather')
+
+
+def parse_meteo_lt_time(dt_str):
+    fmts = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%SZ"]
+    for fmt in fmts:
+        try:
+            return datetime.datetime.strptime(dt_str, fmt)
+        except ValueError:
+            pass
+    raise ValueError(f"Bad time format: {dt_str}")
+
+
+def build_rollups(forecasts, days=7, hours=24):
+    """Builds the daily and hourly views from meteo.lt forecastTimestamps.
+
+    Each timestamp is parsed exactly once.
+    """
+    entries = [(parse_meteo_lt_time(f["forecastTimeUtc"]), f) for f in forecasts]
+
+    by_date = {}
+    for dt_obj, f in entries:
+        by_date.setdefault(dt_obj.date(), []).append((dt_obj, f))
+
+    daily_list = []
+    for date in sorted(by_date.keys())[:days]:
+        daily_entries = by_date[date]
+        temps = [f["airTemperature"] for _, f in daily_entries]
+        # Condition closest to midday represents the day
+        midday = datetime.datetime.combine(date, datetime.time(12))
+        best_dt_obj, best = min(daily_entries, key=lambda e: abs((e[0] - midday).total_seconds()))
+        daily_list.append({
+            "dt": int(best_dt_obj.timestamp()),
+            "main": {"temp_min": min(temps), "temp_max": max(temps)},
+            "weather": [{"description": best["conditionCode"]}]
+        })
+
+    hourly_list = [{
+        "dt": int(dt_obj.timestamp()),
+        "temp": f.get("airTemperature"),
+        "feels_like": f.get("feelsLikeTemperature"),
+        "precipitation": f.get("totalPrecipitation"),
+        "wind_speed": f.get("windSpeed"),
+        "weather": [{"description": f.get("conditionCode")}]
+    } for dt_obj, f in entries[:hours]]
+
+    return {"daily": daily_list, "hourly": hourly_list}
+
+
+class WeatherService(ChangeNotifier):
+    """meteo.lt forecast refreshed in the background and served from memory"""
+
+    def __init__(self, config, cache_file):
+        self.config = config
+        self.cache_file = cache_file
+        self.session = None
+        self.running = False
+        self.thread = None
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.etag = None
+        self.last_modified = None
+        self.fetched_at = None
+        self.not_modified = 0
+        self.failures = 0
+
+    def url(self):
+        return f"{self.config.METEO_API_BASE_URL}/places/{self.config.WEATHER['LOCATION']}/forecasts/long-term"
+
+    def load_snapshot(self):
+        """Loads the last good forecast from disk"""
+        try:
+            with open(self.cache_file, 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.snapshot = saved.get('weather')
+        self.etag = saved.get('etag')
+        self.last_modified = saved.get('last_modified')
+        self.fetched_at = saved.get('fetched_at')
+        logger.info("Loaded weather snapshot from disk")
+
+    def save_snapshot(self):
+        tmp_path = self.cache_file + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({
+                    'weather': self.snapshot,
+                    'etag': self.etag,
+                    'last_modified': self.last_modified,
+                    'fetched_at': self.fetched_at
+                }, f)
+            os.replace(tmp_path, self.cache_file)
+        except OSError as e:
+            logger.error(f"Error saving weather snapshot: {e}")
+
+    def http(self):
+        """HTTP session, created on first use to keep requests out of startup"""
+        if self.session is None:
+            import requests
+            self.session = requests.Session()
+        return self.session
+
+    def refresh(self):
+        """Fetches the forecast if it changed. Returns True if the snapshot changed."""
+        import requests
+        headers = {}
+        if self.snapshot is not None:
+            if self.etag:
+                headers['If-None-Match'] = self.etag
+            if self.last_modified:
+                headers['If-Modified-Since'] = self.last_modified
+        try:
+            with metrics.upstream('meteo', 'forecasts') as call:
+                r = self.http().get(self.url(), headers=headers, timeout=self.config.WEATHER_FETCH_TIMEOUT)
+                call.record(r.status_code, len(r.content))
+        except requests.RequestException as e:
+            self.failures += 1
+            logger.warning(f"meteo.lt unreachable, serving last snapshot: {e}")
+            return False
+
+        if r.status_code == 304:
+            self.not_modified += 1
+            self.fetched_at = time.time()
+            return False
+        if r.status_code != 200:
+            self.failures += 1
+            logger.warning(f"meteo.lt returned HTTP {r.status_code}, serving last snapshot")
+            return False
+
+        snapshot = build_rollups(r.json().get("forecastTimestamps", []))
+        with self.lock:
+            changed = snapshot != self.snapshot
+            self.snapshot = snapshot
+            self.etag = r.headers.get('ETag')
+            self.last_modified = r.headers.get('Last-Modified')
+            self.fetched_at = time.time()
+        self.save_snapshot()
+        if changed:
+            self.notify_change()
+        return changed
+
+    def get(self):
+        """Returns the current forecast, fetching it once if nothing is known yet"""
+        if self.snapshot is None:
+            self.refresh()
+        return self.snapshot
+
+    def refresh_loop(self):
+        """Main refresh loop"""
+        logger.info("Weather refresh started")
+        while self.running:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing weather: {e}")
+            time.sleep(self.config.WEATHER.get("REFRESH_INTERVAL", 3600))
+
+    def start(self):
+        """Starts refreshing in a separate thread"""
+        if self.running:
+            logger.warning("Weather refresh already running")
+            return False
+
+        self.running = True
+        self.thread = threading.Thread(target=self.refresh_loop, daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        """Stops refreshing"""
+        if not self.running:
+            return
+
+        self.running = False
+        if self.thread:
+            self.thread.join(2.0)  # Wait max 2 seconds
+        logger.info("Weather refresh stopped")
+
+    def get_status(self):
+        """Returns refresh status as a dictionary"""
+        return {
+            'running': self.running,
+            'fetched_at': datetime.datetime.fromtimestamp(self.fetched_at).isoformat() if self.fetched_at else None,
+            'not_modified': self.not_modified,
+            'failures': self.failures
+        }